@@ -0,0 +1,78 @@
+"""Benchmark invoice renderers: invoices/sec for small, medium and large baskets"""
+import argparse
+import time
+from datetime import datetime
+
+from utils.invoice_generator import generate_invoice_pdf
+from utils.invoice_canvas import render_invoice_pdf
+
+RENDERERS = {
+    "platypus": generate_invoice_pdf,
+    "canvas": render_invoice_pdf,
+}
+
+def sample_sale(line_count: int) -> dict:
+    """Build a realistic sale document with the given number of lines"""
+    items = []
+    for i in range(line_count):
+        quantity = (i % 5) + 1
+        unit_price = 49.5 + i
+        tax_amount = round(unit_price * quantity * 0.18, 2)
+        items.append({
+            "productId": f"product-{i}",
+            "productName": f"Sample Product {i} Family Pack",
+            "sku": f"SKU-{i:05d}",
+            "quantity": quantity,
+            "unitPrice": unit_price,
+            "discount": 5 if i % 3 == 0 else 0,
+            "discountType": "percentage" if i % 2 else "fixed",
+            "taxRate": 18,
+            "taxAmount": tax_amount,
+            "lineTotal": round(unit_price * quantity + tax_amount, 2)
+        })
+    subtotal = sum(item["unitPrice"] * item["quantity"] for item in items)
+    tax = sum(item["taxAmount"] for item in items)
+    return {
+        "id": "bench-sale",
+        "invoiceNumber": "INV-20250101-0001",
+        "saleDate": datetime(2025, 1, 1, 10, 30),
+        "customerName": "Walk-in Customer",
+        "customerPhone": "9876543210",
+        "items": items,
+        "subtotal": subtotal,
+        "discountAmount": 0,
+        "taxAmount": tax,
+        "total": subtotal + tax,
+        "amountPaid": subtotal + tax,
+        "paymentMode": "cash",
+        "paymentStatus": "paid",
+        "notes": "Goods once sold will not be taken back."
+    }
+
+def bench(render, sale: dict, min_seconds: float) -> float:
+    """Return invoices rendered per second"""
+    render(sale)  # warm-up
+    count = 0
+    start = time.perf_counter()
+    while True:
+        render(sale)
+        count += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            return count / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lines", type=int, nargs="+", default=[5, 50, 500])
+    parser.add_argument("--seconds", type=float, default=2.0, help="minimum run time per case")
+    args = parser.parse_args()
+
+    print(f"{'lines':>6} {'platypus/s':>12} {'canvas/s':>12} {'speedup':>8}")
+    for line_count in args.lines:
+        sale = sample_sale(line_count)
+        rates = {name: bench(render, sale, args.seconds) for name, render in RENDERERS.items()}
+        speedup = rates["canvas"] / rates["platypus"]
+        print(f"{line_count:>6} {rates['platypus']:>12.1f} {rates['canvas']:>12.1f} {speedup:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -2,14 +2,14 @@ from fastapi import HTTPException, status, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from utils.security import verify_token
 from motor.motor_asyncio import AsyncIOMotorClient
+from typing import Optional
 import os
 
 security = HTTPBearer()
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    """Get current authenticated user from JWT token"""
-    token = credentials.credentials
-    payload = verify_token(token)
+async def user_from_token(token: Optional[str]) -> dict:
+    """The active user a JWT token belongs to; raises 401/403 otherwise"""
+    payload = verify_token(token) if token else None
     
     if not payload:
         raise HTTPException(
@@ -39,6 +39,10 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     
     return user
 
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Get current authenticated user from JWT token"""
+    return await user_from_token(credentials.credentials)
+
 async def require_role(required_roles: list):
     """Dependency to check user role"""
     def role_checker(user: dict = Depends(get_current_user)):
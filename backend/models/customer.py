@@ -36,4 +36,9 @@ class CustomerResponse(CustomerBase):
     model_config = ConfigDict(extra="ignore")
     id: str
     createdAt: datetime
-    updatedAt: datetime
\ No newline at end of file
+    updatedAt: datetime
+
+class CustomerLookupResponse(BaseModel):
+    id: str
+    name: Optional[str] = None
+    phone: str
\ No newline at end of file
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, ConfigDict
-from typing import Optional
+from typing import Optional, List
 from datetime import datetime
 from enum import Enum
 
@@ -23,6 +23,10 @@ class Stock(BaseModel):
     reorderPoint: float = Field(default=0, ge=0)
     warehouse: Optional[str] = None
 
+class StockResponse(Stock):
+    isLow: bool = False
+    shortfall: float = 0
+
 class ProductBase(BaseModel):
     name: str = Field(..., min_length=1, max_length=200)
     sku: str = Field(..., min_length=1, max_length=50)
@@ -56,4 +60,38 @@ class ProductResponse(ProductBase):
     createdBy: str
     createdAt: datetime
     updatedAt: datetime
-    profitMargin: Optional[float] = None
\ No newline at end of file
+    profitMargin: Optional[float] = None
+    stock: StockResponse
+
+class ProductLookupResponse(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str
+    name: str
+    sku: str
+    barcode: Optional[str] = None
+    unit: Unit = Unit.PIECE
+    category: Optional[str] = None
+    pricing: Pricing
+    stock: StockResponse
+    isActive: bool = True
+class PriceField(str, Enum):
+    PURCHASE = "purchasePrice"
+    SELLING = "sellingPrice"
+    MRP = "mrp"
+
+class RepriceMode(str, Enum):
+    PERCENTAGE = "percentage"
+    ABSOLUTE = "absolute"
+
+class ProductReprice(BaseModel):
+    category: Optional[str] = None
+    brand: Optional[str] = None
+    supplier: Optional[str] = None
+    field: PriceField = PriceField.SELLING
+    mode: RepriceMode
+    value: float = Field(..., ge=-100000, le=100000)
+    preview: bool = False
+
+class ProductBatchGet(BaseModel):
+    ids: List[str] = Field(..., min_length=1, max_length=5000)
+    fields: Optional[List[str]] = Field(None, max_length=50)
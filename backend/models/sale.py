@@ -3,6 +3,8 @@ from typing import Optional, List
 from datetime import datetime
 from enum import Enum
 
+from models.warehouse import StockAllocation
+
 class PaymentMode(str, Enum):
     CASH = "cash"
     CARD = "card"
@@ -32,6 +34,10 @@ class SaleItem(BaseModel):
     taxRate: float = Field(default=0, ge=0, le=100)
     taxAmount: float = Field(default=0, ge=0)
     lineTotal: float = Field(..., ge=0)
+    # Sell from this warehouse only; otherwise the allocation order applies
+    warehouseId: Optional[str] = None
+    # Filled in by the server with the warehouses the line was drawn from
+    allocations: Optional[List[StockAllocation]] = None
 
 class SaleBase(BaseModel):
     customerId: Optional[str] = None
@@ -51,6 +57,27 @@ class SaleBase(BaseModel):
 class SaleCreate(SaleBase):
     pass
 
+class SaleBatchItem(SaleCreate):
+    # Generated by the terminal; replaying a sale with the same id is a no-op
+    clientSaleId: str = Field(..., min_length=1, max_length=100)
+    # When the sale was rung up, for sales queued offline
+    saleDate: Optional[datetime] = None
+
+class SaleBatch(BaseModel):
+    sales: List[SaleBatchItem] = Field(..., min_length=1, max_length=1000)
+
+class QuoteItem(BaseModel):
+    productId: str
+    quantity: float = Field(..., gt=0)
+    discount: float = Field(default=0, ge=0)
+    discountType: DiscountType = DiscountType.FIXED
+
+class SaleQuote(BaseModel):
+    items: List[QuoteItem] = Field(..., min_length=1, max_length=1000)
+    # Cart discount: an amount, or a percentage of the discounted subtotal
+    discountAmount: float = Field(default=0, ge=0)
+    discountType: DiscountType = DiscountType.FIXED
+
 class SaleUpdate(BaseModel):
     paymentStatus: Optional[PaymentStatus] = None
     amountPaid: Optional[float] = Field(None, ge=0)
@@ -60,6 +87,7 @@ class SaleResponse(SaleBase):
     model_config = ConfigDict(extra="ignore")
     id: str
     invoiceNumber: str
+    clientSaleId: Optional[str] = None
     saleDate: datetime
     createdBy: str
     createdAt: datetime
@@ -0,0 +1,95 @@
+from pydantic import BaseModel, Field, ConfigDict
+from typing import Optional, List
+from datetime import datetime
+from enum import Enum
+
+class WarehouseBase(BaseModel):
+    code: str = Field(..., min_length=1, max_length=20, pattern=r"^[A-Za-z0-9_-]+$")
+    name: str = Field(..., min_length=1, max_length=100)
+    # Sales draw from the default warehouse first, then by ascending priority
+    priority: int = Field(default=100, ge=0)
+    isActive: bool = True
+
+class WarehouseCreate(WarehouseBase):
+    pass
+
+class WarehouseUpdate(BaseModel):
+    name: Optional[str] = Field(None, min_length=1, max_length=100)
+    priority: Optional[int] = Field(None, ge=0)
+    isActive: Optional[bool] = None
+
+class WarehouseResponse(WarehouseBase):
+    model_config = ConfigDict(extra="ignore")
+    id: str
+    isDefault: bool = False
+    createdAt: datetime
+    updatedAt: datetime
+
+class WarehouseStockResponse(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    productId: str
+    warehouseId: str
+    quantity: float
+
+class StockAllocation(BaseModel):
+    warehouseId: str
+    quantity: float
+
+class StockTransfer(BaseModel):
+    productId: str
+    fromWarehouseId: str
+    toWarehouseId: str
+    quantity: float = Field(..., gt=0)
+    note: Optional[str] = Field(None, max_length=500)
+
+class StockAdjustmentType(str, Enum):
+    ADJUST = "adjust"
+    RECEIVE = "receive"
+
+class StockAdjustment(BaseModel):
+    productId: str
+    warehouseId: str
+    delta: float
+    type: StockAdjustmentType = StockAdjustmentType.ADJUST
+    reason: Optional[str] = Field(None, max_length=500)
+
+class StockSharding(BaseModel):
+    # Number of counters the product's stock is split into; 0 turns it off
+    shards: int = Field(..., ge=0, le=64)
+
+class MovementType(str, Enum):
+    OPENING = "opening"
+    SALE = "sale"
+    RETURN = "return"
+    CANCEL = "cancel"
+    ADJUST = "adjust"
+    RECEIVE = "receive"
+    TRANSFER = "transfer"
+
+class StockMovementResponse(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str
+    productId: str
+    warehouseId: str
+    delta: float
+    type: MovementType
+    referenceId: Optional[str] = None
+    createdBy: Optional[str] = None
+    note: Optional[str] = None
+    createdAt: datetime
+
+class WarehouseOnHand(BaseModel):
+    warehouseId: str
+    quantity: float
+    snapshotAt: Optional[datetime] = None
+    movements: int
+
+class StockOnHandResponse(BaseModel):
+    productId: str
+    warehouseId: Optional[str] = None
+    at: datetime
+    quantity: float
+    warehouses: List[WarehouseOnHand]
+    # False when the answer comes from a snapshot because older movements
+    # were compacted, or the time is before history was kept
+    exact: bool
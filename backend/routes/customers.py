@@ -1,18 +1,35 @@
 from fastapi import APIRouter, HTTPException, status, Depends, Query
-from models.customer import CustomerCreate, CustomerUpdate, CustomerResponse
+from models.customer import CustomerCreate, CustomerUpdate, CustomerResponse, CustomerLookupResponse
 from motor.motor_asyncio import AsyncIOMotorClient
 from middleware.auth import get_current_user
 from datetime import datetime, timezone
 from typing import List, Optional
+import asyncio
 import uuid
 import os
 
+from utils.phone_index import customer_phone_index
+from utils.fuzzy_search import fuzzy_search
+from utils.streaming_export import export_response, FORMATS as EXPORT_FORMATS
+
 router = APIRouter(prefix="/customers", tags=["Customers"])
 
 mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
+_index_lock = asyncio.Lock()
+
+async def ensure_customer_indexes():
+    """Build the in-memory customer phone index on first use"""
+    if customer_phone_index.loaded:
+        return
+    async with _index_lock:
+        if customer_phone_index.loaded:
+            return
+        customers = await db.customers.find({}, {"_id": 0, "id": 1, "name": 1, "phone": 1}).to_list(None)
+        customer_phone_index.rebuild(customers)
+
 @router.post("/", response_model=CustomerResponse, status_code=status.HTTP_201_CREATED)
 async def create_customer(
     customer_data: CustomerCreate,
@@ -39,6 +56,8 @@ async def create_customer(
     await db.customers.insert_one(customer_doc)
     
     customer_doc.pop("_id")
+    customer_phone_index.add(customer_doc)
+    fuzzy_search.add("customers", customer_doc)
     return customer_doc
 
 @router.get("/", response_model=List[CustomerResponse])
@@ -63,6 +82,25 @@ async def get_customers(
     customers = await db.customers.find(query, {"_id": 0}).skip(skip).limit(limit).to_list(limit)
     return customers
 
+@router.get("/export")
+async def export_customers(
+    format: str = Query("csv", pattern=f"^({'|'.join(EXPORT_FORMATS)})$"),
+    gzip: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
+    """Stream every customer as CSV or NDJSON, optionally gzip-compressed"""
+    return export_response(db.customers, "customers", format, gzip)
+
+@router.get("/lookup", response_model=List[CustomerLookupResponse])
+async def lookup_customers(
+    phone_prefix: str = Query(..., pattern=r"^[0-9]{1,10}$"),
+    limit: int = Query(10, ge=1, le=50),
+    current_user: dict = Depends(get_current_user)
+):
+    """Find customers by phone prefix from memory as the cashier types"""
+    await ensure_customer_indexes()
+    return customer_phone_index.prefix(phone_prefix, limit)
+
 @router.get("/{customer_id}", response_model=CustomerResponse)
 async def get_customer(
     customer_id: str,
@@ -99,6 +137,8 @@ async def update_customer(
     await db.customers.update_one({"id": customer_id}, {"$set": update_data})
     
     updated_customer = await db.customers.find_one({"id": customer_id}, {"_id": 0})
+    customer_phone_index.add(updated_customer)
+    fuzzy_search.add("customers", updated_customer)
     return updated_customer
 
 @router.delete("/{customer_id}")
@@ -113,4 +153,6 @@ async def delete_customer(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Customer not found"
         )
+    customer_phone_index.remove(customer_id)
+    fuzzy_search.remove("customers", customer_id)
     return {"success": True, "message": "Customer deleted successfully"}
\ No newline at end of file
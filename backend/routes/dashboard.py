@@ -0,0 +1,44 @@
+from fastapi import APIRouter, HTTPException, Query, Header
+from fastapi.responses import StreamingResponse
+from typing import Optional
+
+from middleware.auth import user_from_token
+from utils.events import event_bus
+from utils.dashboard_stream import dashboard_hub, EVENT_TYPES
+
+router = APIRouter(prefix="/dashboard", tags=["dashboard"])
+
+# Deltas are coalesced per batch, so a burst of sales is one frame per connection
+event_bus.subscribe("dashboard", EVENT_TYPES, dashboard_hub.apply, batch_size=200, batch_ms=250)
+
+async def stream_user(token: Optional[str], authorization: Optional[str]) -> dict:
+    """Authenticate a stream request; EventSource cannot send headers, so the
+    token may also come as a query parameter"""
+    if not token and authorization and authorization.lower().startswith("bearer "):
+        token = authorization[7:]
+    return await user_from_token(token)
+
+@router.get("/stream")
+async def dashboard_stream(
+    token: Optional[str] = Query(None),
+    last_event_id: Optional[str] = Header(None),
+    authorization: Optional[str] = Header(None),
+    lastEventId: Optional[str] = Query(None)
+):
+    """Server-Sent Events stream of live dashboard deltas"""
+    
+    await stream_user(token, authorization)
+    if not dashboard_hub.loaded:
+        raise HTTPException(status_code=503, detail="Dashboard stream is starting")
+    if dashboard_hub.full:
+        raise HTTPException(status_code=503, detail="Too many dashboard connections")
+    
+    listener, first = dashboard_hub.connect(last_event_id or lastEventId)
+    return StreamingResponse(
+        dashboard_hub.stream(listener, first),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
@@ -1,18 +1,146 @@
-from fastapi import APIRouter, HTTPException, status, Depends, Query
-from models.product import ProductCreate, ProductUpdate, ProductResponse
+from fastapi import APIRouter, HTTPException, status, Depends, Query, UploadFile, File, Header
+from fastapi.responses import Response, JSONResponse
+from models.product import (
+    ProductCreate, ProductUpdate, ProductResponse, ProductLookupResponse, ProductReprice, RepriceMode,
+    ProductBatchGet
+)
 from motor.motor_asyncio import AsyncIOMotorClient
 from middleware.auth import get_current_user
 from datetime import datetime, timezone
 from typing import List, Optional
+import asyncio
+import io
+import re
 import uuid
 import os
 
+from utils.search_index import product_search_index, normalize
+from utils.product_lookup import product_lookup, normalize_code, cacheable, project, LOOKUP_FIELDS
+from utils.fuzzy_search import fuzzy_search
+from utils.pricing_engine import price_table
+from utils.events import event_bus, ProductUpserted, ProductDeleted, StockChanged
+from utils.facets import facet_store, FACET_PIPELINE
+from utils.product_import import import_products, detect_format, FORMATS
+from utils.stock import with_stock_flags, encode_low_stock_cursor, low_stock_cursor_filter, LOW_STOCK_SORT
+from utils.inventory import adjust, update_total, default_warehouse_id, InsufficientStockError
+from utils.stock_ledger import reason
+from utils.catalog_sync import (
+    SYNC_FIELDS, SYNC_SKEW, sync_now, encode_token, decode_token, latest_change, sync_etag, needs_snapshot
+)
+from utils.repricing import reprice_pipeline, reprice_preview_pipeline
+from utils.streaming_export import export_response, FORMATS as EXPORT_FORMATS
+
 router = APIRouter(prefix="/products", tags=["Products"])
 
 mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
+INDEX_FIELDS = {
+    "_id": 0, "id": 1, "name": 1, "sku": 1, "barcode": 1, "category": 1, "brand": 1,
+    "pricing.sellingPrice": 1, "pricing.taxRate": 1
+}
+_index_lock = asyncio.Lock()
+_facet_lock = asyncio.Lock()
+REPRICE_PREVIEW_SIZE = 20
+FIELD_NAME = re.compile(r"^[A-Za-z][A-Za-z0-9_]*(\.[A-Za-z][A-Za-z0-9_]*)*$")
+
+async def ensure_product_indexes():
+    """Build the in-memory product indexes from one collection scan"""
+    if product_search_index.loaded and product_lookup.loaded and price_table.loaded:
+        return
+    async with _index_lock:
+        if product_search_index.loaded and product_lookup.loaded and price_table.loaded:
+            return
+        products = await db.products.find({}, INDEX_FIELDS).to_list(None)
+        product_search_index.rebuild(products)
+        product_lookup.rebuild(products)
+        price_table.rebuild(products)
+
+async def ensure_facets(rebuild: bool = False):
+    """Load category/brand counts with one aggregation on first use"""
+    if facet_store.loaded and not rebuild:
+        return
+    async with _facet_lock:
+        if facet_store.loaded and not rebuild:
+            return
+        rows = await db.products.aggregate(FACET_PIPELINE).to_list(None)
+        facet_store.rebuild(rows)
+
+def index_product(product: dict, previous: Optional[dict] = None, bulk: bool = False):
+    """Apply a created or updated product to the in-memory indexes"""
+    if not bulk:
+        # Bulk writes rebuild the facet counts once at the end
+        facet_store.apply(previous, product)
+    product_search_index.add(product)
+    product_lookup.update(product)
+    price_table.set(product)
+    fuzzy_search.add("products", product)
+
+async def reindex_products(skus: list):
+    """Announce bulk-written products so the in-memory indexes reload them"""
+    products = await db.products.find({"sku": {"$in": skus}}, {**LOOKUP_FIELDS, "brand": 1}).to_list(None)
+    await event_bus.publish(*(ProductUpserted(product, bulk=True) for product in products))
+
+def unindex_product(product: dict):
+    product_id = product["id"]
+    facet_store.apply(product, None)
+    product_search_index.remove(product_id)
+    product_lookup.remove(product_id)
+    price_table.remove(product_id)
+    fuzzy_search.remove("products", product_id)
+
+async def on_product_event(event):
+    """Keep the in-memory product indexes in step with product writes"""
+    if isinstance(event, ProductUpserted):
+        index_product(event.product, event.previous, event.bulk)
+    elif isinstance(event, ProductDeleted):
+        unindex_product(event.product)
+    else:
+        product_lookup.set_stock(event.product_id, event.stock)
+
+event_bus.subscribe(
+    "product-indexes", (ProductUpserted, ProductDeleted, StockChanged), on_product_event, inline=True
+)
+
+async def search_products(search: str, category: Optional[str], brand: Optional[str],
+                          low_stock: bool, skip: int, limit: int) -> list:
+    """Rank matches in memory, then hydrate the requested page by id"""
+    await ensure_product_indexes()
+    ranked = product_search_index.search(search, category, brand, limit=None if low_stock else skip + limit)
+    if ranked is None:
+        return await search_products_in_db(search, category, brand, low_stock, skip, limit)
+    if low_stock:
+        # Stock changes are not indexed; filter the ranked ids in Mongo
+        query = {"id": {"$in": ranked}, "stock.isLow": True}
+    else:
+        ranked = ranked[skip:]
+        query = {"id": {"$in": ranked}}
+    products = await db.products.find(query, {"_id": 0}).to_list(None)
+    by_id = {product["id"]: product for product in products}
+    ordered = [by_id[product_id] for product_id in ranked if product_id in by_id]
+    return ordered[skip:skip + limit] if low_stock else ordered
+
+async def search_products_in_db(search: str, category: Optional[str], brand: Optional[str],
+                                low_stock: bool, skip: int, limit: int) -> list:
+    """Queries too broad for the index: every token must start a word of the
+    name or SKU, ordered by name so pages are stable"""
+    query = {"$and": [
+        {"$or": [
+            {"name": {"$regex": f"(^|[^a-z0-9]){re.escape(token)}", "$options": "i"}},
+            {"sku": {"$regex": f"(^|[^a-z0-9]){re.escape(token)}", "$options": "i"}}
+        ]}
+        for token in normalize(search).split()
+    ]}
+    if category:
+        query["category"] = category
+    if brand:
+        query["brand"] = brand
+    if low_stock:
+        query["stock.isLow"] = True
+    cursor = db.products.find(query, {"_id": 0}).sort([("name", 1), ("id", 1)])
+    return await cursor.skip(skip).limit(limit).to_list(limit)
+
 @router.post("/", response_model=ProductResponse, status_code=status.HTTP_201_CREATED)
 async def create_product(
     product_data: ProductCreate,
@@ -37,6 +165,8 @@ async def create_product(
     product_doc["createdBy"] = current_user["id"]
     product_doc["createdAt"] = now.isoformat()
     product_doc["updatedAt"] = now.isoformat()
+    product_doc["syncedAt"] = sync_now()
+    product_doc["stock"] = with_stock_flags(product_doc["stock"])
     
     # Calculate profit margin
     if product_data.pricing.purchasePrice > 0:
@@ -46,10 +176,83 @@ async def create_product(
         product_doc["profitMargin"] = 0
     
     await db.products.insert_one(product_doc)
+    # Opening stock is booked into the default warehouse
+    await adjust(
+        db, product_id, await default_warehouse_id(db), product_doc["stock"]["quantity"],
+        update_totals=False, why=reason("opening", product_id, current_user["id"])
+    )
     
     product_doc.pop("_id")
+    await event_bus.publish(ProductUpserted(product_doc))
     return product_doc
 
+@router.post("/import")
+async def import_products_file(
+    file: UploadFile = File(...),
+    format: Optional[str] = Query(None, pattern=f"^({'|'.join(FORMATS)})$"),
+    current_user: dict = Depends(get_current_user)
+):
+    """Bulk upsert products by SKU from a CSV or NDJSON upload"""
+    fmt = format or detect_format(file.filename)
+    if fmt is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Unknown file type; upload a .csv or .ndjson file or pass ?format="
+        )
+    
+    await ensure_product_indexes()
+    stream = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+    try:
+        report = await import_products(db, stream, fmt, current_user["id"], on_batch=reindex_products)
+    except UnicodeDecodeError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="File must be UTF-8 encoded"
+        )
+    finally:
+        stream.detach()
+    await ensure_facets(rebuild=True)
+    return report
+
+@router.post("/reprice")
+async def reprice_products(
+    reprice: ProductReprice,
+    current_user: dict = Depends(get_current_user)
+):
+    """Change a price across a category, brand or supplier in one update"""
+    query = {
+        key: getattr(reprice, key)
+        for key in ("category", "brand", "supplier") if getattr(reprice, key) is not None
+    }
+    if not query:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Filter by at least one of category, brand or supplier"
+        )
+    if reprice.mode == RepriceMode.PERCENTAGE and reprice.value < -100:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="A percentage change cannot be below -100"
+        )
+    field, mode = reprice.field.value, reprice.mode.value
+    
+    if reprice.preview:
+        result = await db.products.aggregate(
+            reprice_preview_pipeline(query, field, mode, reprice.value, REPRICE_PREVIEW_SIZE)
+        ).to_list(1)
+        facets = result[0] if result else {"count": [], "sample": []}
+        matched = facets["count"][0]["matched"] if facets["count"] else 0
+        return {"preview": True, "matched": matched, "sample": facets["sample"]}
+    
+    result = await db.products.update_many(
+        query,
+        reprice_pipeline(field, mode, reprice.value, datetime.now(timezone.utc).isoformat(), sync_now())
+    )
+    # The lookup cache and price table pick the new prices up from the events
+    products = await db.products.find(query, {**LOOKUP_FIELDS, "brand": 1}).to_list(None)
+    await event_bus.publish(*(ProductUpserted(product, bulk=True) for product in products))
+    return {"preview": False, "matched": result.matched_count, "modified": result.modified_count}
+
 @router.get("/", response_model=List[ProductResponse])
 async def get_products(
     current_user: dict = Depends(get_current_user),
@@ -61,13 +264,12 @@ async def get_products(
     lowStock: bool = False
 ):
     """Get all products with filters"""
-    query = {}
+    skip = (page - 1) * limit
     
     if search:
-        query["$or"] = [
-            {"name": {"$regex": search, "$options": "i"}},
-            {"sku": {"$regex": search, "$options": "i"}}
-        ]
+        return await search_products(search, category, brand, lowStock, skip, limit)
+    
+    query = {}
     
     if category:
         query["category"] = category
@@ -76,33 +278,197 @@ async def get_products(
         query["brand"] = brand
     
     if lowStock:
-        query["$expr"] = {"$lte": ["$stock.quantity", "$stock.reorderPoint"]}
-    
-    skip = (page - 1) * limit
+        query["stock.isLow"] = True
     
     products = await db.products.find(query, {"_id": 0}).skip(skip).limit(limit).to_list(limit)
     return products
 
 @router.get("/categories")
 async def get_categories(current_user: dict = Depends(get_current_user)):
-    """Get all unique categories"""
-    categories = await db.products.distinct("category")
-    return {"categories": categories}
+    """Get all unique categories with product counts"""
+    await ensure_facets()
+    counts = facet_store.categories()
+    return {"categories": list(counts), "counts": counts}
 
 @router.get("/brands")
-async def get_brands(current_user: dict = Depends(get_current_user)):
-    """Get all unique brands"""
-    brands = await db.products.distinct("brand")
-    return {"brands": brands}
+async def get_brands(
+    category: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Get all unique brands with product counts, optionally within a category"""
+    await ensure_facets()
+    counts = facet_store.brands(category)
+    return {"brands": list(counts), "counts": counts}
+
+@router.post("/facets/rebuild")
+async def rebuild_facets(current_user: dict = Depends(get_current_user)):
+    """Recount category and brand facets from the collection"""
+    await ensure_facets(rebuild=True)
+    return {"categories": len(facet_store.categories()), "brands": len(facet_store.brands())}
 
 @router.get("/low-stock")
-async def get_low_stock_products(current_user: dict = Depends(get_current_user)):
-    """Get products below reorder point"""
-    products = await db.products.find(
-        {"$expr": {"$lte": ["$stock.quantity", "$stock.reorderPoint"]}},
-        {"_id": 0}
-    ).to_list(100)
-    return {"lowStockItems": products, "count": len(products)}
+async def get_low_stock_products(
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=500),
+    current_user: dict = Depends(get_current_user)
+):
+    """Get products at or below reorder point, largest shortfall first"""
+    query = {"stock.isLow": True}
+    if cursor:
+        try:
+            query.update(low_stock_cursor_filter(cursor))
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
+            )
+    
+    products = await db.products.find(query, {"_id": 0}).sort(LOW_STOCK_SORT).limit(limit + 1).to_list(limit + 1)
+    next_cursor = None
+    if len(products) > limit:
+        products = products[:limit]
+        next_cursor = encode_low_stock_cursor(products[-1])
+    return {"lowStockItems": products, "count": len(products), "nextCursor": next_cursor}
+
+@router.get("/export")
+async def export_products(
+    format: str = Query("csv", pattern=f"^({'|'.join(EXPORT_FORMATS)})$"),
+    gzip: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
+    """Stream every product as CSV or NDJSON, optionally gzip-compressed"""
+    return export_response(db.products, "products", format, gzip)
+
+@router.get("/sync")
+async def sync_catalog(
+    since: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
+    """POS catalog snapshot, or the products changed and deleted since a version token"""
+    since_at = None
+    if since:
+        try:
+            since_at = decode_token(since)
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid sync token"
+            )
+        if needs_snapshot(since_at):
+            since_at = None
+    
+    newest_product = await db.products.find_one({}, {"_id": 0, "syncedAt": 1}, sort=[("syncedAt", -1)])
+    newest_tombstone = await db.product_tombstones.find_one({}, {"_id": 0, "deletedAt": 1}, sort=[("deletedAt", -1)])
+    latest = latest_change(
+        newest_product and newest_product.get("syncedAt"),
+        newest_tombstone and newest_tombstone.get("deletedAt")
+    )
+    etag = sync_etag(since if since_at else None, latest)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    
+    if since_at is None:
+        products = await db.products.find({}, SYNC_FIELDS).to_list(None)
+        deleted = []
+    else:
+        window = since_at - SYNC_SKEW
+        products = await db.products.find({"syncedAt": {"$gt": window}}, SYNC_FIELDS).to_list(None)
+        tombstones = await db.product_tombstones.find({"deletedAt": {"$gt": window}}, {"_id": 0, "id": 1}).to_list(None)
+        deleted = [tombstone["id"] for tombstone in tombstones]
+    
+    return JSONResponse(
+        {"full": since_at is None, "version": encode_token(latest), "products": products, "deleted": deleted},
+        headers=headers
+    )
+
+@router.get("/lookup", response_model=ProductLookupResponse)
+async def lookup_product(
+    code: str = Query(..., min_length=1),
+    current_user: dict = Depends(get_current_user)
+):
+    """Resolve a scanned barcode or SKU to its POS fields"""
+    await ensure_product_indexes()
+    product_id = product_lookup.resolve(code)
+    if product_id is not None:
+        product = product_lookup.get(product_id)
+        if product is not None:
+            return product
+        product = await db.products.find_one({"id": product_id}, LOOKUP_FIELDS)
+    else:
+        # Written by another worker since the index was built
+        product = await db.products.find_one(
+            {"$or": [{"barcode": code.strip()}, {"sku": normalize_code(code)}]},
+            LOOKUP_FIELDS
+        )
+    if not product:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Product not found"
+        )
+    product_lookup.put(product)
+    return product
+
+@router.post("/batch-get")
+async def batch_get_products(
+    request: ProductBatchGet,
+    current_user: dict = Depends(get_current_user)
+):
+    """Fetch many products by id in request order, with not-found markers.
+
+    When only POS fields are requested they are served from the hot lookup
+    cache and misses are read through it; other requests go straight to
+    Mongo. Either way at most one query is made.
+    """
+    fields = request.fields
+    if fields is not None and not all(FIELD_NAME.match(field) for field in fields):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="fields must be plain or dotted field names"
+        )
+    if fields is not None:
+        # A parent field already includes its children; Mongo rejects both
+        fields = [field for field in fields if not any(field.startswith(other + ".") for other in fields)]
+    use_cache = fields is not None and cacheable(fields)
+    
+    found = {}
+    if use_cache:
+        for product_id in request.ids:
+            product = product_lookup.get(product_id)
+            if product is not None:
+                found[product_id] = product
+    missing = list({product_id for product_id in request.ids if product_id not in found})
+    if missing:
+        if use_cache:
+            projection = LOOKUP_FIELDS
+        elif fields is not None:
+            projection = {"_id": 0, "id": 1, **{field: 1 for field in fields}}
+        else:
+            projection = {"_id": 0}
+        products = await db.products.find({"id": {"$in": missing}}, projection).to_list(None)
+        for product in products:
+            if use_cache:
+                product_lookup.put(product)
+            found[product["id"]] = product
+    
+    results = []
+    for product_id in request.ids:
+        product = found.get(product_id)
+        if product is None:
+            results.append({"id": product_id, "found": False})
+        else:
+            results.append({
+                "id": product_id,
+                "found": True,
+                "product": project(product, fields) if use_cache else product
+            })
+    return {
+        "products": results,
+        "found": sum(1 for result in results if result["found"]),
+        "missing": sum(1 for result in results if not result["found"])
+    }
 
 @router.get("/{product_id}", response_model=ProductResponse)
 async def get_product(
@@ -136,6 +502,30 @@ async def update_product(
     # Prepare update data
     update_data = product_data.model_dump(exclude_unset=True)
     update_data["updatedAt"] = datetime.now(timezone.utc).isoformat()
+    update_data["syncedAt"] = sync_now()
+    
+    # Quantity is owned by the warehouse ledger; a new total is booked as an
+    # adjustment of the default warehouse
+    stock = update_data.pop("stock", None)
+    delta = 0
+    if stock is not None:
+        # A partial stock object only changes the keys it sends
+        current = existing.get("stock") or {}
+        delta = stock.get("quantity", current.get("quantity", 0)) - current.get("quantity", 0)
+        if delta:
+            try:
+                await adjust(
+                    db, product_id, await default_warehouse_id(db), delta,
+                    update_totals=False, why=reason("adjust", product_id, current_user["id"])
+                )
+            except InsufficientStockError as e:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Cannot remove {-delta} units: the default warehouse holds {e.available}"
+                )
+        for key in ("reorderPoint", "warehouse"):
+            if key in stock:
+                update_data[f"stock.{key}"] = stock[key]
     
     # Recalculate profit margin if pricing updated
     if "pricing" in update_data:
@@ -145,8 +535,13 @@ async def update_product(
             update_data["profitMargin"] = round(profit_margin, 2)
     
     await db.products.update_one({"id": product_id}, {"$set": update_data})
+    if stock is not None:
+        # Applies the quantity change and recomputes the low-stock flags
+        await update_total(db, product_id, delta)
     
     updated_product = await db.products.find_one({"id": product_id}, {"_id": 0})
+    existing.pop("_id", None)
+    await event_bus.publish(ProductUpserted(updated_product, existing))
     return updated_product
 
 @router.delete("/{product_id}")
@@ -155,10 +550,18 @@ async def delete_product(
     current_user: dict = Depends(get_current_user)
 ):
     """Delete a product"""
-    result = await db.products.delete_one({"id": product_id})
-    if result.deleted_count == 0:
+    deleted = await db.products.find_one_and_delete(
+        {"id": product_id},
+        {"_id": 0, "id": 1, "category": 1, "brand": 1}
+    )
+    if not deleted:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Product not found"
         )
+    await db.warehouse_stock.delete_many({"productId": product_id})
+    await db.stock_shards.delete_many({"productId": product_id})
+    # Lets POS terminals drop the product on their next delta sync
+    await db.product_tombstones.insert_one({"id": product_id, "deletedAt": sync_now()})
+    await event_bus.publish(ProductDeleted(deleted))
     return {"success": True, "message": "Product deleted successfully"}
\ No newline at end of file
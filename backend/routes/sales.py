@@ -1,120 +1,370 @@
-from fastapi import APIRouter, HTTPException, Depends, Query
-from fastapi.responses import Response
+from fastapi import APIRouter, HTTPException, Depends, Query, Header
+from fastapi.responses import Response, StreamingResponse, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
 from typing import Optional, List
 from datetime import datetime, timedelta
+from collections import deque
 from motor.motor_asyncio import AsyncIOMotorClient
+import asyncio
+import logging
 import os
 import uuid
 from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 
 from models.sale import (
-    SaleCreate, SaleUpdate, SaleResponse, SaleReturn, SaleStats,
+    SaleCreate, SaleUpdate, SaleResponse, SaleReturn, SaleStats, SaleBatch, SaleQuote,
     PaymentStatus
 )
 from models.transaction import TransactionCreate, TransactionType, TransactionStatus
 from routes.auth import get_current_user
-from utils.invoice_generator import generate_invoice_pdf
+from utils.invoice_cache import invoice_cache, invoice_digest
+from utils.render_pool import render_invoice, RENDER_WORKERS
+from utils.render_queue import render_queue
+from utils.zip_stream import ZipStream
+from utils.receipt_renderer import render_receipt_text, render_receipt_escpos
+from utils.inventory import (
+    allocate_order, allocate_batch, release, returned_allocations, default_warehouse_id,
+    InsufficientStockError
+)
+from utils.stock_ledger import reason
+from utils.write_behind import transaction_writer
+from utils.events import event_bus, SaleCreated, SaleReturned, SaleCancelled
+from utils.pricing_engine import price_table, VALIDATION_MODE
+from routes.products import ensure_product_indexes
+from utils.idempotency import idempotency_store, scoped_key, IdempotencyError, KeyInUse, KeyMismatch
 
 router = APIRouter(prefix="/sales", tags=["sales"])
+logger = logging.getLogger(__name__)
 
 # Get MongoDB client
 mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
-async def generate_invoice_number():
-    """Generate unique invoice number"""
-    today = datetime.now().strftime("%Y%m%d")
-    # Find the last invoice of the day
+# Day counters this process has already seeded
+_seeded_counters = set()
+
+async def seed_invoice_counter(counter_id: str, today: str):
+    """Start a day's counter after invoices numbered before the counter existed.
+
+    $max makes this safe to run from every caller and worker: all of them
+    seed before incrementing, so no increment can hand out a number at or
+    below the last existing invoice.
+    """
     last_sale = await db.sales.find_one(
         {"invoiceNumber": {"$regex": f"^INV-{today}"}},
+        {"_id": 0, "invoiceNumber": 1},
         sort=[("invoiceNumber", -1)]
     )
-    
-    if last_sale:
-        last_num = int(last_sale["invoiceNumber"].split("-")[-1])
-        new_num = last_num + 1
-    else:
-        new_num = 1
-    
-    return f"INV-{today}-{new_num:04d}"
+    start = int(last_sale["invoiceNumber"].split("-")[-1]) if last_sale else 0
+    try:
+        await db.counters.update_one({"_id": counter_id}, {"$max": {"seq": start}}, upsert=True)
+    except DuplicateKeyError:
+        # A concurrent upsert created it first
+        await db.counters.update_one({"_id": counter_id}, {"$max": {"seq": start}})
+    _seeded_counters.add(counter_id)
 
-async def update_product_stock(product_id: str, quantity: float, operation: str = "subtract"):
-    """Update product stock quantity"""
-    product = await db.products.find_one({"id": product_id})
-    if not product:
-        raise HTTPException(status_code=404, detail=f"Product {product_id} not found")
-    
-    current_qty = product.get("stock", {}).get("quantity", 0)
-    
-    if operation == "subtract":
-        new_qty = current_qty - quantity
-        if new_qty < 0:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Insufficient stock for {product['name']}. Available: {current_qty}"
-            )
-    else:  # add
-        new_qty = current_qty + quantity
-    
-    await db.products.update_one(
-        {"id": product_id},
-        {"$set": {"stock.quantity": new_qty, "updatedAt": datetime.now()}}
+async def allocate_invoice_numbers(count: int) -> list:
+    """Reserve a block of consecutive invoice numbers for today"""
+    today = datetime.now().strftime("%Y%m%d")
+    counter_id = f"invoice-{today}"
+    if counter_id not in _seeded_counters:
+        await seed_invoice_counter(counter_id, today)
+    counter = await db.counters.find_one_and_update(
+        {"_id": counter_id},
+        {"$inc": {"seq": count}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
     )
+    first = counter["seq"] - count + 1
+    return [f"INV-{today}-{number:04d}" for number in range(first, counter["seq"] + 1)]
+
+async def generate_invoice_number():
+    """Generate unique invoice number"""
+    return (await allocate_invoice_numbers(1))[0]
+
+async def on_sale_event(event):
+    """Warm or drop cached invoices as sales change"""
+    if isinstance(event, SaleCreated):
+        # Most invoices are downloaded right after checkout; render ahead of
+        # time. Replayed offline sales are rendered on demand.
+        if not event.offline:
+            render_queue.schedule(event.sale)
+    else:
+        invoice_cache.invalidate(event.sale_id)
+
+event_bus.subscribe("invoices", (SaleCreated, SaleReturned, SaleCancelled), on_sale_event, inline=True)
+
+def legacy_allocations(item: dict, default_id: str) -> list:
+    """Allocations of a sale line, assuming the default warehouse for old sales"""
+    return item.get("allocations") or [{"warehouseId": default_id, "quantity": item["quantity"]}]
+
+async def release_sale_items(items: list, why: dict):
+    """Put the stock of these sale lines back where it was drawn from"""
+    default_id = await default_warehouse_id(db)
+    for item in items:
+        await release(db, item["productId"], legacy_allocations(item, default_id), why)
+
+async def allocate_sale_items(items: list, sale_id: str, user_id: str):
+    """Draw every line of a sale from warehouse stock, all or nothing"""
+    try:
+        await allocate_order(db, items, reason("sale", sale_id, user_id))
+    except InsufficientStockError as e:
+        product = await db.products.find_one({"id": e.product_id}, {"_id": 0, "name": 1})
+        if not product:
+            raise HTTPException(status_code=404, detail=f"Product {e.product_id} not found")
+        raise HTTPException(
+            status_code=400,
+            detail=f"Insufficient stock for {product['name']}. Available: {e.available}"
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Stock update failed: {str(e)}")
+
+def parse_date_range(start_date: Optional[str], end_date: Optional[str]) -> dict:
+    """Build a saleDate range filter from ISO date strings"""
+    date_query = {}
+    if start_date:
+        date_query["$gte"] = datetime.fromisoformat(start_date.replace('Z', '+00:00'))
+    if end_date:
+        date_query["$lte"] = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
+    return date_query
+
+def sale_transaction(sale_data: dict, user_id: str) -> dict:
+    """Transaction document recording a sale's payment"""
+    transaction_doc = TransactionCreate(
+        referenceId=sale_data["id"],
+        referenceType=TransactionType.SALE,
+        amount=sale_data["total"],
+        paymentMode=sale_data["paymentMode"].value,
+        description=f"Sale invoice {sale_data['invoiceNumber']}",
+        status=TransactionStatus.SUCCESS if sale_data["paymentStatus"] == PaymentStatus.PAID else TransactionStatus.PENDING
+    ).model_dump()
+    transaction_doc.update({
+        "id": str(uuid.uuid4()),
+        "transactionDate": sale_data["saleDate"],
+        "createdBy": user_id,
+        "createdAt": datetime.now()
+    })
+    return transaction_doc
+
+async def with_idempotency(scope: str, key: Optional[str], current_user: dict, payload, call, recover):
+    """Run call() once per Idempotency-Key; retries get the first response.
+
+    Both callbacks get the stored key id (None without a key): call() stamps
+    what it writes with it, recover() looks that up after a crashed attempt.
+    """
+    if key is None:
+        return await call(None)
+    scope = f"{scope}:{current_user['id']}"
+    stamp = scoped_key(scope, key)
+    try:
+        return await idempotency_store.run_once(
+            db, scope, key, payload, lambda: call(stamp), lambda: recover(stamp)
+        )
+    except KeyInUse as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except KeyMismatch as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except IdempotencyError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @router.post("", response_model=SaleResponse, status_code=201)
-async def create_sale(sale: SaleCreate, current_user: dict = Depends(get_current_user)):
+async def create_sale(
+    sale: SaleCreate,
+    current_user: dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
     """Create a new sale and update inventory"""
-    
-    # Generate invoice number
-    invoice_number = await generate_invoice_number()
+    return await with_idempotency(
+        "sale", idempotency_key, current_user, sale,
+        lambda stamp: record_sale(sale, current_user, stamp), recover_sale
+    )
+
+async def recover_sale(stamp: str):
+    sale = await db.sales.find_one({"idempotencyKey": stamp})
+    return SaleResponse(**sale) if sale else None
+
+async def validate_sale_prices(sale_data: dict):
+    """Compare client-computed amounts with the pricing engine"""
+    if VALIDATION_MODE == "off":
+        return
+    await ensure_product_indexes()
+    problems = price_table.check_sale(sale_data)
+    if not problems:
+        return
+    if VALIDATION_MODE == "enforce":
+        raise HTTPException(
+            status_code=400,
+            detail=f"Sale amounts do not match current prices: {'; '.join(problems[:10])}"
+        )
+    logger.warning("Sale amounts differ from current prices: %s", "; ".join(problems))
+
+@router.post("/quote")
+async def quote_sale(quote: SaleQuote, current_user: dict = Depends(get_current_user)):
+    """Price a cart with current selling prices, discounts and tax"""
+    await ensure_product_indexes()
+    result = price_table.quote(
+        [(item.productId, item.quantity, item.discount, item.discountType) for item in quote.items],
+        quote.discountType, quote.discountAmount
+    )
+    if result["missing"]:
+        raise HTTPException(status_code=404, detail=f"Products not found: {', '.join(result['missing'])}")
+    del result["missing"]
+    return result
+
+async def record_sale(sale: SaleCreate, current_user: dict, idempotency_key: Optional[str] = None):
+    """Allocate stock, then store the sale and its transaction"""
+    await validate_sale_prices(sale.model_dump())
     
     # Create sale document
     sale_id = str(uuid.uuid4())
     sale_data = sale.model_dump()
     sale_data.update({
         "id": sale_id,
-        "invoiceNumber": invoice_number,
         "saleDate": datetime.now(),
         "createdBy": current_user["id"],
         "createdAt": datetime.now(),
         "updatedAt": datetime.now()
     })
+    if idempotency_key:
+        sale_data["idempotencyKey"] = idempotency_key
     
     # Update stock for each item
-    try:
-        for item in sale.items:
-            await update_product_stock(item.productId, item.quantity, "subtract")
-    except HTTPException as e:
-        raise e
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Stock update failed: {str(e)}")
+    await allocate_sale_items(sale_data["items"], sale_id, current_user["id"])
     
-    # Insert sale
-    await db.sales.insert_one(sale_data)
+    # Numbered once the stock is drawn, so a rejected sale leaves no gap in
+    # the invoice series
+    try:
+        sale_data["invoiceNumber"] = await generate_invoice_number()
+        await db.sales.insert_one(sale_data)
+    except Exception:
+        # The insert may have reached the server before the error
+        if not await db.sales.find_one({"id": sale_id}, {"_id": 1}):
+            await release_sale_items(sale_data["items"], reason("cancel", sale_id, current_user["id"]))
+        raise
     
     # Create transaction record
-    transaction_data = TransactionCreate(
-        referenceId=sale_id,
-        referenceType=TransactionType.SALE,
-        amount=sale.total,
-        paymentMode=sale.paymentMode.value,
-        description=f"Sale invoice {invoice_number}",
-        status=TransactionStatus.SUCCESS if sale.paymentStatus == PaymentStatus.PAID else TransactionStatus.PENDING
-    )
+    await transaction_writer.write(sale_transaction(sale_data, current_user["id"]))
     
-    transaction_id = str(uuid.uuid4())
-    transaction_doc = transaction_data.model_dump()
-    transaction_doc.update({
-        "id": transaction_id,
-        "transactionDate": datetime.now(),
-        "createdBy": current_user["id"],
-        "createdAt": datetime.now()
-    })
-    await db.transactions.insert_one(transaction_doc)
+    await event_bus.publish(SaleCreated(sale_data))
     
     return SaleResponse(**sale_data)
 
+@router.post("/batch")
+async def create_sales_batch(batch: SaleBatch, current_user: dict = Depends(get_current_user)):
+    """Ingest sales queued by a POS terminal while it was offline"""
+    results = {}
+    client_ids = [sale.clientSaleId for sale in batch.sales]
+    existing = await db.sales.find(
+        {"clientSaleId": {"$in": client_ids}},
+        {"_id": 0, "id": 1, "invoiceNumber": 1, "clientSaleId": 1}
+    ).to_list(None)
+    for sale in existing:
+        results[sale["clientSaleId"]] = {
+            "status": "duplicate", "saleId": sale["id"], "invoiceNumber": sale["invoiceNumber"]
+        }
+    
+    now = datetime.now()
+    pending = []
+    # Positions of sales repeating a clientSaleId seen earlier in this batch
+    repeats = set()
+    seen = set()
+    if VALIDATION_MODE != "off":
+        await ensure_product_indexes()
+    for position, sale in enumerate(batch.sales):
+        if sale.clientSaleId in seen:
+            repeats.add(position)
+            continue
+        seen.add(sale.clientSaleId)
+        if sale.clientSaleId in results:
+            continue
+        sale_data = sale.model_dump()
+        problems = price_table.check_sale(sale_data) if VALIDATION_MODE != "off" else []
+        if problems and VALIDATION_MODE == "enforce":
+            results[sale.clientSaleId] = {
+                "status": "failed",
+                "error": f"Sale amounts do not match current prices: {'; '.join(problems[:10])}"
+            }
+            continue
+        if problems:
+            logger.warning("Offline sale %s differs from current prices: %s", sale.clientSaleId, "; ".join(problems))
+        sale_data.update({
+            "id": str(uuid.uuid4()),
+            "saleDate": sale.saleDate or now,
+            "createdBy": current_user["id"],
+            "createdAt": now,
+            "updatedAt": now
+        })
+        results[sale.clientSaleId] = {"status": "pending", "saleId": sale_data["id"]}
+        pending.append(sale_data)
+    
+    outcomes = await allocate_batch(
+        db,
+        [sale_data["items"] for sale_data in pending],
+        [reason("sale", sale_data["id"], current_user["id"]) for sale_data in pending]
+    )
+    failed = {
+        sale_data["clientSaleId"]: error
+        for sale_data, error in zip(pending, outcomes) if error is not None
+    }
+    if failed:
+        products = await db.products.find(
+            {"id": {"$in": list({error.product_id for error in failed.values()})}},
+            {"_id": 0, "id": 1, "name": 1}
+        ).to_list(None)
+        names = {product["id"]: product["name"] for product in products}
+        for client_id, error in failed.items():
+            name = names.get(error.product_id)
+            results[client_id] = {
+                "status": "failed",
+                "error": f"Insufficient stock for {name}. Available: {error.available}"
+                if name else f"Product {error.product_id} not found"
+            }
+    
+    accepted = [sale_data for sale_data in pending if sale_data["clientSaleId"] not in failed]
+    if accepted:
+        for sale_data, invoice_number in zip(accepted, await allocate_invoice_numbers(len(accepted))):
+            sale_data["invoiceNumber"] = invoice_number
+        try:
+            await db.sales.insert_many(accepted, ordered=False)
+            inserted = accepted
+        except BulkWriteError as e:
+            # Another replay of the same sales got in first
+            rejected = {err["index"]: err for err in e.details.get("writeErrors", [])}
+            inserted = [sale_data for index, sale_data in enumerate(accepted) if index not in rejected]
+            for index, err in rejected.items():
+                sale_data = accepted[index]
+                await release_sale_items(sale_data["items"], reason("cancel", sale_data["id"], current_user["id"]))
+                results[sale_data["clientSaleId"]] = {
+                    "status": "failed",
+                    "error": "Sale was already recorded" if err.get("code") == 11000 else err.get("errmsg", "Insert failed")
+                }
+        if inserted:
+            await db.transactions.insert_many(
+                [sale_transaction(sale_data, current_user["id"]) for sale_data in inserted], ordered=False
+            )
+        for sale_data in inserted:
+            results[sale_data["clientSaleId"]] = {
+                "status": "created", "saleId": sale_data["id"], "invoiceNumber": sale_data["invoiceNumber"]
+            }
+        await event_bus.publish(*(SaleCreated(sale_data, offline=True) for sale_data in inserted))
+    
+    ordered = []
+    for position, client_id in enumerate(client_ids):
+        result = results[client_id]
+        if position in repeats and result["status"] != "failed":
+            # Recorded once, by the first copy
+            result = {"status": "duplicate", "saleId": result["saleId"], "invoiceNumber": result["invoiceNumber"]}
+        ordered.append({"clientSaleId": client_id, **result})
+    return {
+        "results": ordered,
+        "created": sum(1 for result in ordered if result["status"] == "created"),
+        "duplicates": sum(1 for result in ordered if result["status"] == "duplicate"),
+        "failed": sum(1 for result in ordered if result["status"] == "failed")
+    }
+
 @router.get("", response_model=List[SaleResponse])
 async def list_sales(
     skip: int = Query(0, ge=0),
@@ -130,14 +380,9 @@ async def list_sales(
     query = {}
     
     # Date filter
-    if start_date or end_date:
-        date_query = {}
-        if start_date:
-            date_query["$gte"] = datetime.fromisoformat(start_date.replace('Z', '+00:00'))
-        if end_date:
-            date_query["$lte"] = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
-        if date_query:
-            query["saleDate"] = date_query
+    date_query = parse_date_range(start_date, end_date)
+    if date_query:
+        query["saleDate"] = date_query
     
     # Payment status filter
     if payment_status:
@@ -239,6 +484,62 @@ async def get_sales_stats(current_user: dict = Depends(get_current_user)):
         recentSales=[SaleResponse(**sale) for sale in recent_sales]
     )
 
+async def load_invoice_bytes(sale: dict) -> bytes:
+    """Return invoice PDF bytes from the cache, rendering on a miss"""
+    pdf_bytes = await run_in_threadpool(
+        invoice_cache.read, sale["id"], invoice_digest(sale["id"], sale["updatedAt"])
+    )
+    if pdf_bytes is not None:
+        return pdf_bytes
+    return await render_invoice(sale)
+
+async def stream_invoice_zip(query: dict):
+    """Yield a ZIP of invoice PDFs, one entry at a time, in saleDate order"""
+    archive = ZipStream()
+    window = max(2, RENDER_WORKERS * 2)
+    pending = deque()
+    cursor = db.sales.find(query, {"_id": 0}).sort("saleDate", 1).batch_size(window * 4)
+    
+    async def write_oldest():
+        sale, task = pending.popleft()
+        return archive.add(
+            f"invoice_{sale['invoiceNumber']}.pdf", await task, sale["saleDate"]
+        )
+    
+    try:
+        async for sale in cursor:
+            pending.append((sale, asyncio.ensure_future(load_invoice_bytes(sale))))
+            if len(pending) >= window:
+                yield await write_oldest()
+        while pending:
+            yield await write_oldest()
+        yield archive.close()
+    finally:
+        # Client went away mid-export: stop rendering what nobody will read
+        for _, task in pending:
+            task.cancel()
+        await cursor.close()
+
+@router.get("/invoices/export")
+async def export_invoices(
+    start_date: str,
+    end_date: str,
+    current_user: dict = Depends(get_current_user)
+):
+    """Stream all invoices in a date range as a ZIP archive"""
+    
+    try:
+        date_query = parse_date_range(start_date, end_date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format")
+    
+    filename = f"invoices_{start_date[:10]}_{end_date[:10]}.zip"
+    return StreamingResponse(
+        stream_invoice_zip({"saleDate": date_query}),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
 @router.get("/{sale_id}", response_model=SaleResponse)
 async def get_sale(sale_id: str, current_user: dict = Depends(get_current_user)):
     """Get a single sale by ID"""
@@ -250,23 +551,63 @@ async def get_sale(sale_id: str, current_user: dict = Depends(get_current_user))
     return SaleResponse(**sale)
 
 @router.get("/{sale_id}/invoice")
-async def get_invoice_pdf(sale_id: str, current_user: dict = Depends(get_current_user)):
-    """Generate and download invoice PDF"""
+async def get_invoice_pdf(
+    sale_id: str,
+    if_none_match: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
+    """Download invoice PDF, rendering it only when the sale has changed"""
     
-    sale = await db.sales.find_one({"id": sale_id})
+    sale = await db.sales.find_one(
+        {"id": sale_id},
+        {"_id": 0, "id": 1, "invoiceNumber": 1, "updatedAt": 1}
+    )
     if not sale:
         raise HTTPException(status_code=404, detail="Sale not found")
     
-    # Generate PDF
-    pdf_bytes = generate_invoice_pdf(sale)
+    digest = invoice_digest(sale_id, sale["updatedAt"])
+    etag = f'"{digest}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    
+    # Bytes, not a cache path: eviction could delete the file before it is sent
+    pdf_bytes = await run_in_threadpool(invoice_cache.read, sale_id, digest)
+    if pdf_bytes is None:
+        job = render_queue.pending(sale_id, digest)
+        if job is not None:
+            pdf_bytes = await asyncio.shield(job)
+    if pdf_bytes is None:
+        sale = await db.sales.find_one({"id": sale_id}, {"_id": 0})
+        pdf_bytes = await render_invoice(sale)
+        await run_in_threadpool(invoice_cache.put, sale_id, digest, pdf_bytes)
+    
+    headers["Content-Disposition"] = f'attachment; filename="invoice_{sale["invoiceNumber"]}.pdf"'
+    return Response(content=pdf_bytes, media_type="application/pdf", headers=headers)
+
+@router.get("/{sale_id}/receipt")
+async def get_receipt(
+    sale_id: str,
+    format: str = Query("text", pattern="^(text|escpos)$"),
+    width: int = Query(48, ge=24, le=64),
+    current_user: dict = Depends(get_current_user)
+):
+    """Get a thermal printer receipt as plain text or ESC/POS bytes"""
     
-    return Response(
-        content=pdf_bytes,
-        media_type="application/pdf",
-        headers={
-            "Content-Disposition": f"attachment; filename=invoice_{sale['invoiceNumber']}.pdf"
-        }
-    )
+    sale = await db.sales.find_one({"id": sale_id}, {"_id": 0})
+    if not sale:
+        raise HTTPException(status_code=404, detail="Sale not found")
+    
+    if format == "escpos":
+        return Response(
+            content=render_receipt_escpos(sale, width),
+            media_type="application/octet-stream",
+            headers={
+                "Content-Disposition": f"attachment; filename=receipt_{sale['invoiceNumber']}.bin"
+            }
+        )
+    return PlainTextResponse(render_receipt_text(sale, width))
 
 @router.put("/{sale_id}", response_model=SaleResponse)
 async def update_sale(
@@ -287,6 +628,7 @@ async def update_sale(
         {"id": sale_id},
         {"$set": update_data}
     )
+    invoice_cache.invalidate(sale_id)
     
     updated_sale = await db.sales.find_one({"id": sale_id})
     return SaleResponse(**updated_sale)
@@ -295,13 +637,42 @@ async def update_sale(
 async def process_return(
     sale_id: str,
     return_data: SaleReturn,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
     """Process sale return and refund"""
-    
+    return await with_idempotency(
+        "return", idempotency_key, current_user, {"saleId": sale_id, "return": return_data},
+        lambda stamp: record_return(sale_id, return_data, current_user, stamp), recover_return
+    )
+
+def return_response(transaction: dict) -> dict:
+    return {
+        "message": "Return processed successfully",
+        "refundAmount": transaction["amount"],
+        "transactionId": transaction["id"]
+    }
+
+async def recover_return(stamp: str):
+    sale = await db.sales.find_one({"returns.idempotencyKey": stamp}, {"_id": 0, "returns": 1})
+    if not sale:
+        return None
+    entry = next(entry for entry in sale["returns"] if entry.get("idempotencyKey") == stamp)
+    return return_response({"id": entry["transactionId"], "amount": entry["refundAmount"]})
+
+async def record_return(sale_id: str, return_data: SaleReturn, current_user: dict,
+                        idempotency_key: Optional[str] = None):
+    """Restock returned items and record the refund.
+
+    The return is logged on the sale, with its key, before anything is
+    restocked, so a retry after a crash is recovered from that entry and
+    never restocks twice.
+    """
     sale = await db.sales.find_one({"id": sale_id})
     if not sale:
         raise HTTPException(status_code=404, detail="Sale not found")
+    if sale.get("paymentStatus") == "cancelled":
+        raise HTTPException(status_code=400, detail="Sale is cancelled")
     
     # Validate return items exist in original sale
     sale_items = {item["productId"]: item for item in sale["items"]}
@@ -320,23 +691,45 @@ async def process_return(
                 detail=f"Return quantity exceeds original quantity for product {return_item.productId}"
             )
     
-    # Update stock (add back returned items)
-    for return_item in return_data.items:
-        await update_product_stock(return_item.productId, return_item.quantity, "add")
-    
-    # Update sale status
-    await db.sales.update_one(
-        {"id": sale_id},
+    transaction_id = str(uuid.uuid4())
+    entry = {
+        "transactionId": transaction_id,
+        "refundAmount": return_data.refundAmount,
+        "items": [item.model_dump() for item in return_data.items],
+        "returnedAt": datetime.now()
+    }
+    query = {"id": sale_id, "paymentStatus": {"$ne": "cancelled"}}
+    if idempotency_key:
+        entry["idempotencyKey"] = idempotency_key
+        query["returns.idempotencyKey"] = {"$ne": idempotency_key}
+    
+    # Log the return and mark the sale refunded first
+    logged = await db.sales.update_one(
+        query,
         {
             "$set": {
                 "paymentStatus": PaymentStatus.REFUNDED.value,
                 "updatedAt": datetime.now()
-            }
+            },
+            "$push": {"returns": entry}
         }
     )
+    if not logged.modified_count:
+        if idempotency_key:
+            recovered = await recover_return(idempotency_key)
+            if recovered is not None:
+                return recovered
+        raise HTTPException(status_code=400, detail="Sale is cancelled")
+    
+    # Update stock (add back returned items where they were sold from)
+    default_id = await default_warehouse_id(db)
+    for return_item in return_data.items:
+        sale_item = sale_items[return_item.productId]
+        await release(db, return_item.productId, returned_allocations(
+            legacy_allocations(sale_item, default_id), return_item.quantity
+        ), reason("return", sale_id, current_user["id"]))
     
     # Create refund transaction
-    transaction_id = str(uuid.uuid4())
     transaction_doc = {
         "id": transaction_id,
         "referenceId": sale_id,
@@ -349,35 +742,48 @@ async def process_return(
         "createdBy": current_user["id"],
         "createdAt": datetime.now()
     }
-    await db.transactions.insert_one(transaction_doc)
+    await transaction_writer.write(transaction_doc)
+    await event_bus.publish(SaleReturned(
+        sale_id, [item.model_dump() for item in return_data.items], return_data.refundAmount
+    ))
     
-    return {
-        "message": "Return processed successfully",
-        "refundAmount": return_data.refundAmount,
-        "transactionId": transaction_id
-    }
+    return return_response(transaction_doc)
 
 @router.delete("/{sale_id}")
-async def delete_sale(sale_id: str, current_user: dict = Depends(get_current_user)):
+async def delete_sale(
+    sale_id: str,
+    current_user: dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
     """Delete a sale (soft delete - mark as cancelled)"""
-    
-    sale = await db.sales.find_one({"id": sale_id})
+    return await with_idempotency(
+        "cancel", idempotency_key, current_user, {"saleId": sale_id},
+        lambda stamp: cancel_sale(sale_id, current_user, stamp), recover_cancel
+    )
+
+CANCEL_RESPONSE = {"message": "Sale cancelled successfully"}
+
+async def recover_cancel(stamp: str):
+    sale = await db.sales.find_one({"cancelIdempotencyKey": stamp}, {"_id": 1})
+    return CANCEL_RESPONSE if sale else None
+
+async def cancel_sale(sale_id: str, current_user: dict, idempotency_key: Optional[str] = None):
+    """Mark a sale cancelled and put its stock back"""
+    update = {"paymentStatus": "cancelled", "updatedAt": datetime.now()}
+    if idempotency_key:
+        update["cancelIdempotencyKey"] = idempotency_key
+    # Mark as cancelled first so two cancels cannot both restore the stock
+    sale = await db.sales.find_one_and_update(
+        {"id": sale_id, "paymentStatus": {"$ne": "cancelled"}},
+        {"$set": update}
+    )
     if not sale:
+        if await db.sales.find_one({"id": sale_id}, {"_id": 1}):
+            raise HTTPException(status_code=400, detail="Sale is already cancelled")
         raise HTTPException(status_code=404, detail="Sale not found")
     
     # Restore stock
-    for item in sale["items"]:
-        await update_product_stock(item["productId"], item["quantity"], "add")
-    
-    # Mark as cancelled instead of deleting
-    await db.sales.update_one(
-        {"id": sale_id},
-        {
-            "$set": {
-                "paymentStatus": "cancelled",
-                "updatedAt": datetime.now()
-            }
-        }
-    )
+    await release_sale_items(sale["items"], reason("cancel", sale_id, current_user["id"]))
+    await event_bus.publish(SaleCancelled(sale_id, sale["items"]))
     
-    return {"message": "Sale cancelled successfully"}
+    return CANCEL_RESPONSE
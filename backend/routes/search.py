@@ -0,0 +1,77 @@
+from fastapi import APIRouter, HTTPException, status, Depends, Query
+from motor.motor_asyncio import AsyncIOMotorClient
+from middleware.auth import get_current_user
+import asyncio
+import os
+
+from utils.fuzzy_search import fuzzy_search, SEARCH_FIELDS
+
+router = APIRouter(prefix="/search", tags=["Search"])
+
+mongo_url = os.environ['MONGO_URL']
+client = AsyncIOMotorClient(mongo_url)
+db = client[os.environ['DB_NAME']]
+
+# Fields returned with each hit
+RESULT_FIELDS = {
+    "products": {"_id": 0, "id": 1, "name": 1, "sku": 1, "category": 1, "brand": 1,
+                 "pricing.sellingPrice": 1, "stock.quantity": 1},
+    "customers": {"_id": 0, "id": 1, "name": 1, "phone": 1, "email": 1},
+    "suppliers": {"_id": 0, "id": 1, "name": 1, "phone": 1, "email": 1},
+}
+
+_index_locks = {doc_type: asyncio.Lock() for doc_type in SEARCH_FIELDS}
+
+
+def _loader(doc_type: str):
+    projection = {"_id": 0, "id": 1, **{field: 1 for field in SEARCH_FIELDS[doc_type]}}
+
+    async def load():
+        return await db[doc_type].find({}, projection).to_list(None)
+    return load
+
+
+for _doc_type in SEARCH_FIELDS:
+    fuzzy_search.register(_doc_type, _loader(_doc_type))
+
+
+async def ensure_search_indexes(doc_types=tuple(SEARCH_FIELDS)):
+    """Build the fuzzy indexes for these entity types on first use"""
+    for doc_type in doc_types:
+        if fuzzy_search.loaded(doc_type):
+            continue
+        async with _index_locks[doc_type]:
+            if not fuzzy_search.loaded(doc_type):
+                await fuzzy_search.load(doc_type)
+
+@router.get("/")
+async def global_search(
+    q: str = Query(..., min_length=1, max_length=100),
+    types: str = Query("products,customers,suppliers"),
+    limit: int = Query(10, ge=1, le=50),
+    current_user: dict = Depends(get_current_user)
+):
+    """Typo-tolerant search across products, customers and suppliers"""
+    doc_types = list(dict.fromkeys(t.strip() for t in types.split(",") if t.strip()))
+    unknown = [t for t in doc_types if t not in SEARCH_FIELDS]
+    if unknown or not doc_types:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"types must be a comma separated subset of {', '.join(SEARCH_FIELDS)}"
+        )
+
+    await ensure_search_indexes(doc_types)
+    hits = fuzzy_search.search(q, doc_types, limit)
+
+    results = {}
+    for doc_type in doc_types:
+        matches = hits.get(doc_type, [])
+        ids = [doc_id for _, doc_id, _ in matches]
+        docs = await db[doc_type].find({"id": {"$in": ids}}, RESULT_FIELDS[doc_type]).to_list(len(ids)) if ids else []
+        by_id = {doc["id"]: doc for doc in docs}
+        results[doc_type] = [
+            {**by_id[doc_id], "score": score}
+            for score, doc_id, _ in matches if doc_id in by_id
+        ]
+
+    return {"query": q, "results": results}
@@ -7,6 +7,9 @@ from typing import List, Optional
 import uuid
 import os
 
+from utils.fuzzy_search import fuzzy_search
+from utils.streaming_export import export_response, FORMATS as EXPORT_FORMATS
+
 router = APIRouter(prefix="/suppliers", tags=["Suppliers"])
 
 mongo_url = os.environ['MONGO_URL']
@@ -39,6 +42,7 @@ async def create_supplier(
     await db.suppliers.insert_one(supplier_doc)
     
     supplier_doc.pop("_id")
+    fuzzy_search.add("suppliers", supplier_doc)
     return supplier_doc
 
 @router.get("/", response_model=List[SupplierResponse])
@@ -63,6 +67,15 @@ async def get_suppliers(
     suppliers = await db.suppliers.find(query, {"_id": 0}).skip(skip).limit(limit).to_list(limit)
     return suppliers
 
+@router.get("/export")
+async def export_suppliers(
+    format: str = Query("csv", pattern=f"^({'|'.join(EXPORT_FORMATS)})$"),
+    gzip: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
+    """Stream every supplier as CSV or NDJSON, optionally gzip-compressed"""
+    return export_response(db.suppliers, "suppliers", format, gzip)
+
 @router.get("/{supplier_id}", response_model=SupplierResponse)
 async def get_supplier(
     supplier_id: str,
@@ -99,6 +112,7 @@ async def update_supplier(
     await db.suppliers.update_one({"id": supplier_id}, {"$set": update_data})
     
     updated_supplier = await db.suppliers.find_one({"id": supplier_id}, {"_id": 0})
+    fuzzy_search.add("suppliers", updated_supplier)
     return updated_supplier
 
 @router.delete("/{supplier_id}")
@@ -113,4 +127,5 @@ async def delete_supplier(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Supplier not found"
         )
+    fuzzy_search.remove("suppliers", supplier_id)
     return {"success": True, "message": "Supplier deleted successfully"}
\ No newline at end of file
@@ -0,0 +1,259 @@
+from fastapi import APIRouter, HTTPException, status, Depends, Query
+from models.warehouse import (
+    WarehouseCreate, WarehouseUpdate, WarehouseResponse, WarehouseStockResponse,
+    StockTransfer, StockAdjustment, StockMovementResponse, StockOnHandResponse, MovementType,
+    StockSharding
+)
+from motor.motor_asyncio import AsyncIOMotorClient
+from middleware.auth import get_current_user
+from datetime import datetime, timezone
+from typing import List, Optional
+import uuid
+import os
+
+from utils.inventory import (
+    adjust, transfer, invalidate_warehouses, ensure_default_warehouse, warehouse_quantities,
+    InsufficientStockError, reconcile_totals
+)
+from utils.stock_ledger import reason, on_hand_at, take_snapshots
+from utils.stock_shards import set_shards
+
+router = APIRouter(prefix="/warehouses", tags=["Warehouses"])
+
+mongo_url = os.environ['MONGO_URL']
+client = AsyncIOMotorClient(mongo_url)
+db = client[os.environ['DB_NAME']]
+
+async def get_warehouse_or_404(warehouse_id: str) -> dict:
+    warehouse = await db.warehouses.find_one({"id": warehouse_id}, {"_id": 0})
+    if not warehouse:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Warehouse {warehouse_id} not found"
+        )
+    return warehouse
+
+async def ensure_product_exists(product_id: str):
+    if not await db.products.find_one({"id": product_id}, {"_id": 0, "id": 1}):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Product not found"
+        )
+
+@router.post("/", response_model=WarehouseResponse, status_code=status.HTTP_201_CREATED)
+async def create_warehouse(
+    warehouse_data: WarehouseCreate,
+    current_user: dict = Depends(get_current_user)
+):
+    """Create a new warehouse"""
+    code = warehouse_data.code.upper()
+    existing = await db.warehouses.find_one({"code": code})
+    if existing:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Warehouse with this code already exists"
+        )
+    
+    now = datetime.now(timezone.utc)
+    warehouse_doc = warehouse_data.model_dump()
+    warehouse_doc.update({
+        "id": str(uuid.uuid4()),
+        "code": code,
+        "isDefault": False,
+        "createdAt": now.isoformat(),
+        "updatedAt": now.isoformat()
+    })
+    await db.warehouses.insert_one(warehouse_doc)
+    invalidate_warehouses()
+    
+    warehouse_doc.pop("_id")
+    return warehouse_doc
+
+@router.get("/", response_model=List[WarehouseResponse])
+async def get_warehouses(current_user: dict = Depends(get_current_user)):
+    """Get all warehouses in allocation order"""
+    await ensure_default_warehouse(db)
+    warehouses = await db.warehouses.find({}, {"_id": 0}).to_list(None)
+    warehouses.sort(key=lambda w: (not w.get("isDefault"), w.get("priority", 100), w["code"]))
+    return warehouses
+
+@router.get("/stock/{product_id}", response_model=List[WarehouseStockResponse])
+async def get_product_stock(
+    product_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    """Get a product's stock in every warehouse"""
+    quantities = await warehouse_quantities(db, product_id, fresh=True)
+    return [
+        {"productId": product_id, "warehouseId": warehouse_id, "quantity": quantity}
+        for warehouse_id, quantity in quantities.items()
+    ]
+
+@router.put("/shards/{product_id}")
+async def set_stock_shards(
+    product_id: str,
+    sharding: StockSharding,
+    current_user: dict = Depends(get_current_user)
+):
+    """Split a hot product's stock into sharded counters, or merge it back"""
+    await ensure_product_exists(product_id)
+    await set_shards(db, product_id, sharding.shards)
+    return {"success": True, "productId": product_id, "shards": sharding.shards}
+
+@router.post("/transfer")
+async def transfer_stock(
+    transfer_data: StockTransfer,
+    current_user: dict = Depends(get_current_user)
+):
+    """Move stock from one warehouse to another"""
+    if transfer_data.fromWarehouseId == transfer_data.toWarehouseId:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Source and destination warehouses must differ"
+        )
+    await get_warehouse_or_404(transfer_data.fromWarehouseId)
+    destination = await get_warehouse_or_404(transfer_data.toWarehouseId)
+    if not destination.get("isActive", True):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Destination warehouse is inactive"
+        )
+    await ensure_product_exists(transfer_data.productId)
+    
+    try:
+        await transfer(
+            db, transfer_data.productId, transfer_data.fromWarehouseId,
+            transfer_data.toWarehouseId, transfer_data.quantity,
+            why=reason("transfer", user_id=current_user["id"], note=transfer_data.note)
+        )
+    except InsufficientStockError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Insufficient stock in source warehouse. Available: {e.available}"
+        )
+    return {"success": True, "message": "Stock transferred successfully"}
+
+@router.post("/adjust")
+async def adjust_stock(
+    adjustment: StockAdjustment,
+    current_user: dict = Depends(get_current_user)
+):
+    """Add or remove stock in one warehouse"""
+    if adjustment.delta == 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="delta must not be zero"
+        )
+    await get_warehouse_or_404(adjustment.warehouseId)
+    await ensure_product_exists(adjustment.productId)
+    
+    try:
+        await adjust(
+            db, adjustment.productId, adjustment.warehouseId, adjustment.delta,
+            why=reason(adjustment.type.value, user_id=current_user["id"], note=adjustment.reason)
+        )
+    except InsufficientStockError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Insufficient stock in warehouse. Available: {e.available}"
+        )
+    return {"success": True, "message": "Stock adjusted successfully"}
+
+@router.post("/reconcile")
+async def reconcile_stock_totals(current_user: dict = Depends(get_current_user)):
+    """Recompute every product's stock total from the warehouse ledger and shards"""
+    changed = await reconcile_totals(db)
+    return {"success": True, "message": "Stock totals reconciled", "changed": changed}
+
+def parse_timestamp(value: str, name: str) -> datetime:
+    """ISO timestamp as an aware UTC datetime; naive input is taken as UTC"""
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"{name} must be an ISO 8601 timestamp"
+        )
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+@router.get("/movements", response_model=List[StockMovementResponse])
+async def get_stock_movements(
+    current_user: dict = Depends(get_current_user),
+    productId: Optional[str] = None,
+    warehouseId: Optional[str] = None,
+    type: Optional[MovementType] = None,
+    referenceId: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    page: int = Query(1, ge=1),
+    limit: int = Query(50, ge=1, le=500)
+):
+    """Stock movement history, newest first"""
+    query = {}
+    if productId:
+        query["productId"] = productId
+    if warehouseId:
+        query["warehouseId"] = warehouseId
+    if type:
+        query["type"] = type.value
+    if referenceId:
+        query["referenceId"] = referenceId
+    date_query = {}
+    if start_date:
+        date_query["$gte"] = parse_timestamp(start_date, "start_date")
+    if end_date:
+        date_query["$lte"] = parse_timestamp(end_date, "end_date")
+    if date_query:
+        query["createdAt"] = date_query
+    
+    skip = (page - 1) * limit
+    movements = await db.stock_movements.find(query, {"_id": 0}).sort(
+        [("createdAt", -1), ("id", 1)]
+    ).skip(skip).limit(limit).to_list(limit)
+    return movements
+
+@router.get("/on-hand/{product_id}", response_model=StockOnHandResponse)
+async def get_stock_on_hand(
+    product_id: str,
+    at: Optional[str] = None,
+    warehouseId: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Quantity of a product on hand at a point in time (default: now)"""
+    moment = parse_timestamp(at, "at") if at else datetime.now(timezone.utc)
+    return await on_hand_at(db, product_id, moment, warehouseId)
+
+@router.post("/snapshots")
+async def create_stock_snapshots(current_user: dict = Depends(get_current_user)):
+    """Fold recent stock movements into snapshots and compact old history"""
+    return await take_snapshots(db)
+
+@router.get("/{warehouse_id}", response_model=WarehouseResponse)
+async def get_warehouse(
+    warehouse_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    """Get a single warehouse by ID"""
+    return await get_warehouse_or_404(warehouse_id)
+
+@router.put("/{warehouse_id}", response_model=WarehouseResponse)
+async def update_warehouse(
+    warehouse_id: str,
+    warehouse_data: WarehouseUpdate,
+    current_user: dict = Depends(get_current_user)
+):
+    """Update a warehouse"""
+    existing = await get_warehouse_or_404(warehouse_id)
+    
+    update_data = warehouse_data.model_dump(exclude_unset=True)
+    if existing.get("isDefault") and update_data.get("isActive") is False:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="The default warehouse cannot be deactivated"
+        )
+    update_data["updatedAt"] = datetime.now(timezone.utc).isoformat()
+    
+    await db.warehouses.update_one({"id": warehouse_id}, {"$set": update_data})
+    invalidate_warehouses()
+    
+    return await get_warehouse_or_404(warehouse_id)
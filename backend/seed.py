@@ -2,6 +2,12 @@
 import asyncio
 from motor.motor_asyncio import AsyncIOMotorClient
 from utils.security import hash_password
+from utils.stock import STOCK_FLAGS_STAGE, LOW_STOCK_SORT
+from utils.catalog_sync import TOMBSTONE_RETENTION, sync_now
+from utils.inventory import ensure_default_warehouse, backfill_pipeline
+from utils.stock_ledger import ensure_baseline
+from utils.idempotency import DEFAULT_TTL as IDEMPOTENCY_TTL
+from utils.events import OUTBOX_RETENTION
 from datetime import datetime, timezone
 import uuid
 import os
@@ -226,14 +232,65 @@ async def seed_database():
     else:
         print(f"ℹ️  Suppliers already exist ({existing_suppliers} suppliers)")
     
+    # Backfill low-stock flags on products written before they existed
+    backfill = await db.products.update_many({"stock.isLow": {"$exists": False}}, [STOCK_FLAGS_STAGE])
+    if backfill.modified_count:
+        print(f"✅ Backfilled low-stock flags on {backfill.modified_count} products")
+    
+    # Stamp products written before catalog sync so the first delta picks them up
+    stamped = await db.products.update_many({"syncedAt": {"$exists": False}}, {"$set": {"syncedAt": sync_now()}})
+    if stamped.modified_count:
+        print(f"✅ Stamped syncedAt on {stamped.modified_count} products")
+    
     # Create indexes
     await db.users.create_index("email", unique=True)
+    await db.products.create_index("id", unique=True)
     await db.products.create_index("sku", unique=True)
+    await db.products.create_index("barcode")
+    await db.products.create_index(LOW_STOCK_SORT, partialFilterExpression={"stock.isLow": True})
+    await db.products.create_index("syncedAt")
+    await db.product_tombstones.create_index(
+        "deletedAt", expireAfterSeconds=int(TOMBSTONE_RETENTION.total_seconds())
+    )
     await db.products.create_index([("name", "text"), ("description", "text")])
     await db.customers.create_index("phone")
     await db.suppliers.create_index("phone")
+    await db.sales.create_index("id", unique=True)
+    await db.sales.create_index("saleDate")
+    await db.sales.create_index("invoiceNumber", unique=True)
+    # Unique so a retried request can never record a second sale
+    await db.sales.create_index("idempotencyKey", unique=True, sparse=True)
+    await db.sales.create_index("cancelIdempotencyKey", sparse=True)
+    await db.sales.create_index("returns.idempotencyKey", sparse=True)
+    await db.sales.create_index("clientSaleId", unique=True, sparse=True)
+    await db.event_outbox.create_index(
+        "createdAt", expireAfterSeconds=int(OUTBOX_RETENTION.total_seconds())
+    )
+    await db.event_outbox.create_index([("type", 1), ("_id", 1)])
+    await db.idempotency_keys.create_index(
+        "createdAt", expireAfterSeconds=int(IDEMPOTENCY_TTL.total_seconds())
+    )
+    await db.warehouses.create_index("id", unique=True)
+    await db.warehouses.create_index("code", unique=True)
+    await db.warehouse_stock.create_index([("productId", 1), ("warehouseId", 1)], unique=True)
+    await db.stock_shards.create_index([("productId", 1), ("warehouseId", 1), ("shard", 1)], unique=True)
+    await db.stock_move_journal.create_index("leaseUntil")
+    await db.products.create_index("stockShards", sparse=True)
+    await db.stock_movements.create_index([("productId", 1), ("warehouseId", 1), ("createdAt", 1)])
+    await db.stock_movements.create_index("createdAt")
+    await db.stock_movements.create_index("referenceId", sparse=True)
+    await db.stock_snapshots.create_index([("productId", 1), ("warehouseId", 1), ("at", -1)], unique=True)
+    await db.stock_snapshot_runs.create_index("at")
     print("✅ Database indexes created")
     
+    # Book existing product totals into the default warehouse ledger
+    main_warehouse = await ensure_default_warehouse(db)
+    await db.products.aggregate(backfill_pipeline(main_warehouse["id"])).to_list(None)
+    print(f"✅ Warehouse stock backfilled into {main_warehouse['code']}")
+    # Movement history starts from a snapshot of the ledger as it is now
+    await ensure_baseline(db)
+    print("✅ Stock history baseline recorded")
+    
     client.close()
     print("\n🎉 Database seeding completed successfully!")
     print("\n📝 Login credentials:")
@@ -1,9 +1,10 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
 from pathlib import Path
 import os
+import asyncio
 import logging
 
 # Load environment variables
@@ -12,10 +13,25 @@ load_dotenv(ROOT_DIR / '.env')
 
 # Import routes
 from routes.auth import router as auth_router
-from routes.products import router as products_router
-from routes.customers import router as customers_router
+from routes.products import router as products_router, ensure_product_indexes, ensure_facets
+from routes.customers import router as customers_router, ensure_customer_indexes
 from routes.suppliers import router as suppliers_router
 from routes.sales import router as sales_router
+from routes.search import router as search_router, ensure_search_indexes
+from routes.warehouses import router as warehouses_router
+from routes.dashboard import router as dashboard_router
+from middleware.auth import get_current_user
+from utils.render_pool import shutdown_render_pool
+from utils.render_queue import render_queue
+from utils.invoice_cache import invoice_cache
+from utils.fuzzy_search import fuzzy_search
+from utils.idempotency import idempotency_store
+from utils.write_behind import transaction_writer
+from utils.events import event_bus
+from utils.dashboard_stream import dashboard_hub
+from utils.stock_ledger import run_snapshot_job
+from utils.stock_shards import run_shard_task
+from utils.stock_journal import run_journal_task
 
 # Configure logging
 logging.basicConfig(
@@ -51,6 +67,9 @@ app.include_router(products_router, prefix="/api")
 app.include_router(customers_router, prefix="/api")
 app.include_router(suppliers_router, prefix="/api")
 app.include_router(sales_router, prefix="/api")
+app.include_router(search_router, prefix="/api")
+app.include_router(warehouses_router, prefix="/api")
+app.include_router(dashboard_router, prefix="/api")
 
 # Health check endpoint
 @app.get("/api/health")
@@ -70,11 +89,58 @@ async def root():
         "version": "1.0.0"
     }
 
+# Runtime metrics for background workers and caches
+@app.get("/api/metrics")
+async def metrics(current_user: dict = Depends(get_current_user)):
+    return {
+        "invoiceRenderQueue": render_queue.metrics(),
+        "invoiceCache": invoice_cache.stats(),
+        "fuzzySearch": fuzzy_search.stats(),
+        "idempotency": idempotency_store.stats(),
+        "transactionWriter": transaction_writer.metrics(),
+        "events": event_bus.metrics(),
+        "dashboardStream": dashboard_hub.metrics()
+    }
+
+# Startup event
+@app.on_event("startup")
+async def start_background_workers():
+    await render_queue.start()
+    logger.info("Invoice render queue started")
+    await transaction_writer.start(db.transactions)
+    logger.info(f"Transaction writer started ({transaction_writer.mode})")
+    # Seeded before the bus delivers, so no delta is missed or counted twice
+    await dashboard_hub.start(db)
+    await event_bus.start(db)
+    logger.info("Event bus started")
+    # Warm in-memory indexes without holding up startup
+    app.state.index_warmup = [
+        asyncio.create_task(ensure_product_indexes()),
+        asyncio.create_task(ensure_facets()),
+        asyncio.create_task(ensure_customer_indexes()),
+        asyncio.create_task(ensure_search_indexes())
+    ]
+    app.state.stock_snapshots = asyncio.create_task(run_snapshot_job(db))
+    app.state.stock_shards = asyncio.create_task(run_shard_task(db))
+    app.state.stock_journal = asyncio.create_task(run_journal_task(db))
+
 # Shutdown event
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    app.state.stock_snapshots.cancel()
+    app.state.stock_shards.cancel()
+    app.state.stock_journal.cancel()
+    await dashboard_hub.stop()
+    await render_queue.drain()
+    logger.info("Invoice render queue drained")
+    await event_bus.stop()
+    logger.info("Event bus stopped")
+    await transaction_writer.drain()
+    logger.info("Transaction writer drained")
     client.close()
     logger.info("Database connection closed")
+    shutdown_render_pool()
+    logger.info("Invoice render pool stopped")
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,60 @@
+"""Delta sync of the product catalog for POS terminals.
+
+Every product write stamps ``syncedAt`` (a UTC BSON date) and every delete
+leaves a tombstone in ``product_tombstones``. A terminal downloads one
+snapshot, keeps the version token it came with, and then asks for changes
+since that token. Tokens are the time of the latest change seen; deltas
+reach back ``SYNC_SKEW_SECONDS`` before the token so writes stamped by a
+slightly slow clock, or committed just after the previous sync, are not
+missed. Re-applying a product the terminal already has is harmless.
+"""
+from datetime import datetime, timedelta, timezone
+import hashlib
+import os
+
+from utils.product_lookup import LOOKUP_FIELDS
+
+SYNC_SKEW = timedelta(seconds=int(os.environ.get("SYNC_SKEW_SECONDS", 5)))
+# Tombstones expire after this long; older tokens get a fresh snapshot
+TOMBSTONE_RETENTION = timedelta(days=int(os.environ.get("SYNC_TOMBSTONE_DAYS", 30)))
+
+SYNC_FIELDS = LOOKUP_FIELDS
+
+
+def sync_now() -> datetime:
+    """Timestamp for syncedAt, truncated to what BSON dates store"""
+    now = datetime.now(timezone.utc)
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+def _as_utc(value: datetime) -> datetime:
+    # Motor returns naive datetimes in UTC unless the client is tz aware
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def encode_token(value: datetime) -> str:
+    return str(int(_as_utc(value).timestamp() * 1000))
+
+
+def decode_token(token: str) -> datetime:
+    """Version token back to its timestamp; ValueError if malformed"""
+    millis = int(token)
+    if millis < 0:
+        raise ValueError("Invalid sync token")
+    return datetime.fromtimestamp(millis / 1000, tz=timezone.utc)
+
+
+def latest_change(*stamps) -> datetime:
+    """Most recent of the given change timestamps (None entries ignored)"""
+    stamps = [_as_utc(stamp) for stamp in stamps if stamp is not None]
+    return max(stamps) if stamps else datetime.fromtimestamp(0, tz=timezone.utc)
+
+
+def sync_etag(since, latest: datetime) -> str:
+    digest = hashlib.sha256(f"{since}:{encode_token(latest)}".encode()).hexdigest()[:32]
+    return f'"{digest}"'
+
+
+def needs_snapshot(since: datetime) -> bool:
+    """True when tombstones for deletes after ``since`` may have expired"""
+    return since < datetime.now(timezone.utc) - TOMBSTONE_RETENTION
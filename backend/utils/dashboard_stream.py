@@ -0,0 +1,393 @@
+"""Live dashboard deltas pushed over Server-Sent Events.
+
+``DashboardHub`` keeps the running sales totals, the top products by
+revenue and the set of low-stock products in memory. It is seeded from
+MongoDB once at startup and then kept current by a batched event bus
+subscriber, so open dashboards no longer re-run the stats aggregation.
+After each batch the hub broadcasts compact deltas:
+
+``sales``
+    Count and amount of the new sales, the new totals (overall, today and
+    the rolling week and month, placed by each sale's ``saleDate``) and the
+    latest few sales for the recent-sales list.
+``lowStock``
+    A product crossed its reorder point in either direction.
+``topProducts``
+    The top products by revenue changed: order, membership, or the
+    quantity or revenue of a listed product.
+
+A new connection first gets a ``snapshot``. Every frame is encoded once
+and shared by all connections. Each connection has a bounded send buffer;
+a client that falls behind is disconnected and resumes with
+``Last-Event-ID`` from a ring of recent frames, or gets a fresh snapshot
+when its id is too old or from before a restart. Heartbeats are comment
+frames sent to everyone by one task, so idle connections cost a queue and
+a parked coroutine each and no timers.
+
+The hub only sees events published in this process. Run one API worker
+per set of dashboards, or put a shared bus in front of it.
+"""
+from collections import deque
+from datetime import datetime, timedelta
+from fastapi.encoders import jsonable_encoder
+import asyncio
+import json
+import logging
+import os
+import time
+
+from utils.events import SaleCreated, StockChanged, ProductUpserted, ProductDeleted
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_SECONDS = float(os.environ.get("DASHBOARD_HEARTBEAT_SECONDS", 15))
+BUFFER_SIZE = int(os.environ.get("DASHBOARD_BUFFER_SIZE", 64))
+REPLAY_SIZE = int(os.environ.get("DASHBOARD_REPLAY_SIZE", 1000))
+MAX_CONNECTIONS = int(os.environ.get("DASHBOARD_MAX_CONNECTIONS", 10000))
+RETRY_MS = 3000
+TOP_PRODUCTS = 5
+RECENT_SALES = 5
+# Worst shortfalls sent in a snapshot; the low-stock screen pages the rest
+LOW_STOCK_ITEMS = 20
+# Same rolling windows as GET /sales/stats; sales are kept in minute buckets
+WEEK = timedelta(days=7)
+MONTH = timedelta(days=30)
+MINUTE = timedelta(minutes=1)
+
+HEARTBEAT = b": ping\n\n"
+# Ends a connection's stream; never sent to the client
+CLOSE = None
+
+EVENT_TYPES = (SaleCreated, StockChanged, ProductUpserted, ProductDeleted)
+
+
+def _frame(event_id: str, event_type: str, data) -> bytes:
+    body = json.dumps(jsonable_encoder(data), separators=(",", ":"))
+    return f"id: {event_id}\nevent: {event_type}\ndata: {body}\n\n".encode()
+
+
+def _low_stock_item(product: dict) -> dict:
+    return {key: product.get(key) for key in ("id", "name", "sku", "stock")}
+
+
+def _local(value):
+    """Naive local time, to compare with ``datetime.now()``; None if not a date"""
+    if not isinstance(value, datetime):
+        return None
+    return value.astimezone().replace(tzinfo=None) if value.tzinfo else value
+
+
+def _recent_sale(sale: dict) -> dict:
+    return {
+        "id": sale["id"],
+        "invoiceNumber": sale.get("invoiceNumber"),
+        "customerName": sale.get("customerName"),
+        "itemCount": len(sale.get("items", [])),
+        "total": sale.get("total", 0),
+        "paymentStatus": sale.get("paymentStatus"),
+        "saleDate": sale.get("saleDate"),
+    }
+
+
+class Listener:
+    def __init__(self, buffer_size: int):
+        self.queue = asyncio.Queue(maxsize=buffer_size)
+
+    def close(self):
+        # Make room for the close marker behind whatever is buffered
+        while self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(CLOSE)
+
+
+class DashboardHub:
+    def __init__(self, buffer_size: int = BUFFER_SIZE, replay_size: int = REPLAY_SIZE,
+                 max_connections: int = MAX_CONNECTIONS):
+        self.buffer_size = buffer_size
+        self.max_connections = max_connections
+        # Ids from an earlier process must not match this one's sequence
+        self.epoch = format(int(time.time()), "x")
+        self._seq = 0
+        self._replay = deque(maxlen=replay_size)  # (seq, frame)
+        self._listeners = set()
+        self._db = None
+        self._heartbeat = None
+        self.loaded = False
+        self.overflows = 0
+        self.sent = 0
+
+        self.day = None
+        self.total_sales = 0.0
+        self.total_transactions = 0
+        self.today_sales = 0.0
+        self.today_transactions = 0
+        self._minutes = {}  # minute -> sales total, for the last MONTH
+        self._products = {}  # product id -> [name, quantity, revenue]
+        self._top = []
+        self._low = {}  # product id -> low-stock item
+        self._recent = deque(maxlen=RECENT_SALES)
+
+    async def start(self, db):
+        """Seed the state from MongoDB and start the heartbeat"""
+        self._db = db
+        await self._load()
+        self._heartbeat = asyncio.create_task(self._run_heartbeat())
+
+    async def stop(self):
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            await asyncio.gather(self._heartbeat, return_exceptions=True)
+        for listener in list(self._listeners):
+            listener.close()
+
+    async def _load(self):
+        now = datetime.now()
+        today_start = datetime(now.year, now.month, now.day)
+        result = await self._db.sales.aggregate([
+            {"$facet": {
+                "totalSales": [
+                    {"$group": {"_id": None, "total": {"$sum": "$total"}, "count": {"$sum": 1}}}
+                ],
+                "todaySales": [
+                    {"$match": {"saleDate": {"$gte": today_start}}},
+                    {"$group": {"_id": None, "total": {"$sum": "$total"}, "count": {"$sum": 1}}}
+                ],
+                "minutes": [
+                    {"$match": {"saleDate": {"$gte": now - MONTH}}},
+                    {"$group": {
+                        "_id": {"$subtract": ["$saleDate", {"$mod": [{"$toLong": "$saleDate"}, 60000]}]},
+                        "total": {"$sum": "$total"}
+                    }}
+                ],
+                "products": [
+                    {"$unwind": "$items"},
+                    {"$group": {
+                        "_id": "$items.productId",
+                        "productName": {"$first": "$items.productName"},
+                        "totalQuantity": {"$sum": "$items.quantity"},
+                        "totalRevenue": {"$sum": "$items.lineTotal"}
+                    }}
+                ],
+                "recentSales": [
+                    {"$sort": {"saleDate": -1}},
+                    {"$limit": RECENT_SALES}
+                ]
+            }}
+        ]).to_list(length=1)
+        data = result[0] if result else {}
+        total = (data.get("totalSales") or [{"total": 0, "count": 0}])[0]
+        today = (data.get("todaySales") or [{"total": 0, "count": 0}])[0]
+        self.day = today_start.date()
+        self.total_sales = total["total"]
+        self.total_transactions = total["count"]
+        self.today_sales = today["total"]
+        self.today_transactions = today["count"]
+        self._minutes = {row["_id"]: row["total"] for row in data.get("minutes", [])}
+        self._products = {
+            row["_id"]: [row["productName"], row["totalQuantity"], row["totalRevenue"]]
+            for row in data.get("products", [])
+        }
+        self._top = self._rank()
+        self._recent = deque(
+            (_recent_sale(sale) for sale in reversed(data.get("recentSales", []))), maxlen=RECENT_SALES
+        )
+
+        low = await self._db.products.find(
+            {"stock.isLow": True}, {"_id": 0, "id": 1, "name": 1, "sku": 1, "stock": 1}
+        ).to_list(None)
+        self._low = {product["id"]: _low_stock_item(product) for product in low}
+        self.loaded = True
+
+    def _rank(self) -> list:
+        ranked = sorted(self._products.items(), key=lambda item: item[1][2], reverse=True)[:TOP_PRODUCTS]
+        return [
+            {"productId": product_id, "productName": name, "totalQuantity": quantity, "totalRevenue": revenue}
+            for product_id, (name, quantity, revenue) in ranked
+        ]
+
+    def _windows(self, now: datetime) -> dict:
+        """Rolling week and month totals; drops buckets older than the month"""
+        month_start = now - MONTH
+        for minute in [minute for minute in self._minutes if minute + MINUTE <= month_start]:
+            del self._minutes[minute]
+        week_start = now - WEEK
+        return {
+            "weekSales": sum(amount for minute, amount in self._minutes.items() if minute + MINUTE > week_start),
+            "monthSales": sum(self._minutes.values()),
+        }
+
+    def snapshot(self) -> dict:
+        return {
+            "totalSales": self.total_sales,
+            "totalTransactions": self.total_transactions,
+            "todaySales": self.today_sales,
+            "todayTransactions": self.today_transactions,
+            **self._windows(datetime.now()),
+            "topProducts": self._top,
+            "recentSales": list(reversed(self._recent)),
+            "lowStockCount": len(self._low),
+            "lowStockItems": sorted(
+                self._low.values(), key=lambda item: (item.get("stock") or {}).get("shortfall", 0), reverse=True
+            )[:LOW_STOCK_ITEMS],
+        }
+
+    async def apply(self, events: list):
+        """Event bus handler: fold a batch of events into the state and broadcast"""
+        if not self.loaded:
+            return
+        now = datetime.now()
+        today = now.date()
+        if today != self.day:
+            self.day = today
+            self.today_sales = 0.0
+            self.today_transactions = 0
+
+        count = 0
+        amount = 0.0
+        stock = {}
+        deleted = []
+        for event in events:
+            if isinstance(event, SaleCreated):
+                sale = event.sale
+                count += 1
+                amount += sale.get("total", 0)
+                sale_date = _local(sale.get("saleDate")) or now
+                if sale_date.date() >= today:
+                    self.today_sales += sale.get("total", 0)
+                    self.today_transactions += 1
+                minute = sale_date.replace(second=0, microsecond=0)
+                if minute + MINUTE > now - MONTH:
+                    self._minutes[minute] = self._minutes.get(minute, 0) + sale.get("total", 0)
+                for item in sale.get("items", []):
+                    entry = self._products.setdefault(item["productId"], [item.get("productName"), 0, 0.0])
+                    entry[1] += item.get("quantity", 0)
+                    entry[2] += item.get("lineTotal", 0)
+                self._recent.append(_recent_sale(sale))
+            elif isinstance(event, StockChanged):
+                stock[event.product_id] = event.stock
+            elif isinstance(event, ProductUpserted) and event.product.get("stock"):
+                stock[event.product["id"]] = event.product["stock"]
+            elif isinstance(event, ProductDeleted):
+                stock.pop(event.product["id"], None)
+                deleted.append(event.product["id"])
+
+        if count:
+            self.total_sales += amount
+            self.total_transactions += count
+            self._publish("sales", {
+                "count": count,
+                "amount": amount,
+                "totalSales": self.total_sales,
+                "totalTransactions": self.total_transactions,
+                "todaySales": self.today_sales,
+                "todayTransactions": self.today_transactions,
+                **self._windows(now),
+                "recentSales": list(reversed(self._recent)),
+            })
+            top = self._rank()
+            if top != self._top:
+                self._publish("topProducts", {"topProducts": top})
+            self._top = top
+
+        await self._apply_stock(stock, deleted)
+
+    async def _apply_stock(self, stock: dict, deleted: list):
+        became_low = [product_id for product_id, values in stock.items()
+                      if values.get("isLow") and product_id not in self._low]
+        details = {}
+        if became_low:
+            products = await self._db.products.find(
+                {"id": {"$in": became_low}}, {"_id": 0, "id": 1, "name": 1, "sku": 1}
+            ).to_list(None)
+            details = {product["id"]: product for product in products}
+
+        for product_id, values in stock.items():
+            if values.get("isLow"):
+                if product_id in self._low:
+                    self._low[product_id]["stock"] = values
+                    continue
+                item = _low_stock_item({**details.get(product_id, {"id": product_id}), "stock": values})
+                self._low[product_id] = item
+                self._publish("lowStock", {"isLow": True, "product": item, "lowStockCount": len(self._low)})
+            elif product_id in self._low:
+                item = self._low.pop(product_id)
+                item["stock"] = values
+                self._publish("lowStock", {"isLow": False, "product": item, "lowStockCount": len(self._low)})
+        for product_id in deleted:
+            item = self._low.pop(product_id, None)
+            if item is not None:
+                self._publish("lowStock", {"isLow": False, "product": item, "lowStockCount": len(self._low)})
+
+    def _publish(self, event_type: str, data: dict):
+        self._seq += 1
+        frame = _frame(f"{self.epoch}-{self._seq}", event_type, data)
+        self._replay.append((self._seq, frame))
+        self._broadcast(frame)
+
+    def _broadcast(self, frame: bytes):
+        for listener in list(self._listeners):
+            try:
+                listener.queue.put_nowait(frame)
+            except asyncio.QueueFull:
+                # Too slow to keep up; it reconnects and resumes from the ring
+                self.overflows += 1
+                self._listeners.discard(listener)
+                listener.close()
+
+    async def _run_heartbeat(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+            self._broadcast(HEARTBEAT)
+
+    def _resume(self, last_event_id: str):
+        """Frames after ``last_event_id``, or None when a snapshot is needed"""
+        epoch, _, seq = (last_event_id or "").partition("-")
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        seq = int(seq)
+        oldest = self._replay[0][0] if self._replay else self._seq + 1
+        if seq < oldest - 1 or seq > self._seq:
+            return None
+        return [frame for frame_seq, frame in self._replay if frame_seq > seq]
+
+    def connect(self, last_event_id: str = None):
+        """Register a connection and return it with the frames to send first"""
+        listener = Listener(self.buffer_size)
+        frames = self._resume(last_event_id)
+        if frames is None:
+            frames = [_frame(f"{self.epoch}-{self._seq}", "snapshot", self.snapshot())]
+        self._listeners.add(listener)
+        return listener, [f"retry: {RETRY_MS}\n\n".encode(), *frames]
+
+    def disconnect(self, listener: Listener):
+        self._listeners.discard(listener)
+
+    @property
+    def full(self) -> bool:
+        return len(self._listeners) >= self.max_connections
+
+    async def stream(self, listener: Listener, first: list):
+        """Async generator of SSE frames for one connection"""
+        try:
+            for frame in first:
+                yield frame
+            while True:
+                frame = await listener.queue.get()
+                if frame is CLOSE:
+                    return
+                self.sent += 1
+                yield frame
+        finally:
+            self.disconnect(listener)
+
+    def metrics(self) -> dict:
+        return {
+            "connections": len(self._listeners),
+            "lastEventId": f"{self.epoch}-{self._seq}",
+            "replayFrames": len(self._replay),
+            "framesSent": self.sent,
+            "overflows": self.overflows,
+        }
+
+
+dashboard_hub = DashboardHub()
@@ -0,0 +1,365 @@
+"""In-process domain event bus.
+
+Handlers publish typed events (``SaleCreated``, ``StockChanged``, ...) and
+caches, indexes and projections subscribe to them instead of being called
+from every handler that changes the underlying data.
+
+Delivery:
+
+* ``inline`` subscribers run inside ``publish``, in subscription order,
+  before the request continues. Use them for cheap in-memory indexes that
+  must reflect a write before its response is sent.
+* Other subscribers get their own bounded queues, one per partition.
+  Events are partitioned by ``event.key`` (sale or product id), so events
+  for one key are handled in publish order while different keys proceed in
+  parallel. A full queue makes ``publish`` wait (backpressure).
+* A subscriber with ``batch_size > 1`` receives lists of up to that many
+  events, collected for at most ``batch_ms``.
+
+With ``EVENT_OUTBOX`` set to ``ack`` or ``spill``, every event is also
+written to the ``event_outbox`` collection (through a write-behind
+batcher) before it is delivered. ``durable`` subscribers keep a checkpoint
+in ``event_checkpoints`` and, on start, first replay outbox events they
+have not seen. They use a single partition so the checkpoint only moves
+forward, and it only moves past events the handler accepted: a failing
+batch is retried with backoff, and if it keeps failing the subscriber is
+halted. A halted subscriber drops new events; they are still in the outbox
+and are replayed from its checkpoint on the next start. Delivery is at
+least once, so durable handlers must be idempotent.
+"""
+from dataclasses import dataclass, field, asdict
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+import abc
+from bson import ObjectId
+import asyncio
+import logging
+import os
+import time
+import zlib
+
+from utils.write_behind import WriteBehind
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_MODE = os.environ.get("EVENT_OUTBOX", "off").lower()
+OUTBOX_RETENTION = timedelta(days=int(os.environ.get("EVENT_OUTBOX_DAYS", 7)))
+PARTITIONS = int(os.environ.get("EVENT_BUS_PARTITIONS", 4))
+QUEUE_SIZE = int(os.environ.get("EVENT_BUS_QUEUE_SIZE", 1000))
+DELIVERY_ATTEMPTS = int(os.environ.get("EVENT_DELIVERY_ATTEMPTS", 5))
+RETRY_SECONDS = 0.5
+
+
+@dataclass(frozen=True)
+class Event(abc.ABC):
+    @property
+    @abc.abstractmethod
+    def key(self) -> str:
+        """Partition key; events with the same key are delivered in order"""
+
+
+@dataclass(frozen=True)
+class SaleCreated(Event):
+    sale: dict
+    # Replayed from an offline terminal rather than rung up just now
+    offline: bool = False
+
+    @property
+    def key(self) -> str:
+        return self.sale["id"]
+
+
+@dataclass(frozen=True)
+class SaleReturned(Event):
+    sale_id: str
+    items: list
+    refund_amount: float
+
+    @property
+    def key(self) -> str:
+        return self.sale_id
+
+
+@dataclass(frozen=True)
+class SaleCancelled(Event):
+    sale_id: str
+    items: list = field(default_factory=list)
+
+    @property
+    def key(self) -> str:
+        return self.sale_id
+
+
+@dataclass(frozen=True)
+class StockChanged(Event):
+    product_id: str
+    stock: dict
+
+    @property
+    def key(self) -> str:
+        return self.product_id
+
+
+@dataclass(frozen=True)
+class ProductUpserted(Event):
+    product: dict
+    # The product before this write, None for a new product
+    previous: Optional[dict] = None
+    # Part of a bulk write (import); aggregate views are rebuilt afterwards
+    bulk: bool = False
+
+    @property
+    def key(self) -> str:
+        return self.product["id"]
+
+
+@dataclass(frozen=True)
+class ProductDeleted(Event):
+    product: dict
+
+    @property
+    def key(self) -> str:
+        return self.product["id"]
+
+
+EVENT_TYPES = {
+    cls.__name__: cls
+    for cls in (SaleCreated, SaleReturned, SaleCancelled, StockChanged, ProductUpserted, ProductDeleted)
+}
+
+
+def _partition(key: str, partitions: int) -> int:
+    # Stable across processes, unlike hash() on str
+    return zlib.crc32(key.encode()) % partitions
+
+
+class Subscription:
+    def __init__(self, name: str, event_types: tuple, handler, inline: bool, batch_size: int,
+                 batch_ms: float, durable: bool, partitions: int, queue_size: int):
+        self.name = name
+        self.event_types = event_types
+        self.handler = handler
+        self.inline = inline
+        self.batch_size = batch_size
+        self.batch_wait = batch_ms / 1000
+        self.durable = durable
+        self.partitions = 1 if durable else partitions
+        self.queues = [] if inline else [asyncio.Queue(maxsize=queue_size) for _ in range(self.partitions)]
+        self.tasks = []
+        self.delivered = 0
+        self.failed = 0
+        self.dropped = 0
+        self.retries = 0
+        self.halted = False
+        self.max_lag = 0.0
+
+    async def call(self, events: list):
+        await self.handler(events if self.batch_size > 1 else events[0])
+
+    def metrics(self) -> dict:
+        return {
+            "inline": self.inline,
+            "durable": self.durable,
+            "backlog": sum(queue.qsize() for queue in self.queues),
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "retries": self.retries,
+            "halted": self.halted,
+            "maxLagMs": round(self.max_lag * 1000, 2),
+        }
+
+
+class EventBus:
+    def __init__(self, partitions: int = PARTITIONS, queue_size: int = QUEUE_SIZE, outbox_mode: str = OUTBOX_MODE):
+        self.partitions = partitions
+        self.queue_size = queue_size
+        self._subscriptions = []
+        self._by_type = {}
+        self._db = None
+        self._outbox = WriteBehind("event_outbox", mode=outbox_mode) if outbox_mode in ("ack", "spill") else None
+        self._running = False
+        self.published = 0
+
+    def subscribe(self, name: str, event_types, handler, *, inline: bool = False, batch_size: int = 1,
+                  batch_ms: float = 50, durable: bool = False) -> Subscription:
+        """Register an async handler for the given Event subclasses"""
+        event_types = tuple(event_types)
+        for event_type in event_types:
+            if not (isinstance(event_type, type) and issubclass(event_type, Event)):
+                raise TypeError(f"{event_type!r} is not an Event type")
+        if inline and (durable or batch_size > 1):
+            raise ValueError("Inline subscribers cannot be durable or batched")
+        subscription = Subscription(
+            name, event_types, handler, inline, batch_size, batch_ms, durable,
+            self.partitions, self.queue_size
+        )
+        self._subscriptions.append(subscription)
+        for event_type in event_types:
+            self._by_type.setdefault(event_type, []).append(subscription)
+        if self._running and not inline:
+            self._start_workers(subscription)
+        return subscription
+
+    async def publish(self, *events: Event):
+        positions = [None] * len(events)
+        if self._outbox is not None and self._running:
+            docs = [
+                {
+                    "_id": ObjectId(),
+                    "type": type(event).__name__,
+                    "key": event.key,
+                    "payload": asdict(event),
+                    "createdAt": datetime.now(timezone.utc),
+                }
+                for event in events
+            ]
+            # Written together so they share outbox batches
+            await asyncio.gather(*(self._outbox.write(doc) for doc in docs))
+            positions = [doc["_id"] for doc in docs]
+        for event, position in zip(events, positions):
+            self.published += 1
+            for subscription in self._by_type.get(type(event), ()):
+                if subscription.inline:
+                    try:
+                        await subscription.call([event])
+                        subscription.delivered += 1
+                    except Exception:
+                        subscription.failed += 1
+                        logger.exception(f"Event subscriber {subscription.name} failed on {type(event).__name__}")
+                elif not self._running or subscription.halted:
+                    # Nothing is consuming (scripts, startup, a halted durable
+                    # subscriber); queues would block
+                    subscription.dropped += 1
+                else:
+                    queue = subscription.queues[_partition(event.key, subscription.partitions)]
+                    await queue.put((position, event, time.monotonic()))
+
+    async def start(self, db=None):
+        """Start delivery; with an outbox, durable subscribers catch up first"""
+        self._db = db
+        if self._outbox is not None and db is not None:
+            await self._outbox.start(db.event_outbox)
+            for subscription in self._subscriptions:
+                if subscription.durable:
+                    await self._catch_up(subscription)
+        for subscription in self._subscriptions:
+            if not subscription.inline:
+                self._start_workers(subscription)
+        self._running = True
+
+    def _start_workers(self, subscription: Subscription):
+        subscription.tasks = [
+            asyncio.create_task(self._worker(subscription, queue)) for queue in subscription.queues
+        ]
+
+    async def _catch_up(self, subscription: Subscription):
+        checkpoint = await self._db.event_checkpoints.find_one({"_id": subscription.name})
+        if checkpoint is None:
+            # A new projection starts from now rather than replaying history
+            await self._save_checkpoint(subscription, ObjectId())
+            return
+        query = {
+            "_id": {"$gt": checkpoint["position"]},
+            "type": {"$in": [event_type.__name__ for event_type in subscription.event_types]},
+        }
+        batch = []
+        replayed = 0
+        async for doc in self._db.event_outbox.find(query).sort("_id", 1):
+            batch.append((doc["_id"], EVENT_TYPES[doc["type"]](**doc["payload"])))
+            if len(batch) >= subscription.batch_size:
+                if not await self._deliver(subscription, batch):
+                    break
+                replayed += len(batch)
+                batch = []
+        else:
+            if batch and await self._deliver(subscription, batch):
+                replayed += len(batch)
+        if replayed:
+            logger.info(f"Event subscriber {subscription.name} replayed {replayed} events")
+
+    async def _save_checkpoint(self, subscription: Subscription, position):
+        await self._db.event_checkpoints.update_one(
+            {"_id": subscription.name}, {"$max": {"position": position}}, upsert=True
+        )
+
+    async def _deliver(self, subscription: Subscription, batch: list) -> bool:
+        """Hand a batch to the subscriber; durable ones retry it and only
+        checkpoint once it is handled. False if it was not delivered."""
+        events = [event for _, event in batch]
+        attempts = max(DELIVERY_ATTEMPTS, 1) if subscription.durable else 1
+        for attempt in range(attempts):
+            try:
+                await subscription.call(events)
+                break
+            except Exception:
+                if attempt + 1 < attempts:
+                    subscription.retries += 1
+                    logger.warning(
+                        f"Event subscriber {subscription.name} failed on {len(batch)} events, retrying",
+                        exc_info=True
+                    )
+                    await asyncio.sleep(RETRY_SECONDS * 2 ** attempt)
+                    continue
+                subscription.failed += len(batch)
+                logger.exception(f"Event subscriber {subscription.name} failed on {len(batch)} events")
+                if subscription.durable:
+                    # The checkpoint stays before this batch; the next start replays it
+                    subscription.halted = True
+                    logger.error(f"Durable event subscriber {subscription.name} halted")
+                return False
+        subscription.delivered += len(batch)
+        if subscription.durable and self._db is not None:
+            positions = [position for position, _ in batch if position is not None]
+            if positions:
+                await self._save_checkpoint(subscription, max(positions))
+        return True
+
+    async def _worker(self, subscription: Subscription, queue: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await queue.get()]
+            if subscription.batch_size > 1:
+                deadline = loop.time() + subscription.batch_wait
+                while len(items) < subscription.batch_size:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        items.append(await asyncio.wait_for(queue.get(), remaining))
+                    except asyncio.TimeoutError:
+                        break
+            if subscription.halted:
+                subscription.dropped += len(items)
+            else:
+                subscription.max_lag = max(subscription.max_lag, time.monotonic() - items[0][2])
+                await self._deliver(subscription, [(position, event) for position, event, _ in items])
+            for _ in items:
+                queue.task_done()
+
+    async def stop(self, timeout: float = 10):
+        """Deliver what is queued, then stop the workers and the outbox"""
+        self._running = False
+        queues = [queue for subscription in self._subscriptions for queue in subscription.queues]
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in queues)), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Event bus stopped with undelivered events")
+        tasks = [task for subscription in self._subscriptions for task in subscription.tasks]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._outbox is not None:
+            await self._outbox.drain()
+
+    def metrics(self) -> dict:
+        metrics = {
+            "published": self.published,
+            "subscribers": {subscription.name: subscription.metrics() for subscription in self._subscriptions},
+        }
+        if self._outbox is not None:
+            metrics["outbox"] = self._outbox.metrics()
+        return metrics
+
+
+event_bus = EventBus()
@@ -0,0 +1,74 @@
+"""Category and brand facet counts for product filter dropdowns.
+
+Counts are rebuilt from one ``$group`` aggregation and then kept current by
+applying the before/after delta of every product write, so reading the
+facets costs O(facets) instead of a collection scan.
+"""
+from collections import Counter
+
+# Aggregation that produces the rows consumed by FacetStore.rebuild
+FACET_PIPELINE = [
+    {"$group": {"_id": {"category": "$category", "brand": "$brand"}, "count": {"$sum": 1}}},
+]
+
+
+class FacetStore:
+    """Product counts per category, per brand and per (category, brand)"""
+
+    def __init__(self):
+        self.loaded = False
+        self._categories = Counter()
+        self._brands = Counter()
+        self._category_brands = {}  # category -> Counter(brand)
+
+    @staticmethod
+    def _key(product: dict) -> tuple:
+        return product.get("category") or None, product.get("brand") or None
+
+    @staticmethod
+    def _bump(counter: Counter, key, delta: int):
+        counter[key] += delta
+        if counter[key] <= 0:
+            del counter[key]
+
+    def _count(self, category, brand, delta: int):
+        if category is not None:
+            self._bump(self._categories, category, delta)
+        if brand is not None:
+            self._bump(self._brands, brand, delta)
+            if category is not None:
+                brands = self._category_brands.setdefault(category, Counter())
+                self._bump(brands, brand, delta)
+                if not brands:
+                    del self._category_brands[category]
+
+    def rebuild(self, rows):
+        """Replace all counts with ``FACET_PIPELINE`` output"""
+        self._categories.clear()
+        self._brands.clear()
+        self._category_brands.clear()
+        for row in rows:
+            self._count(row["_id"].get("category") or None, row["_id"].get("brand") or None, row["count"])
+        self.loaded = True
+
+    def apply(self, before: dict = None, after: dict = None):
+        """Apply a product write: before is None for creates, after is None for deletes"""
+        old = self._key(before) if before else None
+        new = self._key(after) if after else None
+        if old == new:
+            return
+        if old is not None:
+            self._count(*old, -1)
+        if new is not None:
+            self._count(*new, 1)
+
+    def categories(self) -> dict:
+        return dict(sorted(self._categories.items()))
+
+    def brands(self, category: str = None) -> dict:
+        if category is None:
+            return dict(sorted(self._brands.items()))
+        return dict(sorted(self._category_brands.get(category, {}).items()))
+
+
+facet_store = FacetStore()
@@ -0,0 +1,307 @@
+"""Typo-tolerant search over products, customers and suppliers.
+
+Each entity type has a ``FuzzyIndex``: token postings plus a q-gram index
+over the distinct tokens. A misspelt query token is matched by counting
+shared padded bigrams (an edit destroys at most two, so candidates within
+edit distance k must share all but 2k of them) and verifying the survivors
+with a bounded Levenshtein distance. The gram index only ever grows; tokens
+whose documents are gone stay in it as dead entries, and once they make up
+too much of it the index is rebuilt in the background and swapped in.
+"""
+from bisect import bisect_left, insort
+from collections import Counter
+import asyncio
+import heapq
+import logging
+import os
+import re
+import sys
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+MAX_TERM_LENGTH = 32
+MAX_TOKENS_PER_DOC = 16
+# Prefix expansion stops after this many vocabulary terms
+MAX_PREFIX_TERMS = 200
+# Rebuild once this share of gram-indexed terms no longer has any documents
+DEAD_REBUILD_RATIO = 0.25
+# Weight of a token matched by prefix only (the user is still typing)
+PREFIX_WEIGHT = 0.9
+
+# Fields folded into the searchable text of each entity type
+SEARCH_FIELDS = {
+    "products": ("name", "sku", "barcode", "brand", "category"),
+    "customers": ("name", "phone", "email"),
+    "suppliers": ("name", "phone", "email", "gstNumber"),
+}
+
+
+def tokenize(text: str) -> list:
+    return [token[:MAX_TERM_LENGTH] for token in _TOKEN_RE.findall(text.lower())]
+
+
+def max_typos(token: str) -> int:
+    """Edit distance tolerated for a query token of this length"""
+    if len(token) <= 3 or not token.isalpha():
+        # Short words and codes (SKUs, phones) only match exactly or by prefix
+        return 0
+    if len(token) <= 7:
+        return 1
+    return 2
+
+
+def bigrams(token: str) -> set:
+    padded = f"^{token}$"
+    return {padded[i:i + 2] for i in range(len(padded) - 1)}
+
+
+def bounded_levenshtein(a: str, b: str, limit: int) -> int:
+    """Edit distance, or limit + 1 as soon as it must exceed limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        row_min = i
+        for j, cb in enumerate(b, 1):
+            cost = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            current.append(cost)
+            if cost < row_min:
+                row_min = cost
+        if row_min > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class FuzzyIndex:
+    """Token postings + bigram term index for one entity type, capped at max_docs"""
+
+    def __init__(self, max_docs: int):
+        self.max_docs = max_docs
+        self.truncated = False
+        self._docs = {}  # id -> (label, tokens)
+        self._postings = {}  # token -> set(id)
+        self._terms = []  # sorted live tokens, for prefix matching
+        self._gram_terms = []  # term id -> token (append only)
+        self._gram_term_ids = {}  # token -> term id
+        self._grams = {}  # bigram -> [term id]
+        self._live_gram_terms = 0
+
+    def __len__(self):
+        return len(self._docs)
+
+    @property
+    def dead_terms(self) -> int:
+        return len(self._gram_terms) - self._live_gram_terms
+
+    def needs_rebuild(self) -> bool:
+        gram_terms = len(self._gram_terms)
+        return gram_terms > 100 and self.dead_terms / gram_terms > DEAD_REBUILD_RATIO
+
+    def _add_term(self, token: str):
+        insort(self._terms, token)
+        if max_typos(token) == 0:
+            return
+        self._live_gram_terms += 1
+        if token in self._gram_term_ids:
+            return
+        term_id = len(self._gram_terms)
+        self._gram_terms.append(token)
+        self._gram_term_ids[token] = term_id
+        for gram in bigrams(token):
+            self._grams.setdefault(gram, []).append(term_id)
+
+    def add(self, doc_id: str, label: str, text: str):
+        self.remove(doc_id)
+        if len(self._docs) >= self.max_docs:
+            self.truncated = True
+            return
+        tokens = tuple(dict.fromkeys(tokenize(text)))[:MAX_TOKENS_PER_DOC]
+        self._docs[doc_id] = (label, tokens)
+        for token in tokens:
+            ids = self._postings.get(token)
+            if ids is None:
+                ids = self._postings[token] = set()
+                self._add_term(token)
+            ids.add(doc_id)
+
+    def remove(self, doc_id: str):
+        entry = self._docs.pop(doc_id, None)
+        if entry is None:
+            return
+        for token in entry[1]:
+            ids = self._postings[token]
+            ids.discard(doc_id)
+            if not ids:
+                del self._postings[token]
+                del self._terms[bisect_left(self._terms, token)]
+                if token in self._gram_term_ids:
+                    self._live_gram_terms -= 1
+
+    def _typo_matches(self, token: str, typos: int) -> dict:
+        grams = bigrams(token)
+        threshold = len(grams) - 2 * typos
+        counts = Counter()
+        for gram in grams:
+            term_ids = self._grams.get(gram)
+            if term_ids:
+                counts.update(term_ids)
+        matches = {}
+        for term_id, shared in counts.items():
+            if shared < threshold:
+                continue
+            term = self._gram_terms[term_id]
+            if term not in self._postings:
+                continue
+            distance = bounded_levenshtein(token, term, typos)
+            if distance <= typos:
+                matches[term] = 1 - distance / (len(token) + 1)
+        return matches
+
+    def _term_matches(self, token: str) -> dict:
+        """Indexed terms matching a query token -> match weight"""
+        typos = max_typos(token)
+        if typos:
+            weights = self._typo_matches(token, typos)
+        else:
+            weights = {token: 1.0} if token in self._postings else {}
+        terms = self._terms
+        i = bisect_left(terms, token)
+        end = min(len(terms), i + MAX_PREFIX_TERMS)
+        while i < end and terms[i].startswith(token):
+            term = terms[i]
+            if term != token:
+                weights[term] = max(weights.get(term, 0), PREFIX_WEIGHT)
+            i += 1
+        return weights
+
+    def search(self, query: str, limit: int = 10) -> list:
+        """Best matching (score, id, label) entries; score is in [0, 1]"""
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        scores = {}
+        for token in tokens:
+            best = {}
+            for term, weight in self._term_matches(token).items():
+                for doc_id in self._postings[term]:
+                    if weight > best.get(doc_id, 0):
+                        best[doc_id] = weight
+            for doc_id, weight in best.items():
+                scores[doc_id] = scores.get(doc_id, 0) + weight
+        docs = self._docs
+        ranked = heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], docs[item[0]][0]))
+        return [(round(score / len(tokens), 3), doc_id, docs[doc_id][0]) for doc_id, score in ranked]
+
+    def memory_bytes(self) -> int:
+        """Approximate memory held by the index structures"""
+        size = sum(sys.getsizeof(obj) for obj in (
+            self._docs, self._postings, self._terms, self._gram_terms, self._gram_term_ids, self._grams
+        ))
+        for label, tokens in self._docs.values():
+            size += sys.getsizeof(label) + sys.getsizeof(tokens)
+        for token, ids in self._postings.items():
+            size += sys.getsizeof(token) + sys.getsizeof(ids)
+        for term_ids in self._grams.values():
+            size += sys.getsizeof(term_ids)
+        return size
+
+    def stats(self) -> dict:
+        return {
+            "documents": len(self._docs),
+            "terms": len(self._postings),
+            "gramTerms": len(self._gram_terms),
+            "deadTerms": self.dead_terms,
+            "truncated": self.truncated,
+            "memoryBytes": self.memory_bytes(),
+        }
+
+
+class FuzzySearchEngine:
+    """Per-type fuzzy indexes with background rebuild on drift"""
+
+    def __init__(self, max_docs: int):
+        self.max_docs = max_docs
+        self.indexes = {}
+        self._loaders = {}  # type -> async callable returning documents
+        self._rebuilds = {}  # type -> running task
+        self._pending = {}  # type -> writes made while a rebuild is running
+        self.rebuild_count = 0
+
+    def register(self, doc_type: str, loader):
+        self._loaders[doc_type] = loader
+
+    def loaded(self, doc_type: str) -> bool:
+        return doc_type in self.indexes
+
+    async def load(self, doc_type: str):
+        """Build an index from its loader and swap it in"""
+        self._pending[doc_type] = []
+        try:
+            docs = await self._loaders[doc_type]()
+            index = FuzzyIndex(self.max_docs)
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._fill, doc_type, index, docs)
+            for op, args in self._pending[doc_type]:
+                getattr(index, op)(*args)
+            self.indexes[doc_type] = index
+            self.rebuild_count += 1
+        finally:
+            del self._pending[doc_type]
+
+    @staticmethod
+    def _entry(doc_type: str, doc: dict) -> tuple:
+        text = " ".join(str(doc[field]) for field in SEARCH_FIELDS[doc_type] if doc.get(field))
+        return doc["id"], doc.get("name") or "", text
+
+    @classmethod
+    def _fill(cls, doc_type: str, index: FuzzyIndex, docs):
+        for doc in docs:
+            index.add(*cls._entry(doc_type, doc))
+
+    def _apply(self, doc_type: str, op: str, *args):
+        if doc_type in self._pending:
+            self._pending[doc_type].append((op, args))
+        index = self.indexes.get(doc_type)
+        if index is None:
+            return
+        getattr(index, op)(*args)
+        if index.needs_rebuild() and doc_type not in self._rebuilds:
+            self._schedule_rebuild(doc_type)
+
+    def add(self, doc_type: str, doc: dict):
+        """Index or re-index a document of the given type"""
+        self._apply(doc_type, "add", *self._entry(doc_type, doc))
+
+    def remove(self, doc_type: str, doc_id: str):
+        self._apply(doc_type, "remove", doc_id)
+
+    def _schedule_rebuild(self, doc_type: str):
+        task = asyncio.get_running_loop().create_task(self.load(doc_type))
+        self._rebuilds[doc_type] = task
+
+        def done(finished):
+            self._rebuilds.pop(doc_type, None)
+            if not finished.cancelled() and finished.exception():
+                logger.error(f"Fuzzy index rebuild for {doc_type} failed: {finished.exception()}")
+        task.add_done_callback(done)
+
+    def search(self, query: str, doc_types: list, limit: int = 10) -> dict:
+        return {
+            doc_type: self.indexes[doc_type].search(query, limit)
+            for doc_type in doc_types if doc_type in self.indexes
+        }
+
+    def stats(self) -> dict:
+        indexes = {doc_type: index.stats() for doc_type, index in self.indexes.items()}
+        return {
+            "indexes": indexes,
+            "memoryBytes": sum(s["memoryBytes"] for s in indexes.values()),
+            "rebuilds": self.rebuild_count,
+            "rebuilding": sorted(self._rebuilds),
+        }
+
+
+fuzzy_search = FuzzySearchEngine(int(os.environ.get("FUZZY_SEARCH_MAX_DOCS", 500000)))
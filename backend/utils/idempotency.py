@@ -0,0 +1,222 @@
+"""Idempotency keys for retried POS requests.
+
+A client sends the same ``Idempotency-Key`` header on every retry of one
+logical request. The first request claims the key in
+``idempotency_keys`` (TTL indexed on ``createdAt``) and stores its JSON
+response when done; retries get that response back without running the
+handler again. Recently completed keys are also kept in an in-process LRU
+so hot retries skip the database.
+
+Keys are scoped per endpoint and user, and bound to a hash of the request
+body: reusing a key for a different request is rejected. When a handler
+fails, the caller's ``recover`` hook is asked what it wrote anyway: if it
+wrote something, that result is stored for the retry; only if it wrote
+nothing is the key released so the retry runs the handler again.
+
+A claim is leased (``lockedUntil``) and the lease is renewed while the
+handler runs, so a slow request is never taken over. If the process dies
+mid-request the key stays pending only until the lease runs out; the next
+retry then takes the claim over and recovers as above.
+"""
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from fastapi.encoders import jsonable_encoder
+from pymongo.errors import DuplicateKeyError
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+
+DEFAULT_TTL = timedelta(hours=int(os.environ.get("IDEMPOTENCY_TTL_HOURS", 24)))
+DEFAULT_CACHE_SIZE = int(os.environ.get("IDEMPOTENCY_CACHE_SIZE", 10000))
+DEFAULT_LEASE = timedelta(seconds=int(os.environ.get("IDEMPOTENCY_LEASE_SECONDS", 60)))
+MAX_KEY_LENGTH = 255
+
+logger = logging.getLogger(__name__)
+
+
+class IdempotencyError(Exception):
+    pass
+
+
+class KeyInUse(IdempotencyError):
+    """The first request with this key has not finished yet"""
+
+
+class KeyMismatch(IdempotencyError):
+    """The key was already used for a different request"""
+
+
+def scoped_key(scope: str, key: str) -> str:
+    """Stored id of a key; handlers stamp what they write with it"""
+    return f"{scope}:{key}"
+
+
+def fingerprint(payload) -> str:
+    body = json.dumps(jsonable_encoder(payload), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+class IdempotencyStore:
+    def __init__(self, ttl: timedelta = DEFAULT_TTL, cache_size: int = DEFAULT_CACHE_SIZE,
+                 lease: timedelta = DEFAULT_LEASE):
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.lease = lease
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.replays = 0
+        self.takeovers = 0
+        self.recovered = 0
+
+    def _cached(self, key_id: str):
+        entry = self._cache.get(key_id)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] > self.ttl.total_seconds():
+            del self._cache[key_id]
+            return None
+        self._cache.move_to_end(key_id)
+        return entry[1]
+
+    def _remember(self, key_id: str, record: dict):
+        self._cache[key_id] = (time.monotonic(), record)
+        self._cache.move_to_end(key_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    @staticmethod
+    def _replay(record: dict, request_hash: str):
+        if record["requestHash"] != request_hash:
+            raise KeyMismatch("Idempotency-Key was already used for a different request")
+        if record["status"] != "done":
+            raise KeyInUse("A request with this Idempotency-Key is still being processed")
+        return record["response"]
+
+    async def run_once(self, db, scope: str, key: str, payload, call, recover=None):
+        """Await ``call()`` once per key and return its JSON-encoded result;
+        later calls with the same key return the stored result.
+
+        ``recover()``, if given, returns the response for what an abandoned
+        first attempt already wrote, or None if it wrote nothing.
+        """
+        if not key or len(key) > MAX_KEY_LENGTH:
+            raise IdempotencyError(f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters")
+        key_id = scoped_key(scope, key)
+        request_hash = fingerprint(payload)
+
+        record = self._cached(key_id)
+        if record is not None:
+            self.hits += 1
+            self.replays += 1
+            return self._replay(record, request_hash)
+
+        now = datetime.now(timezone.utc)
+        try:
+            await db.idempotency_keys.insert_one({
+                "_id": key_id,
+                "requestHash": request_hash,
+                "status": "pending",
+                "createdAt": now,
+                "lockedUntil": now + self.lease,
+            })
+        except DuplicateKeyError:
+            record = await db.idempotency_keys.find_one({"_id": key_id})
+            if record is None:
+                # Expired or released between the insert and the read
+                return await self.run_once(db, scope, key, payload, call, recover)
+            if (record["status"] == "pending" and record["requestHash"] == request_hash
+                    and await self._take_over(db, record)):
+                if recover is not None:
+                    response = await self._leased(db, key_id, recover)
+                    if response is not None:
+                        self.recovered += 1
+                        return await self._complete(db, key_id, request_hash, jsonable_encoder(response))
+            else:
+                response = self._replay(record, request_hash)
+                self.replays += 1
+                self._remember(key_id, record)
+                return response
+
+        try:
+            response = jsonable_encoder(await self._leased(db, key_id, call))
+        except BaseException:
+            await self._settle_failure(db, key_id, request_hash, recover)
+            raise
+        return await self._complete(db, key_id, request_hash, response)
+
+    async def _leased(self, db, key_id: str, call):
+        """Await ``call()``, renewing the claim's lease until it returns"""
+        async def renew():
+            while True:
+                await asyncio.sleep(self.lease.total_seconds() / 3)
+                try:
+                    await db.idempotency_keys.update_one(
+                        {"_id": key_id, "status": "pending"},
+                        {"$set": {"lockedUntil": datetime.now(timezone.utc) + self.lease}}
+                    )
+                except Exception:
+                    logger.warning(f"Could not renew idempotency lease {key_id}", exc_info=True)
+
+        renewer = asyncio.create_task(renew())
+        try:
+            return await call()
+        finally:
+            renewer.cancel()
+
+    async def _settle_failure(self, db, key_id: str, request_hash: str, recover):
+        """After the handler raised: keep what it wrote, release the key if nothing"""
+        if recover is not None:
+            try:
+                response = await recover()
+            except Exception:
+                # Unknown; the claim stays pending and a retry recovers once the lease ends
+                logger.warning(f"Could not check what failed request {key_id} wrote", exc_info=True)
+                return
+            if response is not None:
+                self.recovered += 1
+                await self._complete(db, key_id, request_hash, jsonable_encoder(response))
+                return
+        await db.idempotency_keys.delete_one({"_id": key_id, "status": "pending"})
+
+    async def _take_over(self, db, record: dict) -> bool:
+        """Claim a pending key whose lease ran out; False while it is live"""
+        locked_until = record.get("lockedUntil")
+        if locked_until is None:
+            return False
+        if locked_until.tzinfo is None:
+            # Motor returns naive UTC datetimes
+            locked_until = locked_until.replace(tzinfo=timezone.utc)
+        now = datetime.now(timezone.utc)
+        if locked_until > now:
+            return False
+        claimed = await db.idempotency_keys.find_one_and_update(
+            {"_id": record["_id"], "status": "pending", "lockedUntil": record["lockedUntil"]},
+            {"$set": {"lockedUntil": now + self.lease}}
+        )
+        if claimed is not None:
+            self.takeovers += 1
+        return claimed is not None
+
+    async def _complete(self, db, key_id: str, request_hash: str, response):
+        record = {"requestHash": request_hash, "status": "done", "response": response}
+        await db.idempotency_keys.update_one(
+            {"_id": key_id},
+            {"$set": {"status": "done", "response": response, "completedAt": datetime.now(timezone.utc)}}
+        )
+        self._remember(key_id, record)
+        return response
+
+    def stats(self) -> dict:
+        return {
+            "cached": len(self._cache),
+            "cacheHits": self.hits,
+            "replays": self.replays,
+            "takeovers": self.takeovers,
+            "recovered": self.recovered,
+        }
+
+
+idempotency_store = IdempotencyStore()
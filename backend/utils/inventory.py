@@ -0,0 +1,538 @@
+"""Per-warehouse stock ledger.
+
+Stock lives in ``warehouse_stock`` rows keyed by (productId, warehouseId).
+Every change is a conditional ``$inc`` on one row, so a decrement can never
+take a row below zero, and the product's ``stock.quantity`` is kept as the
+running total with a matching ``$inc``. Product reads stay a single lookup
+while concurrent sales from different warehouses touch different rows.
+
+Split allocations compensate the rows they already changed when a later
+step fails. Transfers are journaled moves (see ``utils.stock_journal``), so
+a crash between the debit and the credit is finished later instead of
+losing the stock.
+
+Hot products can keep their stock in sharded counters instead of one row
+per warehouse (see ``utils.stock_shards``); ``_change_row`` hides which.
+
+Operations given a ``why`` (see ``utils.stock_ledger.reason``) append one
+movement per row they changed to the stock movement history, in a single
+write right after the rows.
+"""
+from pymongo import ReturnDocument, UpdateOne
+from datetime import datetime, timezone
+import asyncio
+import time
+import uuid
+
+from utils.stock import STOCK_FLAGS_STAGE
+from utils.catalog_sync import sync_now
+from utils.events import event_bus, StockChanged
+from utils.stock_ledger import movement, record
+from utils.stock_journal import move
+from utils.stock_shards import shard_registry, shard_view, mark_dirty, add, take
+
+DEFAULT_WAREHOUSE_CODE = "MAIN"
+# Quantities closer than this are treated as equal (fractional units)
+EPSILON = 1e-9
+WAREHOUSE_CACHE_SECONDS = 30
+# Passes reconcile_totals makes over totals that changed under it
+RECONCILE_ROUNDS = 3
+
+
+class InsufficientStockError(Exception):
+    def __init__(self, product_id: str, available: float):
+        super().__init__(f"Insufficient stock for {product_id}. Available: {available}")
+        self.product_id = product_id
+        self.available = available
+
+
+_warehouses = {"loaded_at": 0.0, "items": []}
+_warehouse_lock = asyncio.Lock()
+
+
+def invalidate_warehouses():
+    _warehouses["loaded_at"] = 0.0
+
+
+async def ensure_default_warehouse(db) -> dict:
+    """The MAIN warehouse, created on first use"""
+    now = datetime.now(timezone.utc).isoformat()
+    return await db.warehouses.find_one_and_update(
+        {"code": DEFAULT_WAREHOUSE_CODE},
+        {"$setOnInsert": {
+            "id": str(uuid.uuid4()), "code": DEFAULT_WAREHOUSE_CODE, "name": "Main Store",
+            "priority": 0, "isActive": True, "isDefault": True, "createdAt": now, "updatedAt": now,
+        }},
+        projection={"_id": 0},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def active_warehouses(db) -> list:
+    """Active warehouses in allocation order: default first, then by priority"""
+    if time.monotonic() - _warehouses["loaded_at"] < WAREHOUSE_CACHE_SECONDS:
+        return _warehouses["items"]
+    async with _warehouse_lock:
+        if time.monotonic() - _warehouses["loaded_at"] >= WAREHOUSE_CACHE_SECONDS:
+            await ensure_default_warehouse(db)
+            items = await db.warehouses.find({"isActive": True}, {"_id": 0}).to_list(None)
+            items.sort(key=lambda w: (not w.get("isDefault"), w.get("priority", 100), w["code"]))
+            _warehouses["items"] = items
+            _warehouses["loaded_at"] = time.monotonic()
+    return _warehouses["items"]
+
+
+async def default_warehouse_id(db) -> str:
+    warehouses = await active_warehouses(db)
+    for warehouse in warehouses:
+        if warehouse.get("isDefault"):
+            return warehouse["id"]
+    return (await ensure_default_warehouse(db))["id"]
+
+
+async def _change_ledger_row(db, product_id: str, warehouse_id: str, delta: float) -> bool:
+    query = {"productId": product_id, "warehouseId": warehouse_id}
+    if delta < 0:
+        query["quantity"] = {"$gte": -delta - EPSILON}
+    result = await db.warehouse_stock.update_one(
+        query,
+        {"$inc": {"quantity": delta}, "$set": {"updatedAt": datetime.now(timezone.utc)}},
+        upsert=delta >= 0
+    )
+    return result.modified_count > 0 or result.upserted_id is not None
+
+
+async def _change_row(db, product_id: str, warehouse_id: str, delta: float) -> bool:
+    """Apply delta to a product's stock in one warehouse; decrements only
+    succeed if enough is left. Sharded products change a shard instead."""
+    shards = await shard_registry.count(db, product_id)
+    if delta >= 0:
+        if shards:
+            await add(db, product_id, warehouse_id, delta, shards)
+            return True
+        return await _change_ledger_row(db, product_id, warehouse_id, delta)
+    if shards:
+        if await take(db, product_id, warehouse_id, -delta, shards):
+            return True
+        return await _change_ledger_row(db, product_id, warehouse_id, delta)
+    if await _change_ledger_row(db, product_id, warehouse_id, delta):
+        return True
+    # Sharding may have been switched on by another worker
+    return await take(db, product_id, warehouse_id, -delta, 0)
+
+
+async def update_total(db, product_id: str, delta: float):
+    """Move the product's stock total by delta and recompute its low-stock flags"""
+    if await shard_registry.count(db, product_id):
+        # Sharded totals are folded in by the shard task, off the checkout path
+        mark_dirty(product_id)
+        return None
+    product = await db.products.find_one_and_update(
+        {"id": product_id},
+        [
+            {"$set": {
+                "stock.quantity": {"$add": [{"$ifNull": ["$stock.quantity", 0]}, delta]},
+                "updatedAt": datetime.now(),
+                "syncedAt": {"$literal": sync_now()}
+            }},
+            STOCK_FLAGS_STAGE
+        ],
+        projection={"_id": 0, "stock": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if product is not None:
+        await event_bus.publish(StockChanged(product_id, product["stock"]))
+    return product
+
+
+async def warehouse_quantities(db, product_id: str, fresh: bool = False) -> dict:
+    rows = await db.warehouse_stock.find(
+        {"productId": product_id}, {"_id": 0, "warehouseId": 1, "quantity": 1}
+    ).to_list(None)
+    quantities = {row["warehouseId"]: row["quantity"] for row in rows}
+    if await shard_registry.count(db, product_id):
+        for warehouse_id, quantity in (await shard_view.totals(db, product_id, fresh)).items():
+            quantities[warehouse_id] = quantities.get(warehouse_id, 0) + quantity
+    return quantities
+
+
+async def _record_rows(db, product_id: str, rows: list, sign: int, why: dict):
+    if why is not None:
+        await record(db, [
+            movement(product_id, row["warehouseId"], sign * row["quantity"], why)
+            for row in rows if row["quantity"]
+        ])
+
+
+async def allocate(db, product_id: str, quantity: float, warehouse_id: str = None,
+                   why: dict = None) -> list:
+    """Take quantity out of stock and return the [{warehouseId, quantity}] drawn.
+
+    With a warehouse_id the whole quantity comes from that warehouse.
+    Otherwise warehouses are drained in allocation order, usually in one
+    write because the default warehouse holds enough.
+    """
+    if warehouse_id:
+        order = [warehouse_id]
+    else:
+        order = [warehouse["id"] for warehouse in await active_warehouses(db)]
+    # Sharded quantities come from a cached view; retry once with fresh totals
+    attempts = (False, True) if await shard_registry.count(db, product_id) else (True,)
+
+    allocations = []
+    remaining = quantity
+    for fresh in attempts:
+        available = await warehouse_quantities(db, product_id, fresh)
+        for candidate in order:
+            if remaining <= EPSILON:
+                break
+            part = min(available.get(candidate, 0), remaining)
+            if part <= EPSILON:
+                continue
+            if await _change_row(db, product_id, candidate, -part):
+                allocations.append({"warehouseId": candidate, "quantity": part})
+                remaining -= part
+        if remaining <= EPSILON:
+            break
+
+    if remaining > EPSILON:
+        # Lost a race or not enough stock: put back what was taken
+        await _restore_rows(db, product_id, allocations)
+        total = sum(available.get(candidate, 0) for candidate in order)
+        raise InsufficientStockError(product_id, total)
+
+    await _record_rows(db, product_id, allocations, -1, why)
+    await update_total(db, product_id, -quantity)
+    return allocations
+
+
+async def _restore_rows(db, product_id: str, allocations: list):
+    for allocation in allocations:
+        await _change_row(db, product_id, allocation["warehouseId"], allocation["quantity"])
+
+
+async def release(db, product_id: str, allocations: list, why: dict = None):
+    """Put allocated stock back into the warehouses it came from"""
+    await _restore_rows(db, product_id, allocations)
+    await _record_rows(db, product_id, allocations, 1, why)
+    await update_total(db, product_id, sum(allocation["quantity"] for allocation in allocations))
+
+
+async def allocate_order(db, items: list, why: dict = None):
+    """Allocate every line of one order, all or nothing; sets item["allocations"]"""
+    allocated = []
+    try:
+        for item in items:
+            item["allocations"] = await allocate(db, item["productId"], item["quantity"], item.get("warehouseId"), why)
+            allocated.append(item)
+    except Exception:
+        for item in allocated:
+            await release(db, item["productId"], item["allocations"], why and {**why, "type": "cancel"})
+        raise
+
+
+def _plan_order(items: list, available: dict, order: list) -> list:
+    """Allocations for each line of an order against ``available``, which is
+    only reduced if the whole order fits"""
+    used = {}
+    plans = []
+    for item in items:
+        product_id = item["productId"]
+        candidates = [item["warehouseId"]] if item.get("warehouseId") else order
+        allocations = []
+        remaining = item["quantity"]
+        for candidate in candidates:
+            if remaining <= EPSILON:
+                break
+            key = (product_id, candidate)
+            part = min(available.get(key, 0) - used.get(key, 0), remaining)
+            if part <= EPSILON:
+                continue
+            allocations.append({"warehouseId": candidate, "quantity": part})
+            used[key] = used.get(key, 0) + part
+            remaining -= part
+        if remaining > EPSILON:
+            free = sum(available.get((product_id, c), 0) - used.get((product_id, c), 0) for c in candidates)
+            raise InsufficientStockError(product_id, max(free, 0))
+        plans.append(allocations)
+    for key, quantity in used.items():
+        available[key] -= quantity
+    return plans
+
+
+async def allocate_batch(db, orders: list, whys: list) -> list:
+    """Allocate many orders (lists of sale lines) with one bulk write.
+
+    Returns one entry per order: None when it was allocated (every line's
+    ``allocations`` is set) or the InsufficientStockError that rejected it.
+    Orders are planned in sequence against one read of the ledger, the
+    summed decrements go out in one unordered ``bulk_write``, and stock
+    totals and movements are written in one batch each. Each decrement is
+    conditional and tags the row with the batch id until the winners are
+    read back; if another checkout wins a row in between, the orders using
+    that row are rejected and their share of the other rows is put back.
+    Orders with sharded products are allocated one by one.
+    """
+    results = [None] * len(orders)
+    product_ids = list({item["productId"] for items in orders for item in items})
+    counts = await shard_registry.counts(db)
+    rows = await db.warehouse_stock.find(
+        {"productId": {"$in": [pid for pid in product_ids if not counts.get(pid)]}},
+        {"_id": 0, "productId": 1, "warehouseId": 1, "quantity": 1}
+    ).to_list(None)
+    available = {(row["productId"], row["warehouseId"]): row["quantity"] for row in rows}
+    order = [warehouse["id"] for warehouse in await active_warehouses(db)]
+
+    planned = {}
+    one_by_one = []
+    for index, items in enumerate(orders):
+        if any(counts.get(item["productId"]) for item in items):
+            one_by_one.append(index)
+            continue
+        try:
+            planned[index] = _plan_order(items, available, order)
+        except InsufficientStockError as e:
+            results[index] = e
+
+    def decrements(indices) -> dict:
+        totals = {}
+        for index in indices:
+            for item, allocations in zip(orders[index], planned[index]):
+                for allocation in allocations:
+                    key = (item["productId"], allocation["warehouseId"])
+                    totals[key] = totals.get(key, 0) + allocation["quantity"]
+        return totals
+
+    totals = decrements(planned)
+    if totals:
+        batch_id = str(uuid.uuid4())
+        now = datetime.now(timezone.utc)
+        result = await db.warehouse_stock.bulk_write([
+            UpdateOne(
+                {"productId": pid, "warehouseId": wid, "quantity": {"$gte": quantity - EPSILON}},
+                {
+                    "$inc": {"quantity": -quantity},
+                    "$set": {"updatedAt": now},
+                    "$addToSet": {"batchIds": batch_id},
+                }
+            )
+            for (pid, wid), quantity in totals.items()
+        ], ordered=False)
+        if result.modified_count < len(totals):
+            won = await db.warehouse_stock.find(
+                {"productId": {"$in": product_ids}, "batchIds": batch_id},
+                {"_id": 0, "productId": 1, "warehouseId": 1}
+            ).to_list(None)
+            won = {(row["productId"], row["warehouseId"]) for row in won}
+            lost = set(totals) - won
+            rejected = [
+                index for index in planned
+                if any((item["productId"], allocation["warehouseId"]) in lost
+                       for item, allocations in zip(orders[index], planned[index])
+                       for allocation in allocations)
+            ]
+            giveback = decrements(rejected)
+            for index in rejected:
+                product_id = next(
+                    item["productId"] for item, allocations in zip(orders[index], planned[index])
+                    if any((item["productId"], a["warehouseId"]) in lost for a in allocations)
+                )
+                quantities = await warehouse_quantities(db, product_id)
+                results[index] = InsufficientStockError(product_id, sum(quantities.values()))
+                del planned[index]
+            restore = [
+                UpdateOne({"productId": pid, "warehouseId": wid}, {"$inc": {"quantity": quantity}})
+                for (pid, wid), quantity in giveback.items() if (pid, wid) in won
+            ]
+            if restore:
+                await db.warehouse_stock.bulk_write(restore, ordered=False)
+        # The tag only has to last until the rows this batch won are known
+        await db.warehouse_stock.update_many(
+            {"productId": {"$in": product_ids}, "batchIds": batch_id}, {"$pull": {"batchIds": batch_id}}
+        )
+
+    for index, allocations in planned.items():
+        for item, item_allocations in zip(orders[index], allocations):
+            item["allocations"] = item_allocations
+
+    by_product = {}
+    for (pid, _), quantity in decrements(planned).items():
+        by_product[pid] = by_product.get(pid, 0) + quantity
+    if by_product:
+        synced_at = sync_now()
+        await db.products.bulk_write([
+            UpdateOne({"id": pid}, [
+                {"$set": {
+                    "stock.quantity": {"$add": [{"$ifNull": ["$stock.quantity", 0]}, -quantity]},
+                    "updatedAt": datetime.now(),
+                    "syncedAt": {"$literal": synced_at}
+                }},
+                STOCK_FLAGS_STAGE
+            ])
+            for pid, quantity in by_product.items()
+        ], ordered=False)
+        products = await db.products.find(
+            {"id": {"$in": list(by_product)}}, {"_id": 0, "id": 1, "stock": 1}
+        ).to_list(None)
+        await event_bus.publish(*(StockChanged(product["id"], product["stock"]) for product in products))
+        await record(db, [
+            movement(item["productId"], allocation["warehouseId"], -allocation["quantity"], whys[index])
+            for index in planned
+            for item in orders[index]
+            for allocation in item["allocations"]
+        ])
+
+    for index in one_by_one:
+        try:
+            await allocate_order(db, orders[index], whys[index])
+        except InsufficientStockError as e:
+            results[index] = e
+    return results
+
+
+def returned_allocations(allocations: list, quantity: float) -> list:
+    """Split a returned quantity over the allocations it was sold from"""
+    split = []
+    remaining = quantity
+    for allocation in allocations:
+        if remaining <= EPSILON:
+            break
+        take = min(allocation["quantity"], remaining)
+        split.append({"warehouseId": allocation["warehouseId"], "quantity": take})
+        remaining -= take
+    if remaining > EPSILON and split:
+        split[0]["quantity"] += remaining
+    return split
+
+
+async def adjust(db, product_id: str, warehouse_id: str, delta: float, update_totals: bool = True,
+                 why: dict = None):
+    """Add or remove stock in one warehouse (counts, damage, receipts)"""
+    if not await _change_row(db, product_id, warehouse_id, delta):
+        available = (await warehouse_quantities(db, product_id)).get(warehouse_id, 0)
+        raise InsufficientStockError(product_id, available)
+    await _record_rows(db, product_id, [{"warehouseId": warehouse_id, "quantity": delta}], 1, why)
+    if update_totals:
+        await update_total(db, product_id, delta)
+
+
+async def transfer(db, product_id: str, from_warehouse_id: str, to_warehouse_id: str, quantity: float,
+                   why: dict = None):
+    """Move stock between warehouses; the product total does not change"""
+    target = {"warehouseId": to_warehouse_id}
+    if not await move(db, product_id, quantity, {"warehouseId": from_warehouse_id}, target):
+        if not await shard_registry.count(db, product_id) or \
+                not await _transfer_from_shards(db, product_id, from_warehouse_id, target, quantity):
+            available = (await warehouse_quantities(db, product_id)).get(from_warehouse_id, 0)
+            raise InsufficientStockError(product_id, available)
+    await _record_rows(db, product_id, [
+        {"warehouseId": from_warehouse_id, "quantity": -quantity},
+        {"warehouseId": to_warehouse_id, "quantity": quantity},
+    ], 1, why)
+
+
+async def _transfer_from_shards(db, product_id: str, warehouse_id: str, target: dict, quantity: float) -> bool:
+    # Fullest shards first, all or nothing; the target row is folded into
+    # its shards by the shard task
+    rows = await db.stock_shards.find(
+        {"productId": product_id, "warehouseId": warehouse_id, "quantity": {"$gt": EPSILON}},
+        {"_id": 0, "shard": 1, "quantity": 1}
+    ).sort("quantity", -1).to_list(None)
+    moved = []
+    remaining = quantity
+    for row in rows:
+        if remaining <= EPSILON:
+            break
+        source = {"warehouseId": warehouse_id, "shard": row["shard"]}
+        part = min(row["quantity"], remaining)
+        if await move(db, product_id, part, source, target):
+            moved.append((source, part))
+            remaining -= part
+    shard_view.invalidate(product_id)
+    if remaining > EPSILON:
+        for source, part in moved:
+            await move(db, product_id, part, target, source)
+        return False
+    return True
+
+
+def ledger_totals_pipeline(product_ids: list = None) -> list:
+    """Per-product totals from the ledger rows and shards"""
+    match = [{"$match": {"productId": {"$in": product_ids}}}] if product_ids is not None else []
+    return [
+        *match,
+        {"$project": {"productId": 1, "quantity": 1}},
+        {"$unionWith": {"coll": "stock_shards", "pipeline": [*match, {"$project": {"productId": 1, "quantity": 1}}]}},
+        {"$group": {"_id": "$productId", "quantity": {"$sum": "$quantity"}}},
+    ]
+
+
+async def reconcile_totals(db) -> int:
+    """Reset product totals that drifted from the ledger, e.g. after a crash
+    between a row change and its total update. Returns how many changed.
+
+    Each reset is conditional on the total it was compared against, so a
+    sale landing in between is not overwritten; those products are read
+    and compared again, up to ``RECONCILE_ROUNDS`` times.
+    """
+    changed = 0
+    touched = set()
+    product_ids = None
+    for _ in range(RECONCILE_ROUNDS):
+        totals = {
+            row["_id"]: row["quantity"]
+            for row in await db.warehouse_stock.aggregate(ledger_totals_pipeline(product_ids)).to_list(None)
+        }
+        products = await db.products.find(
+            {"id": {"$in": list(totals)}}, {"_id": 0, "id": 1, "stock.quantity": 1}
+        ).to_list(None)
+        drifted = {
+            product["id"]: (product.get("stock") or {}).get("quantity") for product in products
+            if (product.get("stock") or {}).get("quantity") != totals[product["id"]]
+        }
+        if not drifted:
+            break
+        synced_at = sync_now()
+        result = await db.products.bulk_write([
+            UpdateOne({"id": pid, "stock.quantity": seen}, [
+                {"$set": {
+                    "stock.quantity": totals[pid],
+                    "updatedAt": datetime.now(),
+                    "syncedAt": {"$literal": synced_at}
+                }},
+                STOCK_FLAGS_STAGE
+            ])
+            for pid, seen in drifted.items()
+        ], ordered=False)
+        changed += result.modified_count
+        touched.update(drifted)
+        if result.modified_count == len(drifted):
+            break
+        # Some totals moved since they were read; compare just those again
+        product_ids = list(drifted)
+    if not touched:
+        return 0
+    products = await db.products.find(
+        {"id": {"$in": list(touched)}}, {"_id": 0, "id": 1, "stock": 1}
+    ).to_list(None)
+    await event_bus.publish(*(StockChanged(product["id"], product["stock"]) for product in products))
+    return changed
+
+
+def backfill_pipeline(warehouse_id: str) -> list:
+    """Seed a default-warehouse ledger row from each product's current total"""
+    return [
+        {"$project": {
+            "_id": 0,
+            "productId": "$id",
+            "warehouseId": {"$literal": warehouse_id},
+            "quantity": {"$ifNull": ["$stock.quantity", 0]},
+        }},
+        {"$merge": {
+            "into": "warehouse_stock",
+            "on": ["productId", "warehouseId"],
+            "whenMatched": "keepExisting",
+            "whenNotMatched": "insert",
+        }},
+    ]
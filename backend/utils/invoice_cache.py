@@ -0,0 +1,140 @@
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = Path(tempfile.gettempdir()) / "stockpilot-invoices"
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def invoice_digest(sale_id: str, updated_at) -> str:
+    """Content key for a sale revision (sale id + updatedAt)"""
+    if isinstance(updated_at, datetime):
+        # Mongo stores milliseconds, so a freshly built document and the same
+        # document read back must hash identically
+        updated_at = updated_at.replace(
+            microsecond=updated_at.microsecond // 1000 * 1000, tzinfo=None
+        ).isoformat()
+    return hashlib.sha256(f"{sale_id}:{updated_at}".encode()).hexdigest()[:32]
+
+
+class InvoiceCache:
+    """On-disk cache of rendered invoice PDFs with LRU eviction.
+
+    Files are named ``<sale_id>_<digest>.pdf`` so an entry can only be served
+    for the exact sale revision it was rendered from, and every revision of a
+    sale can be dropped when the sale is mutated.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # filename -> size, oldest first
+        self._lock = threading.Lock()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        """Rebuild the LRU order from files left by a previous process"""
+        files = sorted(self.directory.glob("*.pdf"), key=lambda p: p.stat().st_atime)
+        for path in files:
+            size = path.stat().st_size
+            self._entries[path.name] = size
+            self.size += size
+        self._evict()
+
+    @staticmethod
+    def _filename(sale_id: str, digest: str) -> str:
+        return f"{sale_id}_{digest}.pdf"
+
+    def read(self, sale_id: str, digest: str):
+        """Return the cached PDF bytes for this revision, or None.
+
+        The file is opened under the lock and read after releasing it: an
+        open file survives eviction or invalidation unlinking it, and other
+        requests are not held up by the read. Another worker sharing the
+        directory may still have removed it; that counts as a miss.
+        """
+        name = self._filename(sale_id, digest)
+        with self._lock:
+            if name not in self._entries:
+                self.misses += 1
+                return None
+            try:
+                f = open(self.directory / name, "rb")
+            except FileNotFoundError:
+                self.size -= self._entries.pop(name)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(name)
+            self.hits += 1
+        with f:
+            return f.read()
+
+    def contains(self, sale_id: str, digest: str) -> bool:
+        return self._filename(sale_id, digest) in self._entries
+
+    def put(self, sale_id: str, digest: str, pdf_bytes: bytes):
+        """Store rendered bytes atomically and evict least recently used files.
+
+        Callers keep serving ``pdf_bytes``; the file may already be evicted
+        (e.g. when it alone exceeds ``max_bytes``).
+        """
+        name = self._filename(sale_id, digest)
+        path = self.directory / name
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(pdf_bytes)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self.size -= self._entries.pop(name, 0)
+            self._entries[name] = len(pdf_bytes)
+            self.size += len(pdf_bytes)
+            self._evict()
+
+    def invalidate(self, sale_id: str):
+        """Drop every cached revision of a sale"""
+        prefix = f"{sale_id}_"
+        with self._lock:
+            names = [name for name in self._entries if name.startswith(prefix)]
+            for name in names:
+                self.size -= self._entries.pop(name)
+                self._unlink(name)
+
+    def _evict(self):
+        while self.size > self.max_bytes and self._entries:
+            name, size = self._entries.popitem(last=False)
+            self.size -= size
+            self._unlink(name)
+
+    def _unlink(self, name: str):
+        try:
+            (self.directory / name).unlink()
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Could not remove cached invoice {name}: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "sizeBytes": self.size,
+            "maxBytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+invoice_cache = InvoiceCache(
+    Path(os.environ.get("INVOICE_CACHE_DIR", DEFAULT_CACHE_DIR)),
+    int(os.environ.get("INVOICE_CACHE_MAX_MB", DEFAULT_MAX_BYTES // (1024 * 1024))) * 1024 * 1024,
+)
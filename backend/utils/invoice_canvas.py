@@ -0,0 +1,318 @@
+"""Fast-path invoice renderer that draws the fixed A4 layout on the canvas.
+
+All fonts, colours and column geometry are resolved once at import time and
+line items are paginated here instead of going through platypus flow layout.
+The platypus renderer in ``invoice_generator`` remains the reference layout.
+"""
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import inch
+from reportlab.lib.utils import simpleSplit
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen import canvas
+from io import BytesIO
+
+PAGE_WIDTH, PAGE_HEIGHT = A4
+MARGIN_X = 0.5 * inch
+MARGIN_TOP = 0.5 * inch
+MARGIN_BOTTOM = 0.5 * inch
+CONTENT_WIDTH = PAGE_WIDTH - 2 * MARGIN_X
+
+FONT = "Helvetica"
+FONT_BOLD = "Helvetica-Bold"
+
+COLOR_TITLE = colors.HexColor('#1f2937')
+COLOR_HEADING = colors.HexColor('#374151')
+COLOR_TEXT = colors.HexColor('#4b5563')
+COLOR_MUTED = colors.HexColor('#6b7280')
+COLOR_GRID = colors.HexColor('#e5e7eb')
+COLOR_HEADER_BG = colors.HexColor('#f3f4f6')
+
+# Items table: (title, width, alignment)
+COLUMNS = [
+    ('#', 0.4 * inch, 'center'),
+    ('Product', 2 * inch, 'left'),
+    ('SKU', 0.8 * inch, 'left'),
+    ('Qty', 0.6 * inch, 'right'),
+    ('Price', 0.8 * inch, 'right'),
+    ('Discount', 0.8 * inch, 'right'),
+    ('Tax', 0.7 * inch, 'right'),
+    ('Total', 0.9 * inch, 'right'),
+]
+TABLE_WIDTH = sum(width for _, width, _ in COLUMNS)
+TABLE_X = MARGIN_X + (CONTENT_WIDTH - TABLE_WIDTH) / 2
+CELL_PADDING = 6
+
+COLUMN_X = []
+_x = TABLE_X
+for _, _width, _ in COLUMNS:
+    COLUMN_X.append(_x)
+    _x += _width
+COLUMN_EDGES = COLUMN_X + [TABLE_X + TABLE_WIDTH]
+PRODUCT_TEXT_WIDTH = COLUMNS[1][1] - 2 * CELL_PADDING
+
+HEADER_ROW_HEIGHT = 24
+ROW_HEIGHT = 20
+TOTALS_LINE_HEIGHT = 16
+NOTES_LINE_HEIGHT = 12
+FOOTER_HEIGHT = 40
+PAGE_NUMBER_Y = MARGIN_BOTTOM / 2
+
+# Space the continuation pages give to line items
+CONTINUATION_TOP = PAGE_HEIGHT - MARGIN_TOP
+
+
+def _cell_text_x(column: int) -> float:
+    _, width, align = COLUMNS[column]
+    if align == 'center':
+        return COLUMN_X[column] + width / 2
+    if align == 'right':
+        return COLUMN_X[column] + width - CELL_PADDING
+    return COLUMN_X[column] + CELL_PADDING
+
+
+CELL_TEXT_X = [_cell_text_x(i) for i in range(len(COLUMNS))]
+HEADER_TEXT_X = [COLUMN_X[i] + COLUMNS[i][1] / 2 for i in range(len(COLUMNS))]
+
+
+_BODY_WIDTHS = {}
+
+
+def _body_width(text: str) -> float:
+    """String width in the 9pt body font, memoised per character"""
+    widths = _BODY_WIDTHS
+    total = 0.0
+    for ch in text:
+        w = widths.get(ch)
+        if w is None:
+            w = widths[ch] = stringWidth(ch, FONT, 9)
+        total += w
+    return total
+
+
+def _fit(text: str, width: float) -> str:
+    """Clip body text so it fits a cell"""
+    text = text[:30]
+    while text and _body_width(text) > width:
+        text = text[:-1]
+    return text
+
+
+def _item_row(idx: int, item: dict) -> list:
+    discount_str = f"₹{item['discount']:.2f}" if item['discountType'] == 'fixed' else f"{item['discount']}%"
+    return [
+        str(idx),
+        _fit(item['productName'], PRODUCT_TEXT_WIDTH),
+        item['sku'],
+        f"{item['quantity']:.2f}",
+        f"₹{item['unitPrice']:.2f}",
+        discount_str,
+        f"₹{item.get('taxAmount', 0):.2f}",
+        f"₹{item['lineTotal']:.2f}",
+    ]
+
+
+def _totals_rows(sale_data: dict) -> list:
+    rows = [("Subtotal:", f"₹{sale_data['subtotal']:.2f}", False)]
+    if sale_data.get('discountAmount', 0) > 0:
+        rows.append(("Discount:", f"-₹{sale_data['discountAmount']:.2f}", False))
+    if sale_data.get('taxAmount', 0) > 0:
+        rows.append(("Tax:", f"₹{sale_data['taxAmount']:.2f}", False))
+    rows.append(("TOTAL:", f"₹{sale_data['total']:.2f}", True))
+    if sale_data.get('amountPaid', 0) > 0:
+        rows.append(("Paid:", f"₹{sale_data['amountPaid']:.2f}", False))
+        balance = sale_data['total'] - sale_data['amountPaid']
+        if balance > 0:
+            rows.append(("Balance:", f"₹{balance:.2f}", True))
+    return rows
+
+
+def _draw_header(c, sale_data: dict) -> float:
+    """Draw title, company/invoice block and customer block; return next y"""
+    y = PAGE_HEIGHT - MARGIN_TOP - 24
+    c.setFillColor(COLOR_TITLE)
+    c.setFont(FONT_BOLD, 24)
+    c.drawCentredString(PAGE_WIDTH / 2, y, "INVOICE")
+    y -= 44
+
+    left = [(FONT_BOLD, "StockPilot"), (FONT, "Store Management System"), (FONT, "support@stockpilot.com")]
+    right = [
+        ("Invoice No: ", sale_data['invoiceNumber']),
+        ("Date: ", sale_data['saleDate'].strftime('%d-%m-%Y %H:%M')),
+        ("Payment: ", sale_data['paymentMode'].upper()),
+    ]
+    right_edge = MARGIN_X + CONTENT_WIDTH
+    c.setFillColor(COLOR_HEADING)
+    for (font, text), (label, value) in zip(left, right):
+        c.setFont(font, 9)
+        c.drawString(MARGIN_X, y, text)
+        c.setFont(FONT, 9)
+        c.drawRightString(right_edge, y, value)
+        c.setFont(FONT_BOLD, 9)
+        c.drawRightString(right_edge - stringWidth(value, FONT, 9), y, label)
+        y -= 12
+    y -= 24
+
+    if sale_data.get('customerName'):
+        c.setFillColor(COLOR_HEADING)
+        c.setFont(FONT_BOLD, 14)
+        c.drawString(MARGIN_X, y, "Bill To:")
+        y -= 20
+        c.setFillColor(COLOR_TEXT)
+        c.setFont(FONT_BOLD, 10)
+        c.drawString(MARGIN_X, y, sale_data['customerName'])
+        y -= 14
+        if sale_data.get('customerPhone'):
+            c.setFont(FONT, 10)
+            c.drawString(MARGIN_X, y, f"Phone: {sale_data['customerPhone']}")
+            y -= 14
+        y -= 12
+
+    c.setFillColor(COLOR_HEADING)
+    c.setFont(FONT_BOLD, 14)
+    c.drawString(MARGIN_X, y, "Items:")
+    return y - 12
+
+
+def _draw_table_header(c, top: float) -> float:
+    bottom = top - HEADER_ROW_HEIGHT
+    c.setFillColor(COLOR_HEADER_BG)
+    c.rect(TABLE_X, bottom, TABLE_WIDTH, HEADER_ROW_HEIGHT, stroke=0, fill=1)
+    c.setFillColor(COLOR_TITLE)
+    c.setFont(FONT_BOLD, 10)
+    text_y = bottom + 8
+    for i, (title, _, _) in enumerate(COLUMNS):
+        c.drawCentredString(HEADER_TEXT_X[i], text_y, title)
+    return bottom
+
+
+def _draw_rows(c, top: float, rows: list) -> float:
+    """Draw body rows under a header whose bottom edge is ``top``"""
+    # One text object for the whole block instead of one per cell
+    text = c.beginText()
+    text.setFont(FONT, 9)
+    text.setFillColor(COLOR_TEXT)
+    y = top
+    for row in rows:
+        y -= ROW_HEIGHT
+        text_y = y + 7
+        text.setTextOrigin(CELL_TEXT_X[0] - _body_width(row[0]) / 2, text_y)
+        text.textOut(row[0])
+        text.setTextOrigin(CELL_TEXT_X[1], text_y)
+        text.textOut(row[1])
+        text.setTextOrigin(CELL_TEXT_X[2], text_y)
+        text.textOut(row[2])
+        for i in range(3, 8):
+            text.setTextOrigin(CELL_TEXT_X[i] - _body_width(row[i]), text_y)
+            text.textOut(row[i])
+    c.drawText(text)
+
+    # Grid for header + body in one pass
+    header_top = top + HEADER_ROW_HEIGHT
+    c.setStrokeColor(COLOR_GRID)
+    c.setLineWidth(0.5)
+    lines = [(TABLE_X, header_top, TABLE_X + TABLE_WIDTH, header_top)]
+    row_y = top
+    for _ in range(len(rows) + 1):
+        lines.append((TABLE_X, row_y, TABLE_X + TABLE_WIDTH, row_y))
+        row_y -= ROW_HEIGHT
+    for x in COLUMN_EDGES:
+        lines.append((x, header_top, x, y))
+    c.lines(lines)
+    return y
+
+
+def _trailer_height(totals: list, notes_lines: list) -> float:
+    height = 20 + len(totals) * TOTALS_LINE_HEIGHT + FOOTER_HEIGHT
+    if notes_lines:
+        height += 24 + len(notes_lines) * NOTES_LINE_HEIGHT + 12
+    return height
+
+
+def _draw_trailer(c, y: float, totals: list, notes_lines: list):
+    label_x = CELL_TEXT_X[6]
+    value_x = CELL_TEXT_X[7]
+    y -= 20
+    for label, value, emphasised in totals:
+        if label == "TOTAL:":
+            c.setStrokeColor(COLOR_TITLE)
+            c.setLineWidth(2)
+            c.line(COLUMN_X[6], y + TOTALS_LINE_HEIGHT - 5, COLUMN_EDGES[-1], y + TOTALS_LINE_HEIGHT - 5)
+        c.setFillColor(COLOR_HEADING)
+        c.setFont(FONT_BOLD, 10)
+        c.drawRightString(label_x, y, label)
+        c.setFont(FONT_BOLD if emphasised else FONT, 10)
+        c.drawRightString(value_x, y, value)
+        y -= TOTALS_LINE_HEIGHT
+
+    if notes_lines:
+        y -= 12
+        c.setFillColor(COLOR_HEADING)
+        c.setFont(FONT_BOLD, 14)
+        c.drawString(MARGIN_X, y, "Notes:")
+        y -= 18
+        c.setFillColor(COLOR_TEXT)
+        c.setFont(FONT, 10)
+        for line in notes_lines:
+            c.drawString(MARGIN_X, y, line)
+            y -= NOTES_LINE_HEIGHT
+
+    c.setFillColor(COLOR_MUTED)
+    c.setFont(FONT, 8)
+    c.drawCentredString(PAGE_WIDTH / 2, y - FOOTER_HEIGHT + 12, "Thank you for your business!")
+
+
+def _plan_pages(first_top: float, row_count: int, trailer_height: float) -> list:
+    """Split rows into pages: list of (row_start, row_end, table_top, has_trailer)"""
+    pages = []
+    start = 0
+    top = first_top
+    while True:
+        capacity = int((top - HEADER_ROW_HEIGHT - MARGIN_BOTTOM) // ROW_HEIGHT)
+        end = min(row_count, start + max(capacity, 1))
+        pages.append([start, end, top, False])
+        start = end
+        if start >= row_count:
+            break
+        top = CONTINUATION_TOP
+    # Trailer goes under the last rows if it fits, else on its own page
+    last_start, last_end, last_top, _ = pages[-1]
+    table_bottom = last_top - HEADER_ROW_HEIGHT - (last_end - last_start) * ROW_HEIGHT
+    if table_bottom - trailer_height >= MARGIN_BOTTOM:
+        pages[-1][3] = True
+    else:
+        pages.append([row_count, row_count, CONTINUATION_TOP, True])
+    return pages
+
+
+def render_invoice_pdf(sale_data: dict) -> bytes:
+    """Render an invoice PDF by drawing the fixed layout directly"""
+    rows = [_item_row(idx, item) for idx, item in enumerate(sale_data['items'], 1)]
+    totals = _totals_rows(sale_data)
+    notes_lines = simpleSplit(sale_data['notes'], FONT, 10, CONTENT_WIDTH) if sale_data.get('notes') else []
+
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=A4)
+    c.setTitle(f"Invoice {sale_data['invoiceNumber']}")
+
+    first_top = _draw_header(c, sale_data)
+    pages = _plan_pages(first_top, len(rows), _trailer_height(totals, notes_lines))
+    page_count = len(pages)
+
+    for page_no, (start, end, top, has_trailer) in enumerate(pages, 1):
+        y = top
+        if end > start:
+            y = _draw_rows(c, _draw_table_header(c, top), rows[start:end])
+        if has_trailer:
+            _draw_trailer(c, y, totals, notes_lines)
+        if page_count > 1:
+            c.setFillColor(COLOR_MUTED)
+            c.setFont(FONT, 8)
+            c.drawRightString(
+                MARGIN_X + CONTENT_WIDTH, PAGE_NUMBER_Y,
+                f"{sale_data['invoiceNumber']} - Page {page_no} of {page_count}"
+            )
+        c.showPage()
+
+    c.save()
+    return buffer.getvalue()
@@ -6,6 +6,25 @@ from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.enums import TA_CENTER, TA_RIGHT, TA_LEFT
 from io import BytesIO
 from datetime import datetime
+import logging
+import os
+
+from utils.invoice_canvas import render_invoice_pdf
+
+logger = logging.getLogger(__name__)
+
+# "canvas" (fast path) or "platypus" (original flow layout)
+INVOICE_RENDERER = os.environ.get("INVOICE_RENDERER", "canvas")
+
+def render_invoice_document(sale_data: dict) -> bytes:
+    """Render an invoice with the configured renderer, falling back to platypus"""
+    if INVOICE_RENDERER == "platypus":
+        return generate_invoice_pdf(sale_data)
+    try:
+        return render_invoice_pdf(sale_data)
+    except Exception:
+        logger.exception(f"Fast invoice renderer failed for {sale_data.get('invoiceNumber')}, using platypus")
+        return generate_invoice_pdf(sale_data)
 
 def generate_invoice_pdf(sale_data: dict) -> bytes:
     """Generate PDF invoice for a sale"""
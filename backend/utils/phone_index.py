@@ -0,0 +1,50 @@
+"""Sorted in-memory index of customer phone numbers for prefix lookup"""
+from bisect import bisect_left, insort
+
+
+class PhoneIndex:
+    """(phone, id) pairs kept sorted so a prefix is one contiguous range"""
+
+    def __init__(self):
+        self.loaded = False
+        self._entries = []  # sorted (phone, customer id)
+        self._customers = {}  # customer id -> (phone, name)
+
+    def __len__(self):
+        return len(self._customers)
+
+    def rebuild(self, customers):
+        self._customers = {c["id"]: (c["phone"], c.get("name")) for c in customers}
+        self._entries = sorted((phone, customer_id) for customer_id, (phone, _) in self._customers.items())
+        self.loaded = True
+
+    def add(self, customer: dict):
+        """Index or re-index a customer document"""
+        self.remove(customer["id"])
+        self._customers[customer["id"]] = (customer["phone"], customer.get("name"))
+        insort(self._entries, (customer["phone"], customer["id"]))
+
+    def remove(self, customer_id: str):
+        entry = self._customers.pop(customer_id, None)
+        if entry is None:
+            return
+        key = (entry[0], customer_id)
+        i = bisect_left(self._entries, key)
+        if i < len(self._entries) and self._entries[i] == key:
+            del self._entries[i]
+
+    def prefix(self, phone_prefix: str, limit: int = 10) -> list:
+        """Customers whose phone starts with the prefix, in phone order"""
+        entries = self._entries
+        i = bisect_left(entries, (phone_prefix,))
+        matches = []
+        while i < len(entries) and len(matches) < limit:
+            phone, customer_id = entries[i]
+            if not phone.startswith(phone_prefix):
+                break
+            matches.append({"id": customer_id, "name": self._customers[customer_id][1], "phone": phone})
+            i += 1
+        return matches
+
+
+customer_phone_index = PhoneIndex()
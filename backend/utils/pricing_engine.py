@@ -0,0 +1,166 @@
+"""Server-side cart pricing.
+
+``PriceTable`` keeps each product's selling price and tax rate in two
+``array('d')`` columns addressed by a slot index, with a dict from product
+id to slot. Quoting a cart is then one dict lookup and a few float
+operations per line, with no per-product objects.
+
+The math mirrors the POS screen: a line discount (fixed amount or
+percentage of price x quantity) comes off before tax, the cart discount
+comes off the discounted subtotal, and tax is the sum of line taxes.
+``subtotal`` is the gross amount before any discount.
+"""
+from array import array
+import os
+
+PERCENTAGE = "percentage"
+# Allowed difference between client and server amounts (rupees)
+TOLERANCE = float(os.environ.get("SALE_PRICE_TOLERANCE", 0.01))
+VALIDATION_MODES = ("off", "warn", "enforce")
+VALIDATION_MODE = os.environ.get("SALE_PRICE_VALIDATION", "warn").lower()
+if VALIDATION_MODE not in VALIDATION_MODES:
+    VALIDATION_MODE = "warn"
+
+
+def _value(discount_type) -> str:
+    return getattr(discount_type, "value", discount_type)
+
+
+class PriceTable:
+    def __init__(self):
+        self._slots = {}
+        self._prices = array("d")
+        self._tax_rates = array("d")
+        self._free = []
+        self.loaded = False
+
+    def __len__(self):
+        return len(self._slots)
+
+    def rebuild(self, products):
+        self._slots = {}
+        self._prices = array("d")
+        self._tax_rates = array("d")
+        self._free = []
+        for product in products:
+            self.set(product)
+        self.loaded = True
+
+    def set(self, product: dict):
+        """Add or refresh a product from its ``pricing``"""
+        pricing = product.get("pricing")
+        if not pricing:
+            return
+        price = float(pricing.get("sellingPrice") or 0)
+        tax_rate = float(pricing.get("taxRate") or 0)
+        slot = self._slots.get(product["id"])
+        if slot is None:
+            if self._free:
+                slot = self._free.pop()
+                self._prices[slot] = price
+                self._tax_rates[slot] = tax_rate
+            else:
+                slot = len(self._prices)
+                self._prices.append(price)
+                self._tax_rates.append(tax_rate)
+            self._slots[product["id"]] = slot
+        else:
+            self._prices[slot] = price
+            self._tax_rates[slot] = tax_rate
+
+    def remove(self, product_id: str):
+        slot = self._slots.pop(product_id, None)
+        if slot is not None:
+            self._free.append(slot)
+
+    def price(self, product_id: str):
+        slot = self._slots.get(product_id)
+        return None if slot is None else self._prices[slot]
+
+    def quote(self, lines, discount_type=None, discount_amount: float = 0) -> dict:
+        """Price a cart of (productId, quantity, discount, discountType) lines"""
+        slots = self._slots
+        prices = self._prices
+        tax_rates = self._tax_rates
+        items = []
+        missing = []
+        gross = 0.0
+        net = 0.0
+        tax = 0.0
+        for product_id, quantity, discount, line_discount_type in lines:
+            slot = slots.get(product_id)
+            if slot is None:
+                missing.append(product_id)
+                continue
+            price = prices[slot]
+            tax_rate = tax_rates[slot]
+            line_subtotal = price * quantity
+            # DiscountType is a str enum, so it compares equal to its value
+            if line_discount_type == PERCENTAGE:
+                line_discount = line_subtotal * discount / 100
+            else:
+                line_discount = discount
+            after_discount = line_subtotal - line_discount
+            line_tax = after_discount * tax_rate / 100
+            gross += line_subtotal
+            net += after_discount
+            tax += line_tax
+            items.append({
+                "productId": product_id,
+                "quantity": quantity,
+                "unitPrice": price,
+                "discount": discount,
+                "discountType": line_discount_type,
+                "discountValue": round(line_discount, 2),
+                "taxRate": tax_rate,
+                "taxAmount": round(line_tax, 2),
+                "lineTotal": round(after_discount + line_tax, 2),
+            })
+
+        if _value(discount_type) == PERCENTAGE:
+            cart_discount = net * discount_amount / 100
+        else:
+            cart_discount = discount_amount
+        return {
+            "items": items,
+            "subtotal": round(gross, 2),
+            "discountAmount": round(cart_discount, 2),
+            "discountType": _value(discount_type),
+            "taxAmount": round(tax, 2),
+            "total": round(net - cart_discount + tax, 2),
+            "missing": missing,
+        }
+
+    def check_sale(self, sale: dict) -> list:
+        """Differences between a sale's client-computed amounts and a quote.
+
+        The sale's ``discountAmount`` is the cart discount already worked
+        out by the POS, so it is applied as a fixed amount.
+        """
+        quote = self.quote(
+            [(item["productId"], item["quantity"], item.get("discount", 0), item.get("discountType"))
+             for item in sale["items"]],
+            "fixed", sale.get("discountAmount", 0)
+        )
+        problems = [f"Product {product_id} has no price" for product_id in quote["missing"]]
+        by_product = {}
+        for item in sale["items"]:
+            by_product.setdefault(item["productId"], []).append(item)
+        for quoted in quote["items"]:
+            item = by_product[quoted["productId"]].pop(0)
+            for field in ("unitPrice", "taxAmount", "lineTotal"):
+                if abs(item.get(field, 0) - quoted[field]) > TOLERANCE:
+                    problems.append(
+                        f"{item.get('sku') or quoted['productId']}: {field} {item.get(field, 0)} "
+                        f"does not match {quoted[field]}"
+                    )
+        if not quote["missing"]:
+            for field in ("subtotal", "taxAmount", "total"):
+                # Rounding can add up over many lines
+                allowed = TOLERANCE * max(len(sale["items"]), 1)
+                if abs(sale.get(field, 0) - quote[field]) > allowed:
+                    problems.append(f"{field} {sale.get(field, 0)} does not match {quote[field]}")
+        return problems
+
+
+price_table = PriceTable()
@@ -0,0 +1,224 @@
+"""Bulk product import from CSV or NDJSON.
+
+Rows are read from a text stream in chunks, validated with ``ProductCreate``
+and upserted by SKU with one unordered ``bulk_write`` per chunk, so memory
+stays bounded by the chunk size however large the file is. CSV columns use
+dotted names for nested fields (``pricing.sellingPrice``, ``stock.quantity``).
+"""
+from pydantic import ValidationError
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from starlette.concurrency import run_in_threadpool
+from datetime import datetime, timezone
+from itertools import islice
+import csv
+import json
+import uuid
+
+import numpy as np
+
+from models.product import ProductCreate
+from utils.stock import with_stock_flags
+from utils.catalog_sync import sync_now
+from utils.inventory import default_warehouse_id
+from utils.stock_ledger import movement, reason, record
+
+BATCH_SIZE = 1000
+# Errors beyond this many are counted but not listed in the report
+MAX_REPORTED_ERRORS = 1000
+FORMATS = ("csv", "ndjson")
+
+
+def detect_format(filename: str) -> str:
+    """Import format from a file name, or None if it is not recognised"""
+    name = (filename or "").lower()
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith((".ndjson", ".jsonl")):
+        return "ndjson"
+    return None
+
+
+def _nest(row: dict) -> dict:
+    """Turn dotted CSV columns into nested documents; empty cells are omitted"""
+    doc = {}
+    for key, value in row.items():
+        if key is None or value is None or value == "":
+            continue
+        *parents, leaf = key.strip().split(".")
+        target = doc
+        for part in parents:
+            target = target.setdefault(part, {})
+        target[leaf] = value
+    return doc
+
+
+def read_rows(stream, fmt: str):
+    """Yield (line number, raw row or parse error) from a text stream"""
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, _nest(row)
+    else:
+        for line_num, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_num, ValueError(f"Invalid JSON: {e}")
+                continue
+            yield line_num, row if isinstance(row, dict) else ValueError("Row is not a JSON object")
+
+
+def _row_error(line: int, row, errors: list) -> dict:
+    sku = row.get("sku") if isinstance(row, dict) else None
+    return {"line": line, "sku": sku, "errors": errors}
+
+
+def profit_margins(purchase: np.ndarray, selling: np.ndarray) -> np.ndarray:
+    """Margin over purchase price in percent, 0 where the purchase price is 0"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        margins = np.round((selling - purchase) / purchase * 100, 2)
+    return np.where(purchase > 0, margins, 0.0)
+
+
+def prepare_batch(rows: list, created_by: str) -> tuple:
+    """Validate a chunk of rows and build its upserts.
+
+    Returns (operations, (line, sku, new id, opening quantity) of each
+    operation, row errors). When a SKU appears more than once in the chunk
+    the last row wins. Stock is only written for new products; existing
+    stock is owned by the warehouse ledger and left alone.
+    """
+    errors = []
+    valid = {}  # sku -> (line, document)
+    for line, row in rows:
+        if isinstance(row, Exception):
+            errors.append(_row_error(line, None, [{"field": None, "message": str(row)}]))
+            continue
+        try:
+            product = ProductCreate.model_validate(row)
+        except ValidationError as e:
+            errors.append(_row_error(line, row, [
+                {"field": ".".join(str(part) for part in err["loc"]), "message": err["msg"]}
+                for err in e.errors()
+            ]))
+            continue
+        doc = product.model_dump()
+        doc["sku"] = doc["sku"].upper()
+        previous = valid.pop(doc["sku"], None)
+        if previous is not None:
+            errors.append(_row_error(previous[0], row, [
+                {"field": "sku", "message": f"Duplicate SKU, replaced by line {line}"}
+            ]))
+        valid[doc["sku"]] = (line, doc)
+
+    entries = list(valid.values())
+    purchase = np.fromiter((doc["pricing"]["purchasePrice"] for _, doc in entries), float, len(entries))
+    selling = np.fromiter((doc["pricing"]["sellingPrice"] for _, doc in entries), float, len(entries))
+    margins = profit_margins(purchase, selling).tolist()
+
+    now = datetime.now(timezone.utc).isoformat()
+    synced_at = sync_now()
+    operations = []
+    keys = []
+    for (line, doc), margin in zip(entries, margins):
+        stock = with_stock_flags(doc.pop("stock"))
+        doc["profitMargin"] = margin
+        doc["updatedAt"] = now
+        doc["syncedAt"] = synced_at
+        product_id = str(uuid.uuid4())
+        operations.append(UpdateOne(
+            {"sku": doc["sku"]},
+            {"$set": doc, "$setOnInsert": {
+                "id": product_id, "stock": stock, "createdBy": created_by, "createdAt": now
+            }},
+            upsert=True
+        ))
+        keys.append((line, doc["sku"], product_id, stock["quantity"]))
+    return operations, keys, errors
+
+
+class ImportReport:
+    """Running totals and a capped list of row errors"""
+
+    def __init__(self):
+        self.processed = 0
+        self.inserted = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_errors(self, errors: list):
+        self.failed += len(errors)
+        room = MAX_REPORTED_ERRORS - len(self.errors)
+        self.errors.extend(errors[:max(room, 0)])
+
+    def to_dict(self) -> dict:
+        return {
+            "processed": self.processed,
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errorsTruncated": self.failed > len(self.errors),
+        }
+
+
+async def import_products(db, stream, fmt: str, created_by: str,
+                          batch_size: int = BATCH_SIZE, on_batch=None) -> dict:
+    """Import every row of a text stream; returns the report as a dict.
+
+    ``on_batch`` is awaited with the SKUs written by each batch, e.g. to
+    refresh in-memory indexes.
+    """
+    report = ImportReport()
+    rows = read_rows(stream, fmt)
+    while True:
+        # Reading and validation are CPU bound; keep them off the event loop
+        chunk = await run_in_threadpool(lambda: list(islice(rows, batch_size)))
+        if not chunk:
+            break
+        report.processed += len(chunk)
+        operations, keys, errors = await run_in_threadpool(prepare_batch, chunk, created_by)
+        report.add_errors(errors)
+        if not operations:
+            continue
+        try:
+            result = await db.products.bulk_write(operations, ordered=False)
+            report.inserted += result.upserted_count
+            report.updated += result.matched_count
+            upserted = list(result.upserted_ids)
+            written = [key[1] for key in keys]
+        except BulkWriteError as e:
+            details = e.details
+            report.inserted += details.get("nUpserted", 0)
+            report.updated += details.get("nMatched", 0)
+            upserted = [entry["index"] for entry in details.get("upserted", [])]
+            write_errors = {err["index"]: err for err in details.get("writeErrors", [])}
+            report.add_errors([
+                _row_error(keys[index][0], {"sku": keys[index][1]}, [
+                    {"field": None, "message": err.get("errmsg", "Write failed")}
+                ])
+                for index, err in write_errors.items()
+            ])
+            written = [key[1] for index, key in enumerate(keys) if index not in write_errors]
+        if upserted:
+            # Opening stock of new products goes into the default warehouse
+            warehouse_id = await default_warehouse_id(db)
+            await db.warehouse_stock.bulk_write([
+                UpdateOne(
+                    {"productId": keys[index][2], "warehouseId": warehouse_id},
+                    {"$inc": {"quantity": keys[index][3]}},
+                    upsert=True
+                )
+                for index in upserted
+            ], ordered=False)
+            await record(db, [
+                movement(keys[index][2], warehouse_id, keys[index][3], reason("opening", keys[index][2], created_by))
+                for index in upserted if keys[index][3]
+            ])
+        if on_batch is not None and written:
+            await on_batch(written)
+    return report.to_dict()
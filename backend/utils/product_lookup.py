@@ -0,0 +1,112 @@
+"""Barcode/SKU hash index with a hot cache of POS product fields.
+
+Every barcode and SKU maps to a product id in a plain dict, so a scan
+resolves in O(1). The POS fields of recently scanned products are kept in an
+LRU so repeated scans of the same items never leave the process.
+"""
+from collections import OrderedDict
+import os
+
+LOOKUP_FIELDS = {
+    "_id": 0, "id": 1, "name": 1, "sku": 1, "barcode": 1, "unit": 1,
+    "category": 1, "pricing": 1, "stock": 1, "isActive": 1,
+}
+
+
+def normalize_code(code: str) -> str:
+    return code.strip().upper()
+
+
+def cacheable(fields) -> bool:
+    """True if every requested (possibly dotted) field is held in the hot cache"""
+    return all(field.split(".", 1)[0] in LOOKUP_FIELDS for field in fields)
+
+
+def project(product: dict, fields) -> dict:
+    """Apply a Mongo-style inclusion projection to a cached product"""
+    projected = {"id": product["id"]}
+    for field in fields:
+        *parents, leaf = field.split(".")
+        source, target = product, projected
+        for part in parents:
+            source = source.get(part) if isinstance(source, dict) else None
+            if not isinstance(source, dict):
+                break
+            target = target.setdefault(part, {})
+        else:
+            if leaf in source:
+                target[leaf] = source[leaf]
+    return projected
+
+
+class ProductLookup:
+    """Code -> id index for every product plus an LRU of hydrated products"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.loaded = False
+        self._codes = {}  # code -> product id
+        self._product_codes = {}  # product id -> codes registered for it
+        self._hot = OrderedDict()  # product id -> POS fields
+
+    def _register(self, product: dict):
+        product_id = product["id"]
+        for code in self._product_codes.pop(product_id, ()):
+            if self._codes.get(code) == product_id:
+                del self._codes[code]
+        codes = [normalize_code(product[key]) for key in ("sku", "barcode") if product.get(key)]
+        for code in codes:
+            self._codes[code] = product_id
+        self._product_codes[product_id] = codes
+
+    def rebuild(self, products):
+        self._codes.clear()
+        self._product_codes.clear()
+        self._hot.clear()
+        for product in products:
+            self._register(product)
+        self.loaded = True
+
+    def resolve(self, code: str):
+        """Product id for a barcode or SKU, or None"""
+        return self._codes.get(normalize_code(code))
+
+    def get(self, product_id: str):
+        product = self._hot.get(product_id)
+        if product is not None:
+            self._hot.move_to_end(product_id)
+        return product
+
+    def put(self, product: dict):
+        """Register a product's codes and cache its POS fields"""
+        self._register(product)
+        self._hot[product["id"]] = {key: product.get(key) for key in LOOKUP_FIELDS if key != "_id"}
+        self._hot.move_to_end(product["id"])
+        while len(self._hot) > self.capacity:
+            self._hot.popitem(last=False)
+
+    def update(self, product: dict):
+        """Apply a product write; only refresh the cache if it was hot"""
+        if product["id"] in self._hot:
+            self.put(product)
+        else:
+            self._register(product)
+
+    def set_stock(self, product_id: str, stock: dict):
+        """Refresh the cached stock of a hot product after a stock write"""
+        product = self._hot.get(product_id)
+        if product is not None:
+            product["stock"] = stock
+
+    def clear_hot(self):
+        """Forget every cached product, e.g. after a bulk price change"""
+        self._hot.clear()
+
+    def remove(self, product_id: str):
+        for code in self._product_codes.pop(product_id, ()):
+            if self._codes.get(code) == product_id:
+                del self._codes[code]
+        self._hot.pop(product_id, None)
+
+
+product_lookup = ProductLookup(int(os.environ.get("PRODUCT_LOOKUP_CACHE_SIZE", 20000)))
@@ -0,0 +1,119 @@
+"""Thermal receipt renderer (plain fixed-width text and ESC/POS bytes).
+
+80mm printers fit 48 columns in font A (58mm rolls fit 32). Both outputs are
+built from the same list of receipt lines so they never disagree.
+"""
+
+DEFAULT_WIDTH = 48
+
+# Line styles
+LEFT = 0
+CENTER = 1
+BOLD = 2
+TALL = 4
+
+# ESC/POS commands
+ESC_INIT = b"\x1b@"
+ESC_ALIGN_LEFT = b"\x1ba\x00"
+ESC_ALIGN_CENTER = b"\x1ba\x01"
+ESC_BOLD_ON = b"\x1bE\x01"
+ESC_BOLD_OFF = b"\x1bE\x00"
+GS_SIZE_TALL = b"\x1d!\x01"
+GS_SIZE_NORMAL = b"\x1d!\x00"
+ESC_FEED = b"\x1bd\x04"
+GS_CUT = b"\x1dVB\x00"
+
+
+def _money(value: float) -> str:
+    return f"{value:,.2f}"
+
+
+def _pair(left: str, right: str, width: int) -> str:
+    """Left text and right-aligned text on one line"""
+    space = width - len(right) - 1
+    return f"{left[:space]:<{space}} {right}"
+
+
+def receipt_lines(sale_data: dict, width: int = DEFAULT_WIDTH) -> list:
+    """Lay out a sale as (text, style) receipt lines"""
+    rule = "-" * width
+    lines = [
+        ("STOCKPILOT", CENTER | BOLD | TALL),
+        ("Store Management System", CENTER),
+        (rule, LEFT),
+        (f"Invoice: {sale_data['invoiceNumber']}", LEFT),
+        (f"Date: {sale_data['saleDate'].strftime('%d-%m-%Y %H:%M')}", LEFT),
+    ]
+    if sale_data.get('customerName'):
+        customer = sale_data['customerName']
+        if sale_data.get('customerPhone'):
+            customer = f"{customer} ({sale_data['customerPhone']})"
+        lines.append((f"Customer: {customer}"[:width], LEFT))
+    lines.append((rule, LEFT))
+
+    for item in sale_data['items']:
+        lines.append((item['productName'][:width], LEFT))
+        detail = f"  {item['quantity']:g} x {_money(item['unitPrice'])}"
+        if item.get('discount'):
+            if item['discountType'] == 'percentage':
+                detail += f" -{item['discount']:g}%"
+            else:
+                detail += f" -{_money(item['discount'])}"
+        if item.get('taxRate'):
+            detail += f" +{item['taxRate']:g}%tax"
+        lines.append((_pair(detail, _money(item['lineTotal']), width), LEFT))
+    lines.append((rule, LEFT))
+
+    lines.append((_pair("Subtotal", _money(sale_data['subtotal']), width), LEFT))
+    if sale_data.get('discountAmount', 0) > 0:
+        lines.append((_pair("Discount", "-" + _money(sale_data['discountAmount']), width), LEFT))
+    if sale_data.get('taxAmount', 0) > 0:
+        lines.append((_pair("Tax", _money(sale_data['taxAmount']), width), LEFT))
+    lines.append((_pair("TOTAL", "Rs. " + _money(sale_data['total']), width), BOLD | TALL))
+    if sale_data.get('amountPaid', 0) > 0:
+        paid_label = f"Paid ({sale_data['paymentMode'].upper()})"
+        lines.append((_pair(paid_label, _money(sale_data['amountPaid']), width), LEFT))
+        balance = sale_data['total'] - sale_data['amountPaid']
+        if balance > 0:
+            lines.append((_pair("Balance", _money(balance), width), BOLD))
+    lines.append((rule, LEFT))
+
+    if sale_data.get('notes'):
+        notes = sale_data['notes']
+        for start in range(0, len(notes), width):
+            lines.append((notes[start:start + width], LEFT))
+        lines.append(("", LEFT))
+    lines.append(("Thank you for your business!", CENTER))
+    return lines
+
+
+def render_receipt_text(sale_data: dict, width: int = DEFAULT_WIDTH) -> str:
+    """Render a receipt as fixed-width plain text"""
+    out = []
+    for text, style in receipt_lines(sale_data, width):
+        out.append(text.center(width).rstrip() if style & CENTER else text)
+    return "\n".join(out) + "\n"
+
+
+def render_receipt_escpos(sale_data: dict, width: int = DEFAULT_WIDTH) -> bytes:
+    """Render a receipt as an ESC/POS byte stream ending with a paper cut"""
+    out = [ESC_INIT]
+    align = LEFT
+    for text, style in receipt_lines(sale_data, width):
+        line_align = style & CENTER
+        if line_align != align:
+            out.append(ESC_ALIGN_CENTER if line_align else ESC_ALIGN_LEFT)
+            align = line_align
+        if style & BOLD:
+            out.append(ESC_BOLD_ON)
+        if style & TALL:
+            out.append(GS_SIZE_TALL)
+        out.append(text.encode("ascii", "replace"))
+        out.append(b"\n")
+        if style & TALL:
+            out.append(GS_SIZE_NORMAL)
+        if style & BOLD:
+            out.append(ESC_BOLD_OFF)
+    out.append(ESC_FEED)
+    out.append(GS_CUT)
+    return b"".join(out)
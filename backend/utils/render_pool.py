@@ -0,0 +1,30 @@
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+import os
+
+from utils.invoice_generator import render_invoice_document
+
+RENDER_WORKERS = int(os.environ.get("INVOICE_RENDER_WORKERS", os.cpu_count() or 1))
+
+_pool = None
+
+
+def get_render_pool() -> ProcessPoolExecutor:
+    """Process pool for PDF rendering (ReportLab is CPU bound and holds the GIL)"""
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS)
+    return _pool
+
+
+async def render_invoice(sale_data: dict) -> bytes:
+    """Render an invoice PDF in a worker process"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_render_pool(), render_invoice_document, sale_data)
+
+
+def shutdown_render_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
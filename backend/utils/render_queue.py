@@ -0,0 +1,122 @@
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import logging
+import os
+import time
+
+from utils.invoice_cache import invoice_cache, invoice_digest
+from utils.render_pool import render_invoice, RENDER_WORKERS
+
+logger = logging.getLogger(__name__)
+
+
+class InvoiceRenderQueue:
+    """In-process job queue that pre-renders invoices into the invoice cache.
+
+    Jobs are keyed by sale revision; a download that arrives while its job is
+    still queued or rendering awaits the job instead of rendering again.
+    """
+
+    def __init__(self, workers: int, max_depth: int):
+        self.workers = workers
+        self.max_depth = max_depth
+        self._queue = None
+        self._tasks = []
+        self._jobs = {}  # (sale_id, digest) -> Future[bytes | None]
+        self._accepting = False
+        self.enqueued = 0
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._total_lag = 0.0
+        self._total_render = 0.0
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_depth)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._accepting = True
+
+    def schedule(self, sale_data: dict) -> bool:
+        """Queue a sale for rendering; returns False if it was not queued"""
+        if not self._accepting:
+            return False
+        digest = invoice_digest(sale_data["id"], sale_data["updatedAt"])
+        key = (sale_data["id"], digest)
+        if key in self._jobs or invoice_cache.contains(*key):
+            return False
+        if self._queue.full():
+            self.dropped += 1
+            return False
+        sale = {k: v for k, v in sale_data.items() if k != "_id"}
+        self._jobs[key] = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((key, sale, time.monotonic()))
+        self.enqueued += 1
+        return True
+
+    def pending(self, sale_id: str, digest: str):
+        """Future for an in-flight render of this sale revision (resolving to
+        the PDF bytes, or None on failure), or None"""
+        return self._jobs.get((sale_id, digest))
+
+    async def _worker(self):
+        while True:
+            key, sale, enqueued_at = await self._queue.get()
+            started = time.monotonic()
+            lag = started - enqueued_at
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            self._total_lag += lag
+            pdf_bytes = None
+            try:
+                pdf_bytes = await render_invoice(sale)
+                await run_in_threadpool(invoice_cache.put, key[0], key[1], pdf_bytes)
+                self.processed += 1
+                self._total_render += time.monotonic() - started
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Background invoice render failed for {sale.get('invoiceNumber')}: {e}")
+            finally:
+                future = self._jobs.pop(key)
+                if not future.done():
+                    future.set_result(pdf_bytes)
+                self._queue.task_done()
+
+    async def drain(self, timeout: float = 30):
+        """Stop accepting jobs, finish queued renders, then stop workers"""
+        self._accepting = False
+        if self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Invoice render queue drain timed out with {self._queue.qsize()} jobs left")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for future in self._jobs.values():
+            if not future.done():
+                future.set_result(None)
+        self._jobs.clear()
+
+    def metrics(self) -> dict:
+        completed = self.processed + self.failed
+        return {
+            "depth": self._queue.qsize() if self._queue else 0,
+            "inFlight": len(self._jobs),
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "lastLagMs": round(self.last_lag * 1000, 2),
+            "maxLagMs": round(self.max_lag * 1000, 2),
+            "avgLagMs": round(self._total_lag / completed * 1000, 2) if completed else 0,
+            "avgRenderMs": round(self._total_render / self.processed * 1000, 2) if self.processed else 0,
+        }
+
+
+render_queue = InvoiceRenderQueue(
+    workers=int(os.environ.get("INVOICE_PRERENDER_WORKERS", RENDER_WORKERS)),
+    max_depth=int(os.environ.get("INVOICE_PRERENDER_MAX_DEPTH", 1000)),
+)
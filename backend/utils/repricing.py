@@ -0,0 +1,59 @@
+"""Aggregation expressions for server-side bulk repricing.
+
+New prices and ``profitMargin`` are computed by MongoDB inside one
+``update_many`` pipeline, using the same rounding as single product writes.
+"""
+
+# Margin over purchase price in percent, 0 when the purchase price is 0
+PROFIT_MARGIN_EXPR = {"$cond": [
+    {"$gt": ["$pricing.purchasePrice", 0]},
+    {"$round": [{"$multiply": [
+        {"$divide": [{"$subtract": ["$pricing.sellingPrice", "$pricing.purchasePrice"]}, "$pricing.purchasePrice"]},
+        100
+    ]}, 2]},
+    0
+]}
+
+
+def repriced_expr(field: str, mode: str, value: float) -> dict:
+    """New value of pricing.<field>, rounded to paise and never negative"""
+    current = f"$pricing.{field}"
+    if mode == "percentage":
+        changed = {"$multiply": [current, 1 + value / 100]}
+    else:
+        changed = {"$add": [current, value]}
+    return {"$max": [{"$round": [changed, 2]}, 0]}
+
+
+def reprice_pipeline(field: str, mode: str, value: float, updated_at: str, synced_at) -> list:
+    return [
+        {"$set": {
+            f"pricing.{field}": repriced_expr(field, mode, value),
+            "updatedAt": updated_at,
+            "syncedAt": {"$literal": synced_at},
+        }},
+        {"$set": {"profitMargin": PROFIT_MARGIN_EXPR}},
+    ]
+
+
+def reprice_preview_pipeline(query: dict, field: str, mode: str, value: float, sample_size: int) -> list:
+    """Count of matching products plus a sample showing old and new prices"""
+    return [
+        {"$match": query},
+        {"$facet": {
+            "count": [{"$count": "matched"}],
+            "sample": [
+                {"$sort": {"sku": 1}},
+                {"$limit": sample_size},
+                {"$project": {
+                    "_id": 0, "id": 1, "name": 1, "sku": 1, "pricing": 1,
+                    "oldPrice": f"$pricing.{field}",
+                    "oldProfitMargin": "$profitMargin",
+                    "newPrice": repriced_expr(field, mode, value),
+                }},
+                {"$set": {f"pricing.{field}": "$newPrice"}},
+                {"$set": {"newProfitMargin": PROFIT_MARGIN_EXPR}},
+                {"$unset": "pricing"},
+            ],
+        }},
+    ]
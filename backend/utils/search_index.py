@@ -0,0 +1,197 @@
+"""In-memory product search index.
+
+Queries are matched two ways: normalized token prefixes (via a sorted token
+list and bisect) and trigram postings for substrings anywhere in the name or
+SKU. Results are ranked ids; callers hydrate documents by ``id``.
+"""
+from bisect import bisect_left, insort
+import heapq
+import re
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Rank weights, highest first
+SCORE_SKU_EXACT = 100
+SCORE_SKU_PREFIX = 60
+SCORE_NAME_PREFIX = 40
+SCORE_TOKEN_PREFIX = 20
+SCORE_SUBSTRING = 10
+
+# A query whose most selective token prefixes more products than this is
+# too broad to rank in memory within typeahead latency; search() returns
+# None and the caller queries the database instead
+BROAD_QUERY_LIMIT = 10000
+
+
+def normalize(text: str) -> str:
+    return " ".join(_TOKEN_RE.findall(text.lower()))
+
+
+def trigrams(text: str) -> set:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class ProductSearchIndex:
+    """Token prefix + trigram index over product name and SKU"""
+
+    def __init__(self):
+        self.loaded = False
+        self._docs = {}  # id -> (name_norm, sku_norm, name, category, brand, words)
+        self._token_ids = {}  # token -> set(id)
+        self._tokens = []  # sorted distinct tokens
+        self._grams = {}  # trigram -> set(id)
+
+    def __len__(self):
+        return len(self._docs)
+
+    def _text(self, name_norm: str, sku_norm: str) -> str:
+        return f"{name_norm} {sku_norm}"
+
+    def add(self, product: dict):
+        """Index or re-index a product document"""
+        product_id = product["id"]
+        if product_id in self._docs:
+            self.remove(product_id)
+        name_norm = normalize(product.get("name", ""))
+        sku_norm = normalize(product.get("sku", ""))
+        text = self._text(name_norm, sku_norm)
+        words = tuple(set(text.split()))
+        self._docs[product_id] = (
+            name_norm, sku_norm, product.get("name", ""),
+            product.get("category"), product.get("brand"), words
+        )
+        for token in words:
+            ids = self._token_ids.get(token)
+            if ids is None:
+                ids = self._token_ids[token] = set()
+                insort(self._tokens, token)
+            ids.add(product_id)
+        for gram in trigrams(text):
+            self._grams.setdefault(gram, set()).add(product_id)
+
+    def remove(self, product_id: str):
+        entry = self._docs.pop(product_id, None)
+        if entry is None:
+            return
+        for token in entry[5]:
+            ids = self._token_ids.get(token)
+            if ids is None:
+                continue
+            ids.discard(product_id)
+            if not ids:
+                del self._token_ids[token]
+                del self._tokens[bisect_left(self._tokens, token)]
+        for gram in trigrams(self._text(entry[0], entry[1])):
+            ids = self._grams.get(gram)
+            if ids is not None:
+                ids.discard(product_id)
+                if not ids:
+                    del self._grams[gram]
+
+    def rebuild(self, products):
+        """Replace the index contents with the given documents"""
+        self._docs.clear()
+        self._token_ids.clear()
+        self._tokens.clear()
+        self._grams.clear()
+        for product in products:
+            self.add(product)
+        self.loaded = True
+
+    def _prefix_range(self, prefix: str) -> tuple:
+        """Tokens starting with prefix as (start, end, posting size).
+
+        Counting stops once the size passes BROAD_QUERY_LIMIT.
+        """
+        tokens = self._tokens
+        start = i = bisect_left(tokens, prefix)
+        size = 0
+        while i < len(tokens) and tokens[i].startswith(prefix):
+            size += len(self._token_ids[tokens[i]])
+            i += 1
+            if size > BROAD_QUERY_LIMIT:
+                i = bisect_left(tokens, prefix + "\x7f", i)
+                break
+        return start, i, size
+
+    def _prefix_ids(self, start: int, end: int, other_tokens: list, category: str, brand: str) -> set:
+        """Ids under the token range that also match the filters and prefix
+        every other query token; nothing is dropped before filtering"""
+        docs = self._docs
+        ids = set()
+        for i in range(start, end):
+            for product_id in self._token_ids[self._tokens[i]]:
+                doc = docs[product_id]
+                if category is not None and doc[3] != category:
+                    continue
+                if brand is not None and doc[4] != brand:
+                    continue
+                if other_tokens and not all(
+                    any(word.startswith(token) for word in doc[5]) for token in other_tokens
+                ):
+                    continue
+                ids.add(product_id)
+        return ids
+
+    def _substring_ids(self, query: str) -> set:
+        grams = trigrams(query)
+        postings = sorted((self._grams.get(gram, set()) for gram in grams), key=len)
+        if not postings or not postings[0]:
+            return set()
+        ids = set(postings[0])
+        for posting in postings[1:]:
+            ids &= posting
+            if not ids:
+                break
+        # Trigrams can co-occur without being contiguous; confirm the match
+        docs = self._docs
+        return {i for i in ids if query in self._text(docs[i][0], docs[i][1])}
+
+    def search(self, query: str, category: str = None, brand: str = None, limit: int = None) -> list:
+        """Return matching product ids, best match first (at most ``limit``),
+        or None when the query is too broad to rank in memory"""
+        query = normalize(query)
+        if not query:
+            return []
+        query_tokens = query.split()
+
+        # Every query token must prefix-match some token of the product.
+        # Materialize the most selective token, then filter by the others.
+        ranges = sorted((self._prefix_range(token) + (token,) for token in set(query_tokens)), key=lambda r: r[2])
+        start, end, size, _ = ranges[0]
+        if size > BROAD_QUERY_LIMIT:
+            return None
+        prefix_matches = self._prefix_ids(start, end, [r[3] for r in ranges[1:]], category, brand)
+        docs = self._docs
+        candidates = prefix_matches
+        # Substring-only matches always score lowest, so they cannot reach a
+        # page that prefix matches already fill
+        if len(query) >= 3 and (limit is None or len(prefix_matches) < limit):
+            candidates = prefix_matches | self._substring_ids(query)
+
+        scored = []
+        for product_id in candidates:
+            name_norm, sku_norm, name, doc_category, doc_brand, _ = docs[product_id]
+            if category is not None and doc_category != category:
+                continue
+            if brand is not None and doc_brand != brand:
+                continue
+            if sku_norm == query:
+                score = SCORE_SKU_EXACT
+            elif sku_norm.startswith(query):
+                score = SCORE_SKU_PREFIX
+            elif name_norm.startswith(query):
+                score = SCORE_NAME_PREFIX
+            elif product_id in prefix_matches:
+                score = SCORE_TOKEN_PREFIX
+            else:
+                score = SCORE_SUBSTRING
+            scored.append((-score, len(name), name, product_id))
+        if limit is not None:
+            scored = heapq.nsmallest(limit, scored)
+        else:
+            scored.sort()
+        return [entry[3] for entry in scored]
+
+
+product_search_index = ProductSearchIndex()
@@ -0,0 +1,53 @@
+"""Materialized low-stock flags.
+
+Every write that changes ``stock.quantity`` or ``stock.reorderPoint`` also
+stores ``stock.isLow`` (quantity at or below the reorder point) and
+``stock.shortfall`` (units missing to reach the reorder point). A partial
+index over the low rows lets the low-stock screen page by severity without a
+collection scan.
+"""
+import base64
+import json
+
+
+def stock_flags(quantity: float, reorder_point: float) -> dict:
+    return {
+        "isLow": quantity <= reorder_point,
+        "shortfall": max(reorder_point - quantity, 0),
+    }
+
+
+def with_stock_flags(stock: dict) -> dict:
+    """Stock sub-document with isLow/shortfall recomputed"""
+    return {**stock, **stock_flags(stock.get("quantity", 0), stock.get("reorderPoint", 0))}
+
+
+# Update-pipeline stage that recomputes the flags server side, for updates
+# that change quantity atomically ($add) and for backfills
+STOCK_FLAGS_STAGE = {"$set": {
+    "stock.isLow": {"$lte": [{"$ifNull": ["$stock.quantity", 0]}, {"$ifNull": ["$stock.reorderPoint", 0]}]},
+    "stock.shortfall": {"$max": [
+        {"$subtract": [{"$ifNull": ["$stock.reorderPoint", 0]}, {"$ifNull": ["$stock.quantity", 0]}]}, 0
+    ]},
+}}
+
+# Sort order of the low-stock screen: worst shortfall first, id as tiebreak
+LOW_STOCK_SORT = [("stock.shortfall", -1), ("id", 1)]
+
+
+def encode_low_stock_cursor(product: dict) -> str:
+    payload = json.dumps([product["stock"]["shortfall"], product["id"]])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def low_stock_cursor_filter(cursor: str) -> dict:
+    """Filter for rows after the cursor in LOW_STOCK_SORT order; ValueError if malformed"""
+    try:
+        shortfall, product_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        shortfall = float(shortfall)
+    except TypeError:
+        raise ValueError("Invalid cursor")
+    return {"$or": [
+        {"stock.shortfall": {"$lt": shortfall}},
+        {"stock.shortfall": shortfall, "id": {"$gt": str(product_id)}},
+    ]}
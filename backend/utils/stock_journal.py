@@ -0,0 +1,115 @@
+"""Journaled stock moves.
+
+Moving stock from one place to another (a warehouse row to another
+warehouse, or a ledger row to a shard) is a debit and a credit on two
+documents. The move is written to ``stock_move_journal`` first, and each
+side is one conditional update that also tags its document with the move
+id, so repeating a step is a no-op. A mover that dies part way leaves the
+journal entry behind; once its lease runs out ``resume_moves`` finishes it
+instead of the stock being lost.
+
+A place is ``{"warehouseId": ...}`` for a ``warehouse_stock`` row, plus
+``"shard": n`` for a ``stock_shards`` counter.
+"""
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from bson import ObjectId
+from datetime import datetime, timedelta, timezone
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+EPSILON = 1e-9
+# A move not finished within this is taken over by resume_moves
+MOVE_LEASE = timedelta(seconds=60)
+
+
+def _location(db, product_id: str, place: dict):
+    """Collection and filter of one side of a move"""
+    query = {"productId": product_id, "warehouseId": place["warehouseId"]}
+    if place.get("shard") is None:
+        return db.warehouse_stock, query
+    return db.stock_shards, {**query, "shard": place["shard"]}
+
+
+async def move(db, product_id: str, quantity: float, source: dict, target: dict) -> bool:
+    """Journal a move of stock between two places, then do it. False if the
+    source did not hold the quantity; nothing is moved then."""
+    now = datetime.now(timezone.utc)
+    entry = {
+        "_id": ObjectId(),
+        "productId": product_id,
+        "quantity": quantity,
+        "from": source,
+        "to": target,
+        "createdAt": now,
+        "leaseUntil": now + MOVE_LEASE,
+    }
+    await db.stock_move_journal.insert_one(entry)
+    return await finish_move(db, entry)
+
+
+async def finish_move(db, entry: dict) -> bool:
+    """Carry out a journaled move; safe to repeat after a crash at any step.
+    Returns False if the source no longer held the quantity (sold since it
+    was read) and nothing was moved."""
+    move_id = entry["_id"]
+    product_id = entry["productId"]
+    quantity = entry["quantity"]
+    now = datetime.now(timezone.utc)
+
+    collection, query = _location(db, product_id, entry["from"])
+    debited = await collection.update_one(
+        {**query, "quantity": {"$gte": quantity - EPSILON}, "moves": {"$ne": move_id}},
+        {"$inc": {"quantity": -quantity}, "$addToSet": {"moves": move_id}, "$set": {"updatedAt": now}}
+    )
+    if not debited.modified_count and await collection.find_one({**query, "moves": move_id}, {"_id": 1}) is None:
+        await db.stock_move_journal.delete_one({"_id": move_id})
+        return False
+
+    collection, query = _location(db, product_id, entry["to"])
+    try:
+        await collection.update_one(
+            {**query, "moves": {"$ne": move_id}},
+            {"$inc": {"quantity": quantity}, "$addToSet": {"moves": move_id}, "$set": {"updatedAt": now}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # The target already carries the tag: credited before a restart
+        pass
+
+    for collection in (db.warehouse_stock, db.stock_shards):
+        await collection.update_many({"productId": product_id, "moves": move_id}, {"$pull": {"moves": move_id}})
+    await db.stock_move_journal.delete_one({"_id": move_id})
+    return True
+
+
+async def resume_moves(db) -> set:
+    """Finish moves whose mover died; claimed by lease so only one worker
+    runs each. Returns the ids of the products whose stock moved."""
+    products = set()
+    while True:
+        now = datetime.now(timezone.utc)
+        entry = await db.stock_move_journal.find_one_and_update(
+            {"leaseUntil": {"$lt": now}},
+            {"$set": {"leaseUntil": now + MOVE_LEASE}},
+            return_document=ReturnDocument.AFTER
+        )
+        if entry is None:
+            return products
+        logger.info(f"Resuming stock move {entry['_id']} for product {entry['productId']}")
+        await finish_move(db, entry)
+        products.add(entry["productId"])
+
+
+async def run_journal_task(db):
+    """Background task finishing abandoned moves"""
+    while True:
+        try:
+            await resume_moves(db)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Resuming stock moves failed")
+        await asyncio.sleep(MOVE_LEASE.total_seconds() / 2)
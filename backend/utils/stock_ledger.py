@@ -0,0 +1,265 @@
+"""Append-only history of stock movements.
+
+Every change to a ``warehouse_stock`` row is also written to
+``stock_movements`` as ``{productId, warehouseId, delta, type, referenceId}``
+so the quantity on hand at any past moment can be rebuilt. Movements are
+never updated; a cancelled sale is recorded as new ``cancel`` movements.
+
+A periodic job folds the movements since its previous run into
+``stock_snapshots`` (one row per product and warehouse that moved), and
+movements older than ``STOCK_MOVEMENT_RETENTION_DAYS`` are deleted once a
+snapshot covers them. A point-in-time query reads the nearest snapshot at or
+before the requested time and sums only the movements after it, so the scan
+is bounded by one snapshot interval.
+
+Snapshots stop ``STOCK_SNAPSHOT_LAG_SECONDS`` short of the current time so
+movements written a moment after their stock change are not left out.
+"""
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timedelta, timezone
+import asyncio
+import logging
+import os
+import uuid
+
+from utils.catalog_sync import sync_now
+
+logger = logging.getLogger(__name__)
+
+MOVEMENT_TYPES = ("opening", "sale", "return", "cancel", "adjust", "receive", "transfer")
+
+SNAPSHOT_INTERVAL = int(os.environ.get("STOCK_SNAPSHOT_INTERVAL_SECONDS", 6 * 3600))
+SNAPSHOT_LAG = timedelta(seconds=int(os.environ.get("STOCK_SNAPSHOT_LAG_SECONDS", 300)))
+RETENTION = timedelta(days=int(os.environ.get("STOCK_MOVEMENT_RETENTION_DAYS", 90)))
+
+SNAPSHOT_LEASE = "stock_snapshots"
+
+
+def reason(kind: str, reference_id: str = None, user_id: str = None, note: str = None) -> dict:
+    """Why stock moved; passed through the inventory functions"""
+    if kind not in MOVEMENT_TYPES:
+        raise ValueError(f"Unknown movement type {kind}")
+    return {"type": kind, "referenceId": reference_id, "userId": user_id, "note": note}
+
+
+def movement(product_id: str, warehouse_id: str, delta: float, why: dict, at: datetime = None) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "productId": product_id,
+        "warehouseId": warehouse_id,
+        "delta": delta,
+        "type": why["type"],
+        "referenceId": why.get("referenceId"),
+        "createdBy": why.get("userId"),
+        "note": why.get("note"),
+        "createdAt": at or sync_now(),
+    }
+
+
+async def record(db, movements: list):
+    """Append movements in one write"""
+    if movements:
+        await db.stock_movements.insert_many(movements, ordered=False)
+
+
+def _as_utc(value: datetime) -> datetime:
+    # Motor returns naive datetimes in UTC unless the client is tz aware
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+async def _runs(db) -> tuple:
+    """First and latest snapshot runs, or None when snapshots never ran"""
+    first = await db.stock_snapshot_runs.find_one({}, {"_id": 0}, sort=[("at", 1)])
+    if first is None:
+        return None, None
+    latest = await db.stock_snapshot_runs.find_one({}, {"_id": 0}, sort=[("at", -1)])
+    return first, latest
+
+
+async def ensure_baseline(db):
+    """Snapshot every ledger row once so history starts from real quantities"""
+    if await db.stock_snapshot_runs.find_one({}, {"_id": 1}):
+        return
+    at = sync_now()
+    await db.warehouse_stock.aggregate([
+        {"$project": {"productId": 1, "warehouseId": 1, "quantity": 1}},
+        # Sharded products hold their stock in stock_shards
+        {"$unionWith": {"coll": "stock_shards", "pipeline": [
+            {"$project": {"productId": 1, "warehouseId": 1, "quantity": 1}}
+        ]}},
+        {"$group": {
+            "_id": {"productId": "$productId", "warehouseId": "$warehouseId"},
+            "quantity": {"$sum": "$quantity"},
+        }},
+        {"$project": {
+            "_id": 0,
+            "productId": "$_id.productId",
+            "warehouseId": "$_id.warehouseId",
+            "quantity": 1,
+            "at": {"$literal": at},
+        }},
+        {"$merge": {
+            "into": "stock_snapshots",
+            "on": ["productId", "warehouseId", "at"],
+            "whenMatched": "keepExisting",
+            "whenNotMatched": "insert",
+        }},
+    ]).to_list(None)
+    await db.stock_snapshot_runs.insert_one({"at": at, "baseline": True, "createdAt": datetime.now(timezone.utc)})
+
+
+def snapshot_pipeline(since, until: datetime) -> list:
+    """Fold movements in (since, until] into snapshots at ``until``"""
+    window = {"$lte": until}
+    if since is not None:
+        window["$gt"] = since
+    return [
+        {"$match": {"createdAt": window}},
+        {"$group": {
+            "_id": {"productId": "$productId", "warehouseId": "$warehouseId"},
+            "delta": {"$sum": "$delta"},
+            "movements": {"$sum": 1},
+        }},
+        {"$lookup": {
+            "from": "stock_snapshots",
+            "let": {"productId": "$_id.productId", "warehouseId": "$_id.warehouseId"},
+            "pipeline": [
+                {"$match": {"$expr": {"$and": [
+                    {"$eq": ["$productId", "$$productId"]},
+                    {"$eq": ["$warehouseId", "$$warehouseId"]},
+                ]}}},
+                {"$sort": {"at": -1}},
+                {"$limit": 1},
+                {"$project": {"_id": 0, "quantity": 1}},
+            ],
+            "as": "previous",
+        }},
+        {"$project": {
+            "_id": 0,
+            "productId": "$_id.productId",
+            "warehouseId": "$_id.warehouseId",
+            "at": {"$literal": until},
+            "quantity": {"$add": [
+                {"$ifNull": [{"$arrayElemAt": ["$previous.quantity", 0]}, 0]},
+                "$delta",
+            ]},
+            "movements": 1,
+        }},
+        {"$merge": {
+            "into": "stock_snapshots",
+            "on": ["productId", "warehouseId", "at"],
+            "whenMatched": "replace",
+            "whenNotMatched": "insert",
+        }},
+    ]
+
+
+async def take_snapshots(db) -> dict:
+    """Snapshot everything that moved since the last run, then compact"""
+    await ensure_baseline(db)
+    _, latest = await _runs(db)
+    since = latest["at"]
+    until = sync_now() - SNAPSHOT_LAG
+    if until <= _as_utc(since):
+        return {"at": since, "compactedBefore": latest.get("compactedBefore"), "deleted": 0}
+
+    await db.stock_movements.aggregate(snapshot_pipeline(since, until)).to_list(None)
+
+    # Only movements already folded into a snapshot may go
+    compacted_before = min(until, sync_now() - RETENTION)
+    result = await db.stock_movements.delete_many({"createdAt": {"$lt": compacted_before}})
+    previous_horizon = latest.get("compactedBefore")
+    if previous_horizon is not None:
+        compacted_before = max(compacted_before, _as_utc(previous_horizon))
+
+    await db.stock_snapshot_runs.insert_one({
+        "at": until,
+        "compactedBefore": compacted_before,
+        "deleted": result.deleted_count,
+        "createdAt": datetime.now(timezone.utc),
+    })
+    return {"at": until, "compactedBefore": compacted_before, "deleted": result.deleted_count}
+
+
+async def _acquire_lease(db, name: str, seconds: int) -> bool:
+    """Let one worker of several run a periodic job"""
+    now = datetime.now(timezone.utc)
+    try:
+        await db.job_leases.update_one(
+            {"_id": name, "until": {"$lte": now}},
+            {"$set": {"until": now + timedelta(seconds=seconds)}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # Another worker holds an unexpired lease
+        return False
+    return True
+
+
+async def run_snapshot_job(db):
+    """Background task taking snapshots every STOCK_SNAPSHOT_INTERVAL_SECONDS"""
+    while True:
+        try:
+            if await _acquire_lease(db, SNAPSHOT_LEASE, SNAPSHOT_INTERVAL):
+                await take_snapshots(db)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Stock snapshot run failed")
+        await asyncio.sleep(SNAPSHOT_INTERVAL)
+
+
+async def on_hand_at(db, product_id: str, at: datetime, warehouse_id: str = None) -> dict:
+    """Quantity of a product at ``at``: nearest snapshot plus later movements"""
+    match = {"productId": product_id}
+    if warehouse_id:
+        match["warehouseId"] = warehouse_id
+
+    snapshots = await db.stock_snapshots.aggregate([
+        {"$match": {**match, "at": {"$lte": at}}},
+        {"$sort": {"warehouseId": 1, "at": -1}},
+        {"$group": {
+            "_id": "$warehouseId",
+            "at": {"$first": "$at"},
+            "quantity": {"$first": "$quantity"},
+        }},
+    ]).to_list(None)
+    base = {snapshot["_id"]: snapshot for snapshot in snapshots}
+
+    # Each warehouse only needs the movements after its own snapshot
+    windows = [
+        {"warehouseId": wid, "createdAt": {"$gt": snapshot["at"], "$lte": at}}
+        for wid, snapshot in base.items()
+    ]
+    windows.append({"warehouseId": {"$nin": list(base)}, "createdAt": {"$lte": at}})
+    moved = await db.stock_movements.aggregate([
+        {"$match": {**match, "$or": windows}},
+        {"$group": {"_id": "$warehouseId", "delta": {"$sum": "$delta"}, "movements": {"$sum": 1}}},
+    ]).to_list(None)
+    moved = {row["_id"]: row for row in moved}
+
+    warehouses = []
+    for wid in sorted(set(base) | set(moved)):
+        snapshot = base.get(wid)
+        change = moved.get(wid, {})
+        warehouses.append({
+            "warehouseId": wid,
+            "quantity": (snapshot["quantity"] if snapshot else 0) + change.get("delta", 0),
+            "snapshotAt": snapshot["at"] if snapshot else None,
+            "movements": change.get("movements", 0),
+        })
+
+    first, latest = await _runs(db)
+    # Before tracking started, or where movements were compacted away, the
+    # answer is the nearest snapshot rather than the exact quantity
+    exact = first is not None and at >= _as_utc(first["at"])
+    if exact and latest.get("compactedBefore") is not None:
+        exact = at >= _as_utc(latest["compactedBefore"])
+    return {
+        "productId": product_id,
+        "warehouseId": warehouse_id,
+        "at": at,
+        "quantity": sum(row["quantity"] for row in warehouses),
+        "warehouses": warehouses,
+        "exact": exact,
+    }
@@ -0,0 +1,344 @@
+"""Sharded stock counters for hot products.
+
+A product flagged with ``stockShards: K`` keeps its stock in K documents
+per warehouse in ``stock_shards`` instead of one ``warehouse_stock`` row,
+so concurrent checkouts of the same SKU update different documents. A
+decrement tries a random shard, then a second one, and only then drains
+several shards in turn. Increments go to a random shard.
+
+For every product and warehouse the quantity on hand is always the ledger
+row plus its shards, so turning sharding on or off only moves stock
+between them and checkouts on another worker that still see the old mode
+keep working.
+
+The product's ``stock.quantity`` is not touched by each sale of a sharded
+product (that single document is the bottleneck). Instead a background
+task folds the shard totals into it every ``STOCK_SHARD_INTERVAL_SECONDS``,
+evens out the shards, and moves stock left in the wrong place after a mode
+change. Allocation reads shard totals through a short-lived cached view.
+
+Stock moved between a ledger row and the shards, or between shards, is a
+journaled move (see ``utils.stock_journal``), so a crash mid-move is
+finished later instead of losing the stock. Maintenance of one product
+holds a lease in ``job_leases`` so two workers never move its stock at once.
+"""
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timedelta, timezone
+import asyncio
+import logging
+import os
+import random
+import time
+import uuid
+
+from utils.stock import STOCK_FLAGS_STAGE
+from utils.catalog_sync import sync_now
+from utils.events import event_bus, StockChanged
+from utils.stock_journal import move, resume_moves
+
+logger = logging.getLogger(__name__)
+
+EPSILON = 1e-9
+MAX_SHARDS = 64
+REGISTRY_CACHE_SECONDS = 30
+VIEW_TTL = float(os.environ.get("STOCK_SHARD_VIEW_TTL_MS", 500)) / 1000
+TASK_INTERVAL = float(os.environ.get("STOCK_SHARD_INTERVAL_SECONDS", 2))
+# Shards are evened out once one drifts this far from an equal split
+REBALANCE_SKEW = 0.5
+# A worker that dies mid-maintenance holds up its product this long at most
+MAINTENANCE_LEASE = timedelta(seconds=60)
+
+
+class ShardRegistry:
+    """Which products are sharded, refreshed from the products collection"""
+
+    def __init__(self):
+        self._counts = {}
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        self._loaded_at = 0.0
+
+    async def counts(self, db) -> dict:
+        if time.monotonic() - self._loaded_at < REGISTRY_CACHE_SECONDS:
+            return self._counts
+        async with self._lock:
+            if time.monotonic() - self._loaded_at >= REGISTRY_CACHE_SECONDS:
+                products = await db.products.find(
+                    {"stockShards": {"$gt": 0}}, {"_id": 0, "id": 1, "stockShards": 1}
+                ).to_list(None)
+                self._counts = {product["id"]: product["stockShards"] for product in products}
+                self._loaded_at = time.monotonic()
+        return self._counts
+
+    async def count(self, db, product_id: str) -> int:
+        return (await self.counts(db)).get(product_id, 0)
+
+
+class ShardView:
+    """Cached per-warehouse shard totals of sharded products"""
+
+    def __init__(self, ttl: float = VIEW_TTL):
+        self.ttl = ttl
+        self._totals = {}
+
+    async def totals(self, db, product_id: str, fresh: bool = False) -> dict:
+        entry = self._totals.get(product_id)
+        if not fresh and entry is not None and time.monotonic() - entry[0] < self.ttl:
+            return entry[1]
+        totals = await shard_totals(db, product_id)
+        self._totals[product_id] = (time.monotonic(), totals)
+        return totals
+
+    def invalidate(self, product_id: str):
+        self._totals.pop(product_id, None)
+
+
+shard_registry = ShardRegistry()
+shard_view = ShardView()
+# Products whose stock total needs folding into the product document
+_dirty = set()
+
+
+def mark_dirty(product_id: str):
+    _dirty.add(product_id)
+
+
+async def shard_totals(db, product_id: str) -> dict:
+    rows = await db.stock_shards.aggregate([
+        {"$match": {"productId": product_id}},
+        {"$group": {"_id": "$warehouseId", "quantity": {"$sum": "$quantity"}}},
+    ]).to_list(None)
+    return {row["_id"]: row["quantity"] for row in rows}
+
+
+async def _change_shard(db, product_id: str, warehouse_id: str, shard: int, delta: float) -> bool:
+    query = {"productId": product_id, "warehouseId": warehouse_id, "shard": shard}
+    if delta < 0:
+        query["quantity"] = {"$gte": -delta - EPSILON}
+    result = await db.stock_shards.update_one(
+        query,
+        {"$inc": {"quantity": delta}, "$set": {"updatedAt": datetime.now(timezone.utc)}},
+        upsert=delta >= 0
+    )
+    return result.modified_count > 0 or result.upserted_id is not None
+
+
+async def add(db, product_id: str, warehouse_id: str, quantity: float, shards: int):
+    await _change_shard(db, product_id, warehouse_id, random.randrange(shards), quantity)
+    shard_view.invalidate(product_id)
+
+
+async def take(db, product_id: str, warehouse_id: str, quantity: float, shards: int) -> bool:
+    """Remove quantity from the product's shards in one warehouse, all or nothing"""
+    if shards:
+        # Two random single-shard attempts cover the common case
+        for shard in random.sample(range(shards), min(2, shards)):
+            if await _change_shard(db, product_id, warehouse_id, shard, -quantity):
+                shard_view.invalidate(product_id)
+                return True
+
+    # Fallback: drain the fullest shards until the quantity is covered
+    rows = await db.stock_shards.find(
+        {"productId": product_id, "warehouseId": warehouse_id, "quantity": {"$gt": EPSILON}},
+        {"_id": 0, "shard": 1, "quantity": 1}
+    ).sort("quantity", -1).to_list(None)
+    taken = []
+    remaining = quantity
+    for row in rows:
+        if remaining <= EPSILON:
+            break
+        part = min(row["quantity"], remaining)
+        if await _change_shard(db, product_id, warehouse_id, row["shard"], -part):
+            taken.append((row["shard"], part))
+            remaining -= part
+    if remaining > EPSILON:
+        for shard, part in taken:
+            await _change_shard(db, product_id, warehouse_id, shard, part)
+        return False
+    shard_view.invalidate(product_id)
+    return True
+
+
+async def _move(db, product_id: str, warehouse_id: str, quantity: float, source: dict, target: dict) -> bool:
+    """Journaled move between the ledger row ({}) and a shard ({"shard": n})"""
+    moved = await move(
+        db, product_id, quantity, {"warehouseId": warehouse_id, **source}, {"warehouseId": warehouse_id, **target}
+    )
+    shard_view.invalidate(product_id)
+    return moved
+
+
+async def _rows_into_shards(db, product_id: str, shards: int):
+    # The whole row goes to one shard in one write, so checkouts only miss
+    # it for a moment; the rebalance that follows spreads it out
+    while True:
+        row = await db.warehouse_stock.find_one(
+            {"productId": product_id, "quantity": {"$gt": EPSILON}},
+            {"_id": 0, "warehouseId": 1, "quantity": 1}
+        )
+        if row is None:
+            return
+        await _move(db, product_id, row["warehouseId"], row["quantity"], {}, {"shard": random.randrange(shards)})
+
+
+async def _shards_into_rows(db, product_id: str):
+    while True:
+        shard = await db.stock_shards.find_one(
+            {"productId": product_id, "quantity": {"$gt": EPSILON}},
+            {"_id": 0, "warehouseId": 1, "shard": 1, "quantity": 1}
+        )
+        if shard is None:
+            break
+        await _move(db, product_id, shard["warehouseId"], shard["quantity"], {"shard": shard["shard"]}, {})
+    # Empty shards can go, except ones an unfinished move still points at
+    await db.stock_shards.delete_many(
+        {"productId": product_id, "quantity": {"$lte": EPSILON}, "moves.0": {"$exists": False}}
+    )
+
+
+async def _rebalance(db, product_id: str, shards: int):
+    """Move stock from full shards to empty ones so random picks keep hitting"""
+    rows = await db.stock_shards.find(
+        {"productId": product_id}, {"_id": 0, "warehouseId": 1, "shard": 1, "quantity": 1}
+    ).to_list(None)
+    by_warehouse = {}
+    for row in rows:
+        by_warehouse.setdefault(row["warehouseId"], {})[row["shard"]] = row["quantity"]
+    for warehouse_id, quantities in by_warehouse.items():
+        levels = [quantities.get(shard, 0) for shard in range(shards)]
+        # Shards beyond the current count (after lowering K) are emptied
+        extra = sum(quantity for shard, quantity in quantities.items() if shard >= shards)
+        target = (sum(levels) + extra) / shards
+        if extra <= EPSILON and max(levels) - min(levels) <= max(REBALANCE_SKEW * target, 1):
+            continue
+        surplus = []
+        for shard, quantity in quantities.items():
+            if shard >= shards:
+                surplus.append((shard, quantity))
+            elif quantity - target > EPSILON:
+                surplus.append((shard, quantity - target))
+        deficits = [(shard, target - level) for shard, level in enumerate(levels) if target - level > EPSILON]
+        for shard, amount in surplus:
+            while amount > EPSILON and deficits:
+                to_shard, need = deficits[0]
+                part = min(need, amount)
+                # Conditional on the shard still holding it; sales may have won
+                if not await _move(db, product_id, warehouse_id, part, {"shard": shard}, {"shard": to_shard}):
+                    break
+                amount -= part
+                if need - part <= EPSILON:
+                    deficits.pop(0)
+                else:
+                    deficits[0] = (to_shard, need - part)
+            if amount > EPSILON and shard >= shards and not deficits:
+                await _move(db, product_id, warehouse_id, amount, {"shard": shard}, {"shard": 0})
+    await db.stock_shards.delete_many({
+        "productId": product_id, "shard": {"$gte": shards}, "quantity": {"$lte": EPSILON},
+        "moves.0": {"$exists": False}
+    })
+    shard_view.invalidate(product_id)
+
+
+async def fold_total(db, product_id: str):
+    """Set the product's stock total to its ledger rows plus shards"""
+    rows = await db.warehouse_stock.aggregate([
+        {"$match": {"productId": product_id}},
+        {"$project": {"quantity": 1}},
+        {"$unionWith": {"coll": "stock_shards", "pipeline": [
+            {"$match": {"productId": product_id}}, {"$project": {"quantity": 1}}
+        ]}},
+        {"$group": {"_id": None, "quantity": {"$sum": "$quantity"}}},
+    ]).to_list(None)
+    total = rows[0]["quantity"] if rows else 0
+    product = await db.products.find_one_and_update(
+        {"id": product_id, "stock.quantity": {"$ne": total}},
+        [
+            {"$set": {
+                "stock.quantity": {"$literal": total},
+                "updatedAt": datetime.now(),
+                "syncedAt": {"$literal": sync_now()}
+            }},
+            STOCK_FLAGS_STAGE
+        ],
+        projection={"_id": 0, "stock": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if product is not None:
+        await event_bus.publish(StockChanged(product_id, product["stock"]))
+
+
+async def _leased(db, product_id: str, work) -> bool:
+    """Run work() under the product's maintenance lease; False if another
+    worker holds it"""
+    name = f"stock_shards:{product_id}"
+    owner = str(uuid.uuid4())
+    now = datetime.now(timezone.utc)
+    try:
+        await db.job_leases.update_one(
+            {"_id": name, "until": {"$lte": now}},
+            {"$set": {"until": now + MAINTENANCE_LEASE, "owner": owner}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return False
+    try:
+        await work()
+    finally:
+        await db.job_leases.update_one(
+            {"_id": name, "owner": owner}, {"$set": {"until": datetime.now(timezone.utc)}}
+        )
+    return True
+
+
+async def _maintain(db, product_id: str, shards: int):
+    if shards:
+        await _rows_into_shards(db, product_id, shards)
+        await _rebalance(db, product_id, shards)
+    else:
+        await _shards_into_rows(db, product_id)
+    shard_view.invalidate(product_id)
+    await fold_total(db, product_id)
+
+
+async def maintain(db, product_id: str, shards: int) -> bool:
+    """Put stock where the product's mode says, even the shards, fold the
+    total. False if another worker is maintaining the product."""
+    return await _leased(db, product_id, lambda: _maintain(db, product_id, shards))
+
+
+async def set_shards(db, product_id: str, shards: int):
+    """Turn sharding on (shards > 0), change the count, or turn it off (0)"""
+    if shards:
+        await db.products.update_one({"id": product_id}, {"$set": {"stockShards": shards}})
+    else:
+        await db.products.update_one({"id": product_id}, {"$unset": {"stockShards": ""}})
+    shard_registry.invalidate()
+    await maintain(db, product_id, shards)
+
+
+async def run_shard_task(db):
+    """Background task keeping sharded products' totals and shards in shape"""
+    while True:
+        try:
+            for product_id in await resume_moves(db):
+                shard_view.invalidate(product_id)
+            counts = dict(await shard_registry.counts(db))
+            # Products unsharded elsewhere may still have shards to drain
+            for product_id in await db.stock_shards.distinct("productId"):
+                counts.setdefault(product_id, 0)
+            pending = set(_dirty)
+            _dirty.clear()
+            for product_id, shards in counts.items():
+                if await maintain(db, product_id, shards):
+                    pending.discard(product_id)
+            for product_id in pending:
+                if not await _leased(db, product_id, lambda: fold_total(db, product_id)):
+                    mark_dirty(product_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Stock shard maintenance failed")
+        await asyncio.sleep(TASK_INTERVAL)
@@ -0,0 +1,149 @@
+"""Constant-memory CSV/NDJSON export of a collection.
+
+Documents are pulled from a projected cursor one batch at a time, encoded
+and flushed in ~64 KB chunks (optionally gzip-compressed), so memory stays
+flat however many rows are exported. CSV columns use the same dotted names
+the product import reads, so an export can be edited and imported back.
+"""
+from fastapi.responses import StreamingResponse
+from datetime import datetime, timezone
+import csv
+import io
+import json
+import zlib
+
+EXPORT_BATCH_SIZE = 1000
+CHUNK_BYTES = 64 * 1024
+FORMATS = ("csv", "ndjson")
+
+_ADDRESS = ("address.street", "address.city", "address.state", "address.pincode", "address.country")
+
+EXPORT_COLUMNS = {
+    "products": (
+        "id", "name", "sku", "barcode", "description", "category", "brand", "unit",
+        "pricing.purchasePrice", "pricing.sellingPrice", "pricing.mrp", "pricing.discount", "pricing.taxRate",
+        "stock.quantity", "stock.reorderPoint", "stock.warehouse",
+        "supplier", "isActive", "profitMargin", "createdAt", "updatedAt",
+    ),
+    "customers": (
+        "id", "name", "phone", "email", "gstNumber", *_ADDRESS,
+        "loyaltyPoints", "creditLimit", "outstandingBalance", "isActive", "createdAt", "updatedAt",
+    ),
+    "suppliers": (
+        "id", "name", "phone", "email", "gstNumber", *_ADDRESS,
+        "paymentTerms", "outstandingBalance", "rating", "isActive", "createdAt", "updatedAt",
+    ),
+}
+
+
+def export_projection(columns) -> dict:
+    return {"_id": 0, **{column: 1 for column in columns}}
+
+
+def _cell(value):
+    if value is None:
+        return ""
+    if value is True or value is False:
+        return "true" if value else "false"
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _getter(column: str):
+    """Fast accessor for a column; nested documents are at most two levels deep"""
+    parts = column.split(".")
+    if len(parts) == 1:
+        return lambda doc: doc.get(column)
+    parent, child = parts
+
+    def get(doc):
+        value = doc.get(parent)
+        return value.get(child) if isinstance(value, dict) else None
+    return get
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+class _Encoder:
+    """Encodes batches of documents to bytes, gzip-compressing if asked"""
+
+    def __init__(self, columns, fmt: str, compress: bool):
+        self.fmt = fmt
+        self.columns = columns
+        self._getters = [_getter(column) for column in columns]
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, lineterminator="\n")
+        self._gzip = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+    def _bytes(self, text: str) -> bytes:
+        data = text.encode()
+        return self._gzip.compress(data) if self._gzip else data
+
+    def header(self) -> bytes:
+        if self.fmt != "csv":
+            return b""
+        self._writer.writerow(self.columns)
+        return self._take()
+
+    def _take(self) -> bytes:
+        text = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return self._bytes(text)
+
+    def encode(self, docs: list) -> bytes:
+        if self.fmt == "csv":
+            getters = self._getters
+            self._writer.writerows([_cell(get(doc)) for get in getters] for doc in docs)
+            return self._take()
+        return self._bytes("".join(
+            json.dumps(doc, default=_json_default, separators=(",", ":")) + "\n" for doc in docs
+        ))
+
+    def finish(self) -> bytes:
+        return self._gzip.flush() if self._gzip else b""
+
+
+async def stream_export(cursor, columns, fmt: str, compress: bool = False):
+    """Yield the encoded export of every document the cursor returns"""
+    encoder = _Encoder(columns, fmt, compress)
+    pending = [encoder.header()]
+    size = len(pending[0])
+    try:
+        while True:
+            docs = await cursor.to_list(EXPORT_BATCH_SIZE)
+            if not docs:
+                break
+            chunk = encoder.encode(docs)
+            pending.append(chunk)
+            size += len(chunk)
+            if size >= CHUNK_BYTES:
+                yield b"".join(pending)
+                pending = []
+                size = 0
+        pending.append(encoder.finish())
+        yield b"".join(pending)
+    finally:
+        await cursor.close()
+
+
+def export_response(collection, name: str, fmt: str, compress: bool,
+                    query: dict = None) -> StreamingResponse:
+    """StreamingResponse exporting a collection with its EXPORT_COLUMNS"""
+    columns = EXPORT_COLUMNS[name]
+    cursor = collection.find(query or {}, export_projection(columns)).sort("_id", 1).batch_size(EXPORT_BATCH_SIZE)
+    filename = f"{name}_{datetime.now(timezone.utc).strftime('%Y%m%d')}.{fmt}"
+    media_type = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    if compress:
+        filename += ".gz"
+        media_type = "application/gzip"
+    return StreamingResponse(
+        stream_export(cursor, columns, fmt, compress),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
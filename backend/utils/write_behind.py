@@ -0,0 +1,245 @@
+"""Group-commit writer for append-only records (sale and refund transactions).
+
+Documents handed to ``write`` are collected and inserted with one
+``insert_many`` every ``flush_ms`` milliseconds, or as soon as
+``max_batch`` documents are waiting. Two durability modes:
+
+``ack``
+    ``write`` returns once the batch holding the document is inserted.
+    Callers still wait, but many requests share one round trip.
+``spill``
+    ``write`` appends the document to an on-disk spill file and returns
+    at once. Each process spills to its own ``<name>.<pid>.ndjson`` and
+    holds an exclusive lock on it while running. On start, every spill
+    file no live process holds is replayed into MongoDB, so a crash
+    before the flush does not lose the record. Failed flushes are retried.
+
+``off`` inserts each document directly, as before. Every document gets its
+``_id`` before it is queued, so replaying the spill file cannot insert a
+record twice.
+
+Each writer feeds the one collection it was started with.
+"""
+from bson import ObjectId, json_util
+from pymongo.errors import BulkWriteError
+from collections import deque
+from pathlib import Path
+import asyncio
+import fcntl
+import logging
+import os
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+MODES = ("off", "ack", "spill")
+DEFAULT_SPILL_DIR = Path(tempfile.gettempdir()) / "stockpilot-write-behind"
+RETRY_SECONDS = 1.0
+
+
+class WriteBehind:
+    def __init__(self, name: str, mode: str = "ack", flush_ms: float = 10, max_batch: int = 500,
+                 spill_path: Path = None):
+        self.name = name
+        self.mode = mode if mode in MODES else "ack"
+        self.interval = flush_ms / 1000
+        self.max_batch = max_batch
+        self._spill_base = Path(spill_path or DEFAULT_SPILL_DIR / f"{name}.ndjson")
+        self.spill_path = self._own_spill_path()
+        self._collection = None
+        self._pending = deque()  # (doc, future or None)
+        self._wake = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task = None
+        self._spill = None
+        self._accepting = False
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+        self.retries = 0
+        self.replayed = 0
+        self.last_flush = 0.0
+        self.max_flush = 0.0
+        self._total_flush = 0.0
+
+    async def start(self, collection):
+        self._collection = collection
+        if self.mode == "off":
+            return
+        if self.mode == "spill":
+            # Resolved here, not at import, in case workers were forked since
+            self.spill_path = self._own_spill_path()
+            self.spill_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self._spill_base.with_suffix(".lock"), "a") as lock:
+                # One process replays at a time, and no file is claimed
+                # between a starting process creating it and locking it
+                await asyncio.to_thread(fcntl.flock, lock, fcntl.LOCK_EX)
+                try:
+                    await self._replay()
+                    self._spill = open(self.spill_path, "a", encoding="utf-8")
+                    fcntl.flock(self._spill, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+        self._task = asyncio.create_task(self._run())
+        self._accepting = True
+
+    def _own_spill_path(self) -> Path:
+        base = self._spill_base
+        return base.with_name(f"{base.stem}.{os.getpid()}{base.suffix}")
+
+    def _spill_files(self) -> list:
+        """Spill files of every process, plus the shared file older versions used"""
+        base = self._spill_base
+        files = sorted(base.parent.glob(f"{base.stem}.*{base.suffix}"))
+        return [base] + files if base.exists() else files
+
+    async def _replay(self):
+        """Insert documents other processes spilled but may not have flushed.
+        Files still locked belong to running processes and are left alone."""
+        for path in self._spill_files():
+            try:
+                spill = open(path, encoding="utf-8")
+            except FileNotFoundError:
+                continue
+            with spill:
+                try:
+                    fcntl.flock(spill, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                docs = [json_util.loads(line) for line in spill if line.strip()]
+                if docs:
+                    try:
+                        await self._collection.insert_many(docs, ordered=False)
+                    except BulkWriteError as e:
+                        # Already flushed before the restart
+                        errors = e.details.get("writeErrors", [])
+                        if any(err.get("code") != 11000 for err in errors):
+                            raise
+                    self.replayed += len(docs)
+                    logger.info(f"Replayed {len(docs)} spilled {self.name} records from {path.name}")
+                path.unlink(missing_ok=True)
+
+    async def write(self, doc: dict):
+        """Queue one document for the collection given to ``start``; see the
+        module docstring for when it returns"""
+        if self._collection is None:
+            raise RuntimeError(f"{self.name} writer has not been started")
+        if not self._accepting:
+            await self._collection.insert_one(doc)
+            return
+        doc.setdefault("_id", ObjectId())
+        future = None
+        if self.mode == "spill":
+            self._spill.write(json_util.dumps(doc) + "\n")
+            self._spill.flush()
+        else:
+            future = asyncio.get_running_loop().create_future()
+        self._pending.append((doc, future))
+        self._wake.set()
+        if len(self._pending) >= self.max_batch:
+            self._full.set()
+        if future is not None:
+            await future
+
+    async def _run(self):
+        while True:
+            await self._wake.wait()
+            if len(self._pending) < self.max_batch:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._full.clear()
+            while self._pending:
+                batch = [self._pending.popleft() for _ in range(min(self.max_batch, len(self._pending)))]
+                if not await self._flush(batch):
+                    await asyncio.sleep(RETRY_SECONDS)
+            self._wake.clear()
+            if self._spill is not None:
+                # Everything spilled so far is in MongoDB now
+                self._spill.truncate(0)
+
+    async def _flush(self, batch: list) -> bool:
+        started = time.monotonic()
+        failed = {}
+        try:
+            await self._collection.insert_many([doc for doc, _ in batch], ordered=False)
+        except BulkWriteError as e:
+            failed = {
+                err["index"]: err for err in e.details.get("writeErrors", [])
+                # A retried batch may have been partly inserted already
+                if err.get("code") != 11000 or self.mode == "ack"
+            }
+        except Exception as e:
+            if self.mode == "spill":
+                # Keep the batch at the front and retry; it is safe on disk
+                self.retries += 1
+                self._pending.extendleft(reversed(batch))
+                logger.warning(f"{self.name} flush failed, retrying: {e}")
+                return False
+            failed = {index: {"errmsg": str(e)} for index in range(len(batch))}
+
+        elapsed = time.monotonic() - started
+        self.batches += 1
+        self.last_flush = elapsed
+        self.max_flush = max(self.max_flush, elapsed)
+        self._total_flush += elapsed
+        self.written += len(batch) - len(failed)
+        self.failed += len(failed)
+        for index, (doc, future) in enumerate(batch):
+            if index in failed:
+                error = RuntimeError(failed[index].get("errmsg", "Insert failed"))
+                if future is not None and not future.done():
+                    future.set_exception(error)
+                else:
+                    logger.error(f"Dropped {self.name} record {doc.get('id')}: {error}")
+            elif future is not None and not future.done():
+                future.set_result(None)
+        return True
+
+    async def drain(self, timeout: float = 10):
+        """Stop queueing, flush what is waiting, then stop the flusher"""
+        self._accepting = False
+        if self._task is None:
+            return
+        deadline = time.monotonic() + timeout
+        while self._pending and time.monotonic() < deadline:
+            self._wake.set()
+            self._full.set()
+            await asyncio.sleep(self.interval or 0.01)
+        if self._pending:
+            logger.warning(f"{self.name} drain timed out with {len(self._pending)} records left")
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        if self._spill is not None:
+            if not self._pending:
+                # Unlink before closing so no other process can claim it
+                self.spill_path.unlink(missing_ok=True)
+            self._spill.close()
+            self._spill = None
+
+    def metrics(self) -> dict:
+        return {
+            "mode": self.mode,
+            "backlog": len(self._pending),
+            "written": self.written,
+            "failed": self.failed,
+            "retries": self.retries,
+            "replayed": self.replayed,
+            "batches": self.batches,
+            "avgBatchSize": round(self.written / self.batches, 1) if self.batches else 0,
+            "lastFlushMs": round(self.last_flush * 1000, 2),
+            "maxFlushMs": round(self.max_flush * 1000, 2),
+            "avgFlushMs": round(self._total_flush / self.batches * 1000, 2) if self.batches else 0,
+            "spillBytes": self.spill_path.stat().st_size if self._spill is not None and self.spill_path.exists() else 0,
+        }
+
+
+transaction_writer = WriteBehind(
+    "transactions",
+    mode=os.environ.get("TRANSACTION_WRITE_MODE", "ack").lower(),
+    flush_ms=float(os.environ.get("TRANSACTION_FLUSH_MS", 10)),
+    max_batch=int(os.environ.get("TRANSACTION_BATCH_SIZE", 500)),
+    spill_path=os.environ.get("TRANSACTION_SPILL_PATH"),
+)
@@ -0,0 +1,47 @@
+from datetime import datetime
+import zipfile
+
+
+class _ChunkSink:
+    """Write-only, non-seekable file object that collects ZIP output"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ZipStream:
+    """Incrementally build a ZIP archive and hand back bytes per entry.
+
+    The sink is not seekable, so zipfile writes data descriptors after each
+    entry instead of patching local headers; only the central directory is
+    kept in memory.
+    """
+
+    def __init__(self):
+        self._sink = _ChunkSink()
+        self._zip = zipfile.ZipFile(self._sink, mode="w", compression=zipfile.ZIP_STORED)
+
+    def add(self, name: str, data: bytes, modified: datetime = None) -> bytes:
+        """Append an entry and return the archive bytes produced for it"""
+        modified = modified or datetime.now()
+        info = zipfile.ZipInfo(name, date_time=modified.timetuple()[:6])
+        info.compress_type = zipfile.ZIP_STORED
+        self._zip.writestr(info, data)
+        return self._sink.drain()
+
+    def close(self) -> bytes:
+        """Finish the archive and return the central directory bytes"""
+        self._zip.close()
+        return self._sink.drain()
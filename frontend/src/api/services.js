@@ -56,18 +56,56 @@ export const productService = {
     return response.data;
   },
 
+  async batchGetProducts(ids, fields) {
+    const response = await api.post('/products/batch-get', fields ? { ids, fields } : { ids });
+    return response.data;
+  },
+
+  async syncCatalog(since, etag) {
+    const response = await api.get('/products/sync', {
+      params: since ? { since } : {},
+      headers: etag ? { 'If-None-Match': etag } : {},
+    });
+    return {
+      notModified: response.status === 304,
+      etag: response.headers.etag,
+      data: response.data,
+    };
+  },
+
+  async repriceProducts(data) {
+    const response = await api.post('/products/reprice', data);
+    return response.data;
+  },
+
+  async importProducts(file) {
+    const formData = new FormData();
+    formData.append('file', file);
+    const response = await api.post('/products/import', formData, {
+      headers: { 'Content-Type': 'multipart/form-data' },
+    });
+    return response.data;
+  },
+
   async getCategories() {
     const response = await api.get('/products/categories/');
     return response.data;
   },
 
-  async getBrands() {
-    const response = await api.get('/products/brands/');
+  async getBrands(category) {
+    const response = await api.get('/products/brands/', {
+      params: category ? { category } : {},
+    });
     return response.data;
   },
 
-  async getLowStockProducts() {
-    const response = await api.get('/products/low-stock/');
+  async getLowStockProducts(params = {}) {
+    const response = await api.get('/products/low-stock/', { params });
+    return response.data;
+  },
+
+  async lookupProduct(code) {
+    const response = await api.get('/products/lookup', { params: { code } });
     return response.data;
   },
 };
@@ -97,6 +135,13 @@ export const customerService = {
     const response = await api.delete(`/customers/${id}/`);
     return response.data;
   },
+
+  async lookupByPhone(phonePrefix, limit = 10) {
+    const response = await api.get('/customers/lookup', {
+      params: { phone_prefix: phonePrefix, limit },
+    });
+    return response.data;
+  },
 };
 
 export const supplierService = {
@@ -124,4 +169,77 @@ export const supplierService = {
     const response = await api.delete(`/suppliers/${id}/`);
     return response.data;
   },
-};
\ No newline at end of file
+};
+export const searchService = {
+  async search(q, types = ['products', 'customers', 'suppliers'], limit = 10) {
+    const response = await api.get('/search/', {
+      params: { q, types: types.join(','), limit },
+    });
+    return response.data;
+  },
+};
+
+export const warehouseService = {
+  async getWarehouses() {
+    const response = await api.get('/warehouses/');
+    return response.data;
+  },
+
+  async createWarehouse(data) {
+    const response = await api.post('/warehouses/', data);
+    return response.data;
+  },
+
+  async updateWarehouse(id, data) {
+    const response = await api.put(`/warehouses/${id}`, data);
+    return response.data;
+  },
+
+  async getProductStock(productId) {
+    const response = await api.get(`/warehouses/stock/${productId}`);
+    return response.data;
+  },
+
+  async transferStock(data) {
+    const response = await api.post('/warehouses/transfer', data);
+    return response.data;
+  },
+
+  async adjustStock(data) {
+    const response = await api.post('/warehouses/adjust', data);
+    return response.data;
+  },
+
+  async setStockShards(productId, shards) {
+    const response = await api.put(`/warehouses/shards/${productId}`, { shards });
+    return response.data;
+  },
+
+  async getMovements(params = {}) {
+    const response = await api.get('/warehouses/movements', { params });
+    return response.data;
+  },
+
+  async getStockOnHand(productId, at = null, warehouseId = null) {
+    const params = {};
+    if (at) params.at = at;
+    if (warehouseId) params.warehouseId = warehouseId;
+    const response = await api.get(`/warehouses/on-hand/${productId}`, { params });
+    return response.data;
+  },
+};
+
+export const dashboardService = {
+  // EventSource cannot set headers, so the token goes in the query string;
+  // the browser resends Last-Event-ID itself when it reconnects
+  openStream(handlers = {}) {
+    const token = localStorage.getItem('token');
+    const source = new EventSource(
+      `${api.defaults.baseURL}/dashboard/stream?token=${encodeURIComponent(token || '')}`
+    );
+    Object.entries(handlers).forEach(([type, handler]) => {
+      source.addEventListener(type, (event) => handler(JSON.parse(event.data)));
+    });
+    return source;
+  },
+};
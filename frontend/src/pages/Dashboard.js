@@ -2,7 +2,7 @@ import React, { useEffect, useState } from 'react';
 import { useNavigate } from 'react-router-dom';
 import { MainLayout } from '../components/layout/MainLayout';
 import { useAuth } from '../contexts/AuthContext';
-import { productService, customerService, supplierService } from '../api/services';
+import { productService, customerService, supplierService, dashboardService } from '../api/services';
 import axios from '../api/axios';
 import {
   Package,
@@ -86,6 +86,45 @@ export const Dashboard = () => {
     fetchDashboardData();
   }, []);
 
+  // Live deltas instead of re-polling the stats endpoints
+  useEffect(() => {
+    const applyLowStock = (data) => {
+      setStats((prev) => ({ ...prev, lowStockCount: data.lowStockCount }));
+      if (data.lowStockItems) {
+        setLowStockProducts(data.lowStockItems);
+      }
+    };
+    const source = dashboardService.openStream({
+      snapshot: (data) => {
+        setSalesStats((prev) => (prev ? { ...prev, ...data } : prev));
+        applyLowStock(data);
+      },
+      sales: (data) => {
+        setSalesStats((prev) => prev && {
+          ...prev,
+          totalSales: data.totalSales,
+          totalTransactions: data.totalTransactions,
+          averageOrderValue: data.totalTransactions ? data.totalSales / data.totalTransactions : 0,
+          todaySales: data.todaySales,
+          weekSales: data.weekSales,
+          monthSales: data.monthSales,
+          recentSales: data.recentSales,
+        });
+      },
+      topProducts: (data) => {
+        setSalesStats((prev) => prev && { ...prev, topProducts: data.topProducts });
+      },
+      lowStock: (data) => {
+        applyLowStock(data);
+        setLowStockProducts((prev) => {
+          const others = prev.filter((product) => product.id !== data.product.id);
+          return data.isLow ? [data.product, ...others] : others;
+        });
+      },
+    });
+    return () => source.close();
+  }, []);
+
   const fetchDashboardData = async () => {
     try {
       const [products, customers, suppliers, lowStock] = await Promise.all([
@@ -298,7 +337,7 @@ export const Dashboard = () => {
                       <div className="flex-1">
                         <p className="font-medium text-gray-900">{sale.invoiceNumber}</p>
                         <p className="text-sm text-gray-600">
-                          {sale.customerName || 'Walk-in'} • {sale.items?.length || 0} items
+                          {sale.customerName || 'Walk-in'} • {sale.itemCount ?? sale.items?.length ?? 0} items
                         </p>
                       </div>
                       <div className="text-right">
@@ -1,7 +1,8 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { useNavigate } from 'react-router-dom';
 import { Search, Plus, Minus, Trash2, ShoppingCart, X, User, CreditCard, Wallet } from 'lucide-react';
 import axios from '../api/axios';
+import { productService } from '../api/services';
 import { useToast } from '../hooks/use-toast';
 import { Button } from '../components/ui/button';
 import { Input } from '../components/ui/input';
@@ -17,6 +18,8 @@ const POS = () => {
   const { toast } = useToast();
   
   const [products, setProducts] = useState([]);
+  // Local copy of the catalog, kept current with delta syncs
+  const catalog = useRef({ items: new Map(), version: null, etag: null });
   const [customers, setCustomers] = useState([]);
   const [searchTerm, setSearchTerm] = useState('');
   const [cart, setCart] = useState([]);
@@ -38,8 +41,15 @@ const POS = () => {
   
   const fetchProducts = async () => {
     try {
-      const response = await axios.get('/api/products');
-      setProducts(response.data.filter(p => p.isActive && p.stock.quantity > 0));
+      const { items, version, etag } = catalog.current;
+      const result = await productService.syncCatalog(version, etag);
+      if (result.notModified) return;
+      const { full, products: changed, deleted } = result.data;
+      if (full) items.clear();
+      changed.forEach(product => items.set(product.id, product));
+      deleted.forEach(id => items.delete(id));
+      catalog.current = { items, version: result.data.version, etag: result.etag };
+      setProducts([...items.values()].filter(p => p.isActive && p.stock.quantity > 0));
     } catch (error) {
       toast({
         title: 'Error',
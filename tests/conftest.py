@@ -0,0 +1,16 @@
+import sys
+import tempfile
+import os
+from pathlib import Path
+
+# The backend is not a package; its modules import each other as top-level
+# ``utils.*`` / ``models.*``
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+# Module-level singletons write under these; keep them out of the shared tmp dir
+_scratch = tempfile.mkdtemp(prefix="stockpilot-tests-")
+os.environ.setdefault("INVOICE_CACHE_DIR", os.path.join(_scratch, "invoices"))
+os.environ.setdefault("TRANSACTION_SPILL_PATH", os.path.join(_scratch, "transactions.ndjson"))
+# Route modules create their (lazy) Motor clients at import
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "stockpilot_tests")
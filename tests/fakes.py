@@ -0,0 +1,420 @@
+"""In-memory stand-ins for the Motor collections the utils modules use.
+
+Only the query and update operators those modules rely on are supported.
+Good enough to exercise conditional-update logic without a MongoDB server.
+"""
+import copy
+import itertools
+import re
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+_MISSING = object()
+
+
+def _get(doc, path):
+    value = doc
+    for part in path.split("."):
+        if isinstance(value, list) and part.isdigit():
+            index = int(part)
+            value = value[index] if index < len(value) else _MISSING
+        elif isinstance(value, list):
+            # Field of each array element, like "returns.idempotencyKey"
+            value = [item[part] for item in value if isinstance(item, dict) and part in item] or _MISSING
+        elif isinstance(value, dict):
+            value = value.get(part, _MISSING)
+        else:
+            return _MISSING
+        if value is _MISSING:
+            return _MISSING
+    return value
+
+
+def _equals(value, expected):
+    if isinstance(value, list) and not isinstance(expected, list):
+        return expected in value
+    return value == expected
+
+
+def _matches_condition(value, condition):
+    if condition is None:
+        # Like MongoDB, null also matches a missing field
+        return value is _MISSING or value is None
+    if not (isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition)):
+        return value is not _MISSING and _equals(value, condition)
+    for op, operand in condition.items():
+        if op == "$exists":
+            if (value is not _MISSING) != bool(operand):
+                return False
+        elif op == "$ne":
+            if value is not _MISSING and _equals(value, operand):
+                return False
+        elif op == "$eq":
+            if value is _MISSING or not _equals(value, operand):
+                return False
+        elif op == "$in":
+            if value is _MISSING or not any(_equals(value, item) for item in operand):
+                return False
+        elif op == "$regex":
+            if not isinstance(value, str) or not re.search(operand, value):
+                return False
+        elif op in ("$gt", "$gte", "$lt", "$lte"):
+            if value is _MISSING or value is None:
+                return False
+            if op == "$gt" and not value > operand:
+                return False
+            if op == "$gte" and not value >= operand:
+                return False
+            if op == "$lt" and not value < operand:
+                return False
+            if op == "$lte" and not value <= operand:
+                return False
+        else:
+            raise NotImplementedError(op)
+    return True
+
+
+def matches(doc, query) -> bool:
+    for key, condition in query.items():
+        if key == "$and":
+            if not all(matches(doc, sub) for sub in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(doc, sub) for sub in condition):
+                return False
+        elif not _matches_condition(_get(doc, key), condition):
+            return False
+    return True
+
+
+def _set(doc, path, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def _unset(doc, path):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.get(part, {})
+    doc.pop(parts[-1], None)
+
+
+def evaluate(doc, expr):
+    """Aggregation expression over doc; the operators the pipelines use"""
+    if isinstance(expr, str) and expr.startswith("$"):
+        value = _get(doc, expr[1:])
+        return None if value is _MISSING else value
+    if isinstance(expr, dict) and len(expr) == 1 and next(iter(expr)).startswith("$"):
+        op, args = next(iter(expr.items()))
+        if op == "$literal":
+            return args
+        values = [evaluate(doc, arg) for arg in args] if isinstance(args, list) else [evaluate(doc, args)]
+        if op == "$add":
+            return sum(values)
+        if op == "$subtract":
+            return values[0] - values[1]
+        if op == "$ifNull":
+            return values[0] if values[0] is not None else values[1]
+        if op == "$lte":
+            return values[0] <= values[1]
+        if op == "$max":
+            return max(values)
+        if op == "$min":
+            return min(values)
+        raise NotImplementedError(op)
+    if isinstance(expr, dict):
+        return {key: evaluate(doc, value) for key, value in expr.items()}
+    return expr
+
+
+def apply_update(doc, update, inserting=False):
+    if isinstance(update, list):
+        # Update pipeline: $set stages evaluated against the document so far
+        for stage in update:
+            for path, expr in stage["$set"].items():
+                _set(doc, path, evaluate(doc, expr))
+        return
+    for op, fields in update.items():
+        for path, value in fields.items():
+            current = _get(doc, path)
+            if op == "$set":
+                _set(doc, path, copy.deepcopy(value))
+            elif op == "$setOnInsert":
+                if inserting:
+                    _set(doc, path, copy.deepcopy(value))
+            elif op == "$push":
+                _set(doc, path, ([] if current is _MISSING else current) + [copy.deepcopy(value)])
+            elif op == "$unset":
+                _unset(doc, path)
+            elif op == "$inc":
+                _set(doc, path, (0 if current is _MISSING else current) + value)
+            elif op == "$max":
+                if current is _MISSING or value > current:
+                    _set(doc, path, value)
+            elif op == "$addToSet":
+                items = [] if current is _MISSING else current
+                if value not in items:
+                    items = items + [value]
+                _set(doc, path, items)
+            elif op == "$pull":
+                if current is not _MISSING:
+                    _set(doc, path, [item for item in current if item != value])
+            else:
+                raise NotImplementedError(op)
+
+
+def _project(doc, projection):
+    if not projection:
+        return copy.deepcopy(doc)
+    include = {key for key, flag in projection.items() if flag and key != "_id"}
+    if include:
+        result = {}
+        for key in include:
+            value = _get(doc, key)
+            if value is not _MISSING:
+                _set(result, key, copy.deepcopy(value))
+        if projection.get("_id", 1) and "_id" in doc:
+            result["_id"] = doc["_id"]
+        return result
+    return {key: copy.deepcopy(value) for key, value in doc.items() if projection.get(key, 1)}
+
+
+class Result:
+    def __init__(self, matched_count=0, modified_count=0, upserted_id=None, deleted_count=0,
+                 inserted_id=None):
+        self.matched_count = matched_count
+        self.modified_count = modified_count
+        self.upserted_id = upserted_id
+        self.deleted_count = deleted_count
+        self.inserted_id = inserted_id
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self._docs = docs
+
+    def sort(self, key, direction=1):
+        keys = key if isinstance(key, list) else [(key, direction)]
+        for field, order in reversed(keys):
+            self._docs.sort(key=lambda doc: _get(doc, field), reverse=order < 0)
+        return self
+
+    def skip(self, count):
+        self._docs = self._docs[count:]
+        return self
+
+    def limit(self, count):
+        if count:
+            self._docs = self._docs[:count]
+        return self
+
+    async def to_list(self, length=None):
+        return self._docs if length is None else self._docs[:length]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self._docs:
+            yield doc
+
+
+class FakeCollection:
+    def __init__(self, name, unique=(), db=None):
+        self.name = name
+        self.db = db
+        self.docs = []
+        # Tuples of field names that must be unique together
+        self.unique = [tuple(fields) for fields in unique]
+
+    def _check_unique(self, candidate, ignore=None):
+        if any(doc["_id"] == candidate["_id"] for doc in self.docs if doc is not ignore):
+            raise DuplicateKeyError("duplicate _id", 11000)
+        for fields in self.unique:
+            key = tuple(_get(candidate, field) for field in fields)
+            if all(value is _MISSING for value in key):
+                # Sparse: documents without the fields are not indexed
+                continue
+            for doc in self.docs:
+                if doc is not ignore and tuple(_get(doc, field) for field in fields) == key:
+                    raise DuplicateKeyError(f"duplicate {fields}", 11000)
+
+    def _find(self, query):
+        return [doc for doc in self.docs if matches(doc, query or {})]
+
+    async def insert_one(self, doc):
+        doc.setdefault("_id", ObjectId())
+        self._check_unique(doc)
+        self.docs.append(copy.deepcopy(doc))
+        return Result(inserted_id=doc["_id"])
+
+    async def insert_many(self, docs, ordered=True):
+        errors = []
+        for index, doc in enumerate(docs):
+            try:
+                await self.insert_one(doc)
+            except DuplicateKeyError as e:
+                errors.append({"index": index, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+
+    def find(self, query=None, projection=None):
+        return FakeCursor([_project(doc, projection) for doc in self._find(query)])
+
+    async def find_one(self, query=None, projection=None, sort=None):
+        docs = self._find(query)
+        if sort:
+            docs = await FakeCursor(docs).sort(sort).to_list()
+        return _project(docs[0], projection) if docs else None
+
+    async def update_one(self, query, update, upsert=False):
+        docs = self._find(query)
+        if docs:
+            updated = copy.deepcopy(docs[0])
+            apply_update(updated, update)
+            self._check_unique(updated, ignore=docs[0])
+            changed = updated != docs[0]
+            docs[0].clear()
+            docs[0].update(updated)
+            return Result(matched_count=1, modified_count=int(changed))
+        if not upsert:
+            return Result()
+        doc = {
+            key: value for key, value in query.items()
+            if not key.startswith("$") and not (isinstance(value, dict) and any(k.startswith("$") for k in value))
+        }
+        doc.setdefault("_id", ObjectId())
+        apply_update(doc, update, inserting=True)
+        self._check_unique(doc)
+        self.docs.append(doc)
+        return Result(upserted_id=doc["_id"])
+
+    async def bulk_write(self, requests, ordered=True):
+        matched = modified = 0
+        for request in requests:
+            # pymongo.UpdateOne keeps its arguments in these attributes
+            result = await self.update_one(request._filter, request._doc, upsert=bool(request._upsert))
+            matched += result.matched_count
+            modified += result.modified_count
+        return Result(matched_count=matched, modified_count=modified)
+
+    def aggregate(self, pipeline):
+        docs = [copy.deepcopy(doc) for doc in self.docs]
+        for stage in pipeline:
+            (op, spec), = stage.items()
+            if op == "$match":
+                docs = [doc for doc in docs if matches(doc, spec)]
+            elif op == "$project":
+                docs = [_project(doc, spec) for doc in docs]
+            elif op == "$unionWith":
+                docs += self.db[spec["coll"]].aggregate(spec.get("pipeline", []))._docs
+            elif op == "$group":
+                groups = {}
+                for doc in docs:
+                    key = evaluate(doc, spec["_id"])
+                    group = groups.setdefault(repr(key), {"_id": key})
+                    for field, (accumulator, expr) in ((f, next(iter(a.items()))) for f, a in spec.items() if f != "_id"):
+                        value = evaluate(doc, expr)
+                        if accumulator == "$sum":
+                            group[field] = group.get(field, 0) + (value or 0)
+                        elif accumulator == "$first":
+                            group.setdefault(field, value)
+                        else:
+                            raise NotImplementedError(accumulator)
+                docs = list(groups.values())
+            else:
+                raise NotImplementedError(op)
+        return FakeCursor(docs)
+
+    async def update_many(self, query, update):
+        docs = self._find(query)
+        for doc in docs:
+            apply_update(doc, update)
+        return Result(matched_count=len(docs), modified_count=len(docs))
+
+    async def find_one_and_update(self, query, update, projection=None, upsert=False,
+                                  return_document=ReturnDocument.BEFORE):
+        docs = self._find(query)
+        before = copy.deepcopy(docs[0]) if docs else None
+        result = await self.update_one(query, update, upsert=upsert)
+        if return_document == ReturnDocument.BEFORE:
+            return _project(before, projection) if before else None
+        target = docs[0] if docs else next(
+            (doc for doc in self.docs if doc["_id"] == result.upserted_id), None
+        )
+        return _project(target, projection) if target else None
+
+    async def find_one_and_delete(self, query, projection=None):
+        docs = self._find(query)
+        if not docs:
+            return None
+        self.docs.remove(docs[0])
+        return _project(docs[0], projection)
+
+    async def delete_one(self, query):
+        docs = self._find(query)
+        if docs:
+            self.docs.remove(docs[0])
+        return Result(deleted_count=len(docs[:1]))
+
+    async def delete_many(self, query):
+        docs = self._find(query)
+        for doc in docs:
+            self.docs.remove(doc)
+        return Result(deleted_count=len(docs))
+
+    async def distinct(self, field, query=None):
+        values = []
+        for doc in self._find(query):
+            value = _get(doc, field)
+            if value is not _MISSING and value not in values:
+                values.append(value)
+        return values
+
+
+class FakeDB:
+    """Attribute access creates collections on first use, like Motor"""
+
+    UNIQUE = {
+        "warehouse_stock": [("productId", "warehouseId")],
+        "stock_shards": [("productId", "warehouseId", "shard")],
+        "products": [("id",)],
+        "sales": [("invoiceNumber",), ("idempotencyKey",)],
+    }
+
+    def __init__(self):
+        self._collections = {}
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if name not in self._collections:
+            self._collections[name] = FakeCollection(name, self.UNIQUE.get(name, ()), self)
+        return self._collections[name]
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+
+_counter = itertools.count()
+
+
+def fail_once(collection, method, when=lambda *args, **kwargs: True):
+    """Make the next matching call to ``collection.method`` raise, as if the
+    process died right there"""
+    original = getattr(collection, method)
+    state = {"armed": True}
+
+    async def wrapper(*args, **kwargs):
+        if state["armed"] and when(*args, **kwargs):
+            state["armed"] = False
+            raise RuntimeError(f"simulated crash #{next(_counter)} in {collection.name}.{method}")
+        return await original(*args, **kwargs)
+
+    setattr(collection, method, wrapper)
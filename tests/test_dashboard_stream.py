@@ -0,0 +1,141 @@
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from tests.fakes import FakeDB
+from utils.dashboard_stream import DashboardHub
+from utils.events import SaleCreated, StockChanged
+
+
+def frames(listener):
+    sent = []
+    while not listener.queue.empty():
+        frame = listener.queue.get_nowait()
+        event_type = frame.split(b"\n")[1].removeprefix(b"event: ").decode()
+        data = json.loads(frame.split(b"\n")[2].removeprefix(b"data: "))
+        sent.append((event_type, data))
+    return sent
+
+
+def sale(sale_id, total, items=(), sale_date=None):
+    return {
+        "id": sale_id, "total": total, "saleDate": sale_date or datetime.now(),
+        "items": [
+            {"productId": product_id, "productName": product_id, "quantity": 1, "lineTotal": line_total}
+            for product_id, line_total in items
+        ],
+    }
+
+
+@pytest.fixture
+def hub():
+    hub = DashboardHub(buffer_size=100, replay_size=3)
+    hub._db = FakeDB()
+    hub.day = datetime.now().date()
+    hub.loaded = True
+    return hub
+
+
+def test_resume_replays_frames_after_the_last_id(hub):
+    for n in range(2):
+        hub._publish("sales", {"n": n})
+    frames_after = hub._resume(f"{hub.epoch}-1")
+    assert len(frames_after) == 1 and b'"n":1' in frames_after[0]
+    assert hub._resume(f"{hub.epoch}-2") == []
+
+
+def test_resume_needs_a_snapshot_for_foreign_or_stale_ids(hub):
+    for n in range(5):
+        hub._publish("sales", {"n": n})
+    # Ring holds 3..5; resuming from 2 is still complete, from 1 is not
+    assert len(hub._resume(f"{hub.epoch}-2")) == 3
+    assert hub._resume(f"{hub.epoch}-1") is None
+    assert hub._resume(f"{hub.epoch}-9") is None
+    assert hub._resume("0-3") is None
+    assert hub._resume("garbage") is None
+    assert hub._resume(None) is None
+
+
+def test_connect_sends_a_snapshot_without_a_usable_id(hub):
+    _, first = hub.connect("stale-1")
+    assert b"event: snapshot" in first[1]
+    _, first = hub.connect(f"{hub.epoch}-0")
+    assert first[1:] == []
+
+
+def test_top_products_sent_when_a_listed_products_values_change(hub):
+    listener, _ = hub.connect()
+
+    async def scenario():
+        await hub.apply([SaleCreated(sale("s1", 30, [("a", 20), ("b", 10)]))])
+        first = frames(listener)
+        # Same order, but a's revenue moved
+        await hub.apply([SaleCreated(sale("s2", 5, [("a", 5)]))])
+        return first, frames(listener)
+
+    first, second = asyncio.run(scenario())
+    assert [event for event, _ in first] == ["sales", "topProducts"]
+    top = dict(second)["topProducts"]["topProducts"]
+    assert [(row["productId"], row["totalRevenue"]) for row in top] == [("a", 25), ("b", 10)]
+
+
+def test_top_products_not_resent_when_unchanged(hub):
+    listener, _ = hub.connect()
+
+    async def scenario():
+        await hub.apply([SaleCreated(sale("s1", 30, [("a", 20)]))])
+        frames(listener)
+        await hub.apply([SaleCreated(sale("s2", 0))])
+        return frames(listener)
+
+    assert [event for event, _ in asyncio.run(scenario())] == ["sales"]
+
+
+def test_sales_windows_follow_sale_date(hub):
+    listener, _ = hub.connect()
+    now = datetime.now()
+
+    async def scenario():
+        await hub.apply([
+            SaleCreated(sale("today", 10)),
+            SaleCreated(sale("last-week", 20, sale_date=now - timedelta(days=3)), offline=True),
+            SaleCreated(sale("last-month", 40, sale_date=now - timedelta(days=20)), offline=True),
+            SaleCreated(sale("ancient", 80, sale_date=now - timedelta(days=90)), offline=True),
+            SaleCreated(sale("aware", 1, sale_date=datetime.now(timezone.utc)), offline=True),
+        ])
+        return frames(listener)
+
+    data = dict(asyncio.run(scenario()))["sales"]
+    assert data["amount"] == 151
+    assert data["totalSales"] == 151
+    assert data["todaySales"] == 11
+    assert data["weekSales"] == 31
+    assert data["monthSales"] == 71
+    assert hub.snapshot()["monthSales"] == 71
+
+
+def test_month_window_drops_expired_buckets(hub):
+    now = datetime.now()
+    hub._minutes = {
+        (now - timedelta(days=31)).replace(second=0, microsecond=0): 5,
+        (now - timedelta(days=8)).replace(second=0, microsecond=0): 7,
+    }
+    assert hub._windows(now) == {"weekSales": 0, "monthSales": 7}
+    assert len(hub._minutes) == 1
+
+
+def test_low_stock_crossings_are_broadcast(hub):
+    listener, _ = hub.connect()
+
+    async def scenario():
+        await hub._db.products.insert_one({"id": "p1", "name": "Soap", "sku": "S1"})
+        await hub.apply([StockChanged("p1", {"quantity": 1, "isLow": True})])
+        await hub.apply([StockChanged("p1", {"quantity": 2, "isLow": True})])
+        await hub.apply([StockChanged("p1", {"quantity": 9, "isLow": False})])
+        return frames(listener)
+
+    sent = asyncio.run(scenario())
+    assert [(data["isLow"], data["lowStockCount"]) for _, data in sent] == [(True, 1), (False, 0)]
+    assert sent[0][1]["product"]["name"] == "Soap"
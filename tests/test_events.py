@@ -0,0 +1,156 @@
+import asyncio
+
+import pytest
+from bson import ObjectId
+
+from tests.fakes import FakeDB
+from utils import events
+from utils.events import Event, EventBus, SaleCreated, StockChanged
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(events, "RETRY_SECONDS", 0)
+    monkeypatch.setattr(events, "DELIVERY_ATTEMPTS", 3)
+
+
+def outbox_doc(event):
+    return {
+        "_id": ObjectId(), "type": type(event).__name__, "key": event.key,
+        "payload": events.asdict(event),
+    }
+
+
+def test_event_key_is_required():
+    with pytest.raises(TypeError):
+        Event()
+
+
+def test_new_durable_subscriber_starts_from_now():
+    async def scenario():
+        db = FakeDB()
+        await db.event_outbox.insert_one(outbox_doc(StockChanged("p1", {"quantity": 1})))
+        seen = []
+        bus = EventBus(outbox_mode="ack")
+
+        async def handler(event):
+            seen.append(event)
+
+        bus.subscribe("projection", (StockChanged,), handler, durable=True)
+        await bus.start(db)
+        await bus.stop()
+        return db, seen
+
+    db, seen = asyncio.run(scenario())
+    assert seen == []
+    assert db.event_checkpoints.docs[0]["_id"] == "projection"
+
+
+def test_durable_subscriber_checkpoints_and_replays_what_it_missed():
+    async def scenario():
+        db = FakeDB()
+        seen = []
+
+        async def handler(events):
+            seen.extend(events)
+
+        bus = EventBus(outbox_mode="ack")
+        bus.subscribe("projection", (StockChanged,), handler, durable=True, batch_size=10, batch_ms=1)
+        await bus.start(db)
+        await bus.publish(StockChanged("p1", {"quantity": 1}), SaleCreated({"id": "s1"}))
+        await bus.stop()
+        assert [event.product_id for event in seen] == ["p1"]
+        # Both events are in the outbox; the checkpoint is at the one delivered
+        assert len(db.event_outbox.docs) == 2
+        stock_doc = next(doc for doc in db.event_outbox.docs if doc["type"] == "StockChanged")
+        assert db.event_checkpoints.docs[0]["position"] == stock_doc["_id"]
+
+        # Published by another process while this subscriber was down
+        for product_id in ("p2", "p3"):
+            await db.event_outbox.insert_one(outbox_doc(StockChanged(product_id, {"quantity": 2})))
+        seen.clear()
+        bus = EventBus(outbox_mode="ack")
+        bus.subscribe("projection", (StockChanged,), handler, durable=True, batch_size=10, batch_ms=1)
+        await bus.start(db)
+        await bus.stop()
+        return seen
+
+    seen = asyncio.run(scenario())
+    assert [(event.product_id, event.stock) for event in seen] == [("p2", {"quantity": 2}), ("p3", {"quantity": 2})]
+
+
+def test_failed_durable_batch_is_retried_before_checkpointing():
+    async def scenario():
+        db = FakeDB()
+        calls = []
+
+        async def flaky(event):
+            calls.append(event.product_id)
+            if len(calls) == 1:
+                raise RuntimeError("projection store unavailable")
+
+        bus = EventBus(outbox_mode="ack")
+        subscription = bus.subscribe("projection", (StockChanged,), flaky, durable=True)
+        await bus.start(db)
+        await bus.publish(StockChanged("p1", {"quantity": 1}))
+        await bus.stop()
+        return db, calls, subscription
+
+    db, calls, subscription = asyncio.run(scenario())
+    assert calls == ["p1", "p1"]
+    assert subscription.retries == 1 and subscription.delivered == 1
+    assert db.event_checkpoints.docs[0]["position"] == db.event_outbox.docs[0]["_id"]
+
+
+def test_durable_subscriber_halts_without_passing_a_failed_event():
+    async def scenario():
+        db = FakeDB()
+        broken = True
+        seen = []
+
+        async def handler(event):
+            if broken and event.product_id == "p1":
+                raise RuntimeError("bad projection")
+            seen.append(event.product_id)
+
+        bus = EventBus(outbox_mode="ack")
+        subscription = bus.subscribe("projection", (StockChanged,), handler, durable=True)
+        await bus.start(db)
+        start = db.event_checkpoints.docs[0]["position"]
+        await bus.publish(StockChanged("p1", {"quantity": 1}))
+        await bus.publish(StockChanged("p2", {"quantity": 1}))
+        await bus.stop()
+        assert subscription.halted
+        assert seen == []
+        assert db.event_checkpoints.docs[0]["position"] == start
+
+        # Fixed and restarted: both events come back from the outbox
+        broken = False
+        bus = EventBus(outbox_mode="ack")
+        bus.subscribe("projection", (StockChanged,), handler, durable=True)
+        await bus.start(db)
+        await bus.stop()
+        return seen
+
+    assert asyncio.run(scenario()) == ["p1", "p2"]
+
+
+def test_plain_subscriber_failures_do_not_stop_delivery():
+    async def scenario():
+        seen = []
+
+        async def handler(event):
+            if event.product_id == "p1":
+                raise RuntimeError("boom")
+            seen.append(event.product_id)
+
+        bus = EventBus(outbox_mode="off")
+        subscription = bus.subscribe("cache", (StockChanged,), handler)
+        await bus.start()
+        await bus.publish(StockChanged("p1", {}), StockChanged("p2", {}))
+        await bus.stop()
+        return seen, subscription
+
+    seen, subscription = asyncio.run(scenario())
+    assert seen == ["p2"]
+    assert subscription.failed == 1 and not subscription.halted
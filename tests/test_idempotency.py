@@ -0,0 +1,255 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from utils.idempotency import IdempotencyStore, IdempotencyError, KeyInUse, KeyMismatch, fingerprint
+from utils.write_behind import WriteBehind
+from tests.fakes import FakeDB, fail_once
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class Handler:
+    def __init__(self, result=None, error=None):
+        self.calls = 0
+        self.result = result if result is not None else {"id": "sale-1"}
+        self.error = error
+
+    async def __call__(self):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return self.result
+
+
+def test_second_call_returns_stored_response_without_running_handler():
+    db, store, handler = FakeDB(), IdempotencyStore(), Handler()
+    first = run(store.run_once(db, "sale:u1", "k1", {"total": 10}, handler))
+    # A fresh store (another worker) still replays from the collection
+    second = run(IdempotencyStore().run_once(db, "sale:u1", "k1", {"total": 10}, handler))
+    assert first == second == {"id": "sale-1"}
+    assert handler.calls == 1
+
+
+def test_key_reused_for_a_different_request_is_rejected():
+    db, store = FakeDB(), IdempotencyStore()
+    run(store.run_once(db, "sale:u1", "k1", {"total": 10}, Handler()))
+    with pytest.raises(KeyMismatch):
+        run(store.run_once(db, "sale:u1", "k1", {"total": 11}, Handler()))
+
+
+def test_keys_are_scoped():
+    db, store, handler = FakeDB(), IdempotencyStore(), Handler()
+    run(store.run_once(db, "sale:u1", "k1", {}, handler))
+    run(store.run_once(db, "sale:u2", "k1", {}, handler))
+    assert handler.calls == 2
+
+
+def test_failed_handler_releases_the_key():
+    db, store = FakeDB(), IdempotencyStore()
+    with pytest.raises(ValueError):
+        run(store.run_once(db, "sale:u1", "k1", {}, Handler(error=ValueError("boom"))))
+    assert db.idempotency_keys.docs == []
+    assert run(store.run_once(db, "sale:u1", "k1", {}, Handler())) == {"id": "sale-1"}
+
+
+def test_invalid_keys_are_rejected():
+    with pytest.raises(IdempotencyError):
+        run(IdempotencyStore().run_once(FakeDB(), "sale:u1", "", {}, Handler()))
+    with pytest.raises(IdempotencyError):
+        run(IdempotencyStore().run_once(FakeDB(), "sale:u1", "k" * 256, {}, Handler()))
+
+
+def abandon(db, store, key="k1", payload=None, expired=True):
+    """Leave a pending claim behind, as a worker killed mid-request would"""
+    now = datetime.now(timezone.utc)
+    db.idempotency_keys.docs.append({
+        "_id": f"sale:u1:{key}", "status": "pending", "createdAt": now,
+        "requestHash": fingerprint(payload or {}),
+        "lockedUntil": now + (-timedelta(seconds=1) if expired else store.lease),
+    })
+
+
+def test_live_pending_claim_is_in_use():
+    db, store = FakeDB(), IdempotencyStore()
+    abandon(db, store, expired=False)
+    with pytest.raises(KeyInUse):
+        run(store.run_once(db, "sale:u1", "k1", {}, Handler()))
+
+
+def test_expired_claim_is_resolved_from_what_the_first_attempt_wrote():
+    db, store, handler = FakeDB(), IdempotencyStore(), Handler()
+    abandon(db, store)
+
+    async def recover():
+        return {"id": "sale-from-first-attempt"}
+
+    response = run(store.run_once(db, "sale:u1", "k1", {}, handler, recover))
+    assert response == {"id": "sale-from-first-attempt"}
+    assert handler.calls == 0
+    assert db.idempotency_keys.docs[0]["status"] == "done"
+    assert store.stats()["recovered"] == 1
+
+
+def test_expired_claim_with_nothing_written_runs_the_handler():
+    db, store, handler = FakeDB(), IdempotencyStore(), Handler()
+    abandon(db, store)
+
+    async def recover():
+        return None
+
+    assert run(store.run_once(db, "sale:u1", "k1", {}, handler, recover)) == {"id": "sale-1"}
+    assert handler.calls == 1
+    assert store.stats()["takeovers"] == 1
+
+
+def test_expired_claim_for_a_different_request_is_still_a_mismatch():
+    db, store = FakeDB(), IdempotencyStore()
+    abandon(db, store, payload={"total": 1})
+    with pytest.raises(KeyMismatch):
+        run(store.run_once(db, "sale:u1", "k1", {"total": 2}, Handler()))
+
+
+def test_only_one_retry_takes_over_an_expired_claim():
+    db, store = FakeDB(), IdempotencyStore()
+    abandon(db, store)
+    gate = asyncio.Event()
+
+    async def slow():
+        await gate.wait()
+        return {"id": "sale-1"}
+
+    async def scenario():
+        first = asyncio.create_task(store.run_once(db, "sale:u1", "k1", {}, slow))
+        await asyncio.sleep(0)
+        with pytest.raises(KeyInUse):
+            await IdempotencyStore().run_once(db, "sale:u1", "k1", {}, Handler())
+        gate.set()
+        return await first
+
+    assert run(scenario()) == {"id": "sale-1"}
+
+
+def test_failed_handler_that_wrote_something_keeps_its_result():
+    db, store = FakeDB(), IdempotencyStore()
+    written = []
+
+    async def call():
+        written.append("sale-1")
+        raise RuntimeError("transaction write failed after the sale insert")
+
+    async def recover():
+        return {"id": written[0]} if written else None
+
+    with pytest.raises(RuntimeError):
+        run(store.run_once(db, "sale:u1", "k1", {}, call, recover))
+    assert db.idempotency_keys.docs[0]["status"] == "done"
+    handler = Handler()
+    assert run(IdempotencyStore().run_once(db, "sale:u1", "k1", {}, handler, recover)) == {"id": "sale-1"}
+    assert handler.calls == 0
+
+
+def test_failed_handler_keeps_the_claim_when_recovery_cannot_tell():
+    db, store = FakeDB(), IdempotencyStore()
+
+    async def recover():
+        raise RuntimeError("database unreachable")
+
+    with pytest.raises(ValueError):
+        run(store.run_once(db, "sale:u1", "k1", {}, Handler(error=ValueError("boom")), recover))
+    assert db.idempotency_keys.docs[0]["status"] == "pending"
+    with pytest.raises(KeyInUse):
+        run(store.run_once(db, "sale:u1", "k1", {}, Handler()))
+
+
+def test_lease_is_renewed_while_the_handler_runs():
+    db = FakeDB()
+    store = IdempotencyStore(lease=timedelta(milliseconds=60))
+
+    async def slow():
+        await asyncio.sleep(0.2)
+        return {"id": "sale-1"}
+
+    async def scenario():
+        first = asyncio.create_task(store.run_once(db, "sale:u1", "k1", {}, slow))
+        await asyncio.sleep(0.15)
+        # Well past the original lease, but the first attempt is still live
+        with pytest.raises(KeyInUse):
+            await IdempotencyStore().run_once(db, "sale:u1", "k1", {}, Handler())
+        return await first
+
+    assert run(scenario()) == {"id": "sale-1"}
+    assert store.stats()["takeovers"] == 0
+
+
+@pytest.fixture
+def sales_db(monkeypatch):
+    from routes import sales
+    from utils.inventory import invalidate_warehouses
+    from utils.stock_shards import shard_registry
+
+    db = FakeDB()
+    monkeypatch.setattr(sales, "db", db)
+    # Its queue events belong to the loop it was first started in
+    monkeypatch.setattr(sales, "transaction_writer", WriteBehind("transactions", mode="ack"))
+    invalidate_warehouses()
+    shard_registry.invalidate()
+    db.products.docs.append({"_id": "p1", "id": "p1", "stock": {"quantity": 0, "reorderPoint": 0}})
+    db.sales.docs.append({
+        "_id": "s1", "id": "s1", "invoiceNumber": "INV-1", "paymentStatus": "paid",
+        "items": [{"productId": "p1", "quantity": 2, "allocations": [{"warehouseId": "w1", "quantity": 2}]}],
+    })
+    return sales, db
+
+
+def return_request(sales):
+    return sales.SaleReturn(items=[{"productId": "p1", "quantity": 2}], refundAmount=20, refundMode="cash")
+
+
+def restocked(db):
+    return sum(doc["quantity"] for doc in db.warehouse_stock.docs)
+
+
+def test_return_retried_after_a_crash_mid_restock_does_not_restock_again(sales_db):
+    sales, db = sales_db
+    user = {"id": "u1"}
+
+    async def attempt():
+        await sales.transaction_writer.start(db.transactions)
+        try:
+            return await sales.process_return("s1", return_request(sales), user, "k1")
+        finally:
+            await sales.transaction_writer.drain()
+
+    fail_once(db.products, "find_one_and_update")
+    with pytest.raises(RuntimeError):
+        run(attempt())
+    # The rows were restocked before the crash; the return is logged on the sale
+    assert restocked(db) == 2
+    response = run(attempt())
+    assert response["refundAmount"] == 20
+    assert response["transactionId"] == db.sales.docs[0]["returns"][0]["transactionId"]
+    assert restocked(db) == 2
+
+
+def test_return_recovers_from_the_sale_log_after_losing_the_claim(sales_db):
+    sales, db = sales_db
+
+    async def scenario():
+        await sales.transaction_writer.start(db.transactions)
+        try:
+            first = await sales.record_return("s1", return_request(sales), {"id": "u1"}, "return:u1:k1")
+            # A takeover whose recovery raced the first attempt's stamp
+            second = await sales.record_return("s1", return_request(sales), {"id": "u1"}, "return:u1:k1")
+            return first, second
+        finally:
+            await sales.transaction_writer.drain()
+
+    first, second = run(scenario())
+    assert first == second
+    assert restocked(db) == 2
+    assert db.sales.docs[0]["paymentStatus"] == "refunded"
+    assert [doc["referenceType"] for doc in db.transactions.docs] == ["refund"]
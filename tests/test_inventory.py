@@ -0,0 +1,168 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from utils import inventory, stock_journal
+from utils.inventory import InsufficientStockError
+from utils.stock_ledger import reason
+from utils.stock_shards import shard_registry
+from tests.fakes import FakeDB, fail_once
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def db():
+    db = FakeDB()
+    inventory.invalidate_warehouses()
+    shard_registry.invalidate()
+    db.warehouses.docs.append({"_id": "w1", "id": "w1", "code": "MAIN", "isDefault": True, "isActive": True})
+    db.warehouses.docs.append({"_id": "w2", "id": "w2", "code": "BACK", "priority": 1, "isActive": True})
+    for product_id in ("p1", "p2"):
+        db.products.docs.append({"_id": product_id, "id": product_id, "stock": {"quantity": 5, "reorderPoint": 0}})
+        db.warehouse_stock.docs.append({"_id": product_id, "productId": product_id, "warehouseId": "w1", "quantity": 5})
+    yield db
+    inventory.invalidate_warehouses()
+    shard_registry.invalidate()
+
+
+def rows(db, product_id="p1"):
+    return {doc["warehouseId"]: doc["quantity"] for doc in db.warehouse_stock.docs if doc["productId"] == product_id}
+
+
+def total(db, product_id="p1"):
+    return next(doc["stock"]["quantity"] for doc in db.products.docs if doc["id"] == product_id)
+
+
+def movements(db):
+    return [(doc["productId"], doc["warehouseId"], doc["delta"], doc["type"]) for doc in db.stock_movements.docs]
+
+
+def test_order_that_cannot_be_filled_puts_back_the_lines_already_taken(db):
+    items = [{"productId": "p1", "quantity": 2}, {"productId": "p2", "quantity": 6}]
+    with pytest.raises(InsufficientStockError) as raised:
+        run(inventory.allocate_order(db, items, reason("sale", "s1")))
+    assert raised.value.product_id == "p2"
+    assert rows(db) == {"w1": 5} and total(db) == 5
+    assert movements(db) == [("p1", "w1", -2, "sale"), ("p1", "w1", 2, "cancel")]
+
+
+def test_order_that_crashes_mid_way_puts_back_the_lines_already_taken(db):
+    items = [{"productId": "p1", "quantity": 2}, {"productId": "p2", "quantity": 1}]
+    fail_once(db.warehouse_stock, "update_one", lambda query, *args, **kwargs: query["productId"] == "p2")
+    with pytest.raises(RuntimeError):
+        run(inventory.allocate_order(db, items))
+    assert rows(db) == {"w1": 5} and rows(db, "p2") == {"w1": 5}
+    assert total(db) == 5
+
+
+def test_allocation_spills_into_the_next_warehouse(db):
+    db.warehouse_stock.docs.append({"_id": "p1-w2", "productId": "p1", "warehouseId": "w2", "quantity": 3})
+    assert run(inventory.allocate(db, "p1", 7)) == [
+        {"warehouseId": "w1", "quantity": 5}, {"warehouseId": "w2", "quantity": 2}
+    ]
+    assert rows(db) == {"w1": 0, "w2": 1}
+
+
+def test_batch_allocates_each_order_that_fits(db):
+    orders = [
+        [{"productId": "p1", "quantity": 2}, {"productId": "p2", "quantity": 1}],
+        [{"productId": "p1", "quantity": 4}],
+        [{"productId": "p1", "quantity": 3}],
+    ]
+    whys = [reason("sale", f"s{index}") for index in range(3)]
+    results = run(inventory.allocate_batch(db, orders, whys))
+    # The second order would take p1 past what is left after the first
+    assert results[0] is None and results[2] is None
+    assert isinstance(results[1], InsufficientStockError)
+    assert orders[0][0]["allocations"] == [{"warehouseId": "w1", "quantity": 2}]
+    assert "allocations" not in orders[1][0]
+    assert rows(db) == {"w1": 0} and rows(db, "p2") == {"w1": 4}
+    assert total(db) == 0 and total(db, "p2") == 4
+    assert sorted(doc["referenceId"] for doc in db.stock_movements.docs) == ["s0", "s0", "s2"]
+    assert not any(doc.get("batchIds") for doc in db.warehouse_stock.docs)
+
+
+def test_transfer_moves_stock_and_records_the_note(db):
+    why = reason("transfer", user_id="u1", note="restock the back room")
+    run(inventory.transfer(db, "p1", "w1", "w2", 3, why))
+    assert rows(db) == {"w1": 2, "w2": 3}
+    assert total(db) == 5
+    assert movements(db) == [("p1", "w1", -3, "transfer"), ("p1", "w2", 3, "transfer")]
+    assert {doc["note"] for doc in db.stock_movements.docs} == {"restock the back room"}
+    assert db.stock_move_journal.docs == []
+
+
+def test_transfer_of_more_than_is_there_moves_nothing(db):
+    with pytest.raises(InsufficientStockError) as raised:
+        run(inventory.transfer(db, "p1", "w1", "w2", 6))
+    assert raised.value.available == 5
+    assert rows(db) == {"w1": 5}
+    assert db.stock_move_journal.docs == []
+
+
+def test_transfer_interrupted_after_the_debit_is_finished_on_resume(db):
+    fail_once(db.warehouse_stock, "update_one", lambda *args, **kwargs: kwargs.get("upsert"))
+    with pytest.raises(RuntimeError):
+        run(inventory.transfer(db, "p1", "w1", "w2", 3))
+    assert rows(db) == {"w1": 2}
+    for entry in db.stock_move_journal.docs:
+        entry["leaseUntil"] = datetime.now(timezone.utc) - timedelta(seconds=1)
+    assert run(stock_journal.resume_moves(db)) == {"p1"}
+    assert rows(db) == {"w1": 2, "w2": 3}
+    assert db.stock_move_journal.docs == []
+    assert not any(doc.get("moves") for doc in db.warehouse_stock.docs)
+
+
+def test_transfer_of_a_sharded_product_draws_from_its_shards(db):
+    db.warehouse_stock.docs[0]["quantity"] = 0
+    db.products.docs[0]["stockShards"] = 2
+    for shard, quantity in ((0, 2), (1, 3)):
+        db.stock_shards.docs.append({
+            "_id": f"p1-{shard}", "productId": "p1", "warehouseId": "w1", "shard": shard, "quantity": quantity
+        })
+    run(inventory.transfer(db, "p1", "w1", "w2", 4))
+    assert rows(db) == {"w1": 0, "w2": 4}
+    assert sum(doc["quantity"] for doc in db.stock_shards.docs) == 1
+
+
+def test_reconcile_resets_drifted_totals(db):
+    db.products.docs[0]["stock"]["quantity"] = 9
+    assert run(inventory.reconcile_totals(db)) == 1
+    assert total(db) == 5
+    assert db.products.docs[0]["stock"]["isLow"] is False
+    assert run(inventory.reconcile_totals(db)) == 0
+
+
+def test_reconcile_does_not_overwrite_a_sale_landing_in_between(db):
+    db.products.docs[0]["stock"]["quantity"] = 9
+    original = db.products.bulk_write
+    calls = []
+
+    async def racing_bulk_write(requests, ordered=True):
+        if not calls:
+            # A sale of one takes the row and the total after they were read
+            db.warehouse_stock.docs[0]["quantity"] -= 1
+            db.products.docs[0]["stock"]["quantity"] -= 1
+        calls.append(len(requests))
+        return await original(requests, ordered=ordered)
+
+    db.products.bulk_write = racing_bulk_write
+    assert run(inventory.reconcile_totals(db)) == 1
+    # Skipped once, then compared again against the new total
+    assert calls == [1, 1]
+    assert total(db) == 4
+
+
+def test_returned_quantity_is_split_over_the_sale_allocations():
+    allocations = [{"warehouseId": "w1", "quantity": 2}, {"warehouseId": "w2", "quantity": 3}]
+    assert inventory.returned_allocations(allocations, 4) == [
+        {"warehouseId": "w1", "quantity": 2}, {"warehouseId": "w2", "quantity": 2}
+    ]
+    # More than was sold (a correction) lands in the first warehouse
+    assert inventory.returned_allocations(allocations, 6) == [
+        {"warehouseId": "w1", "quantity": 3}, {"warehouseId": "w2", "quantity": 3}
+    ]
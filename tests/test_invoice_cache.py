@@ -0,0 +1,83 @@
+from datetime import datetime
+import os
+
+from utils.invoice_cache import InvoiceCache, invoice_digest
+
+
+def make_cache(tmp_path, max_bytes=1000):
+    return InvoiceCache(tmp_path / "invoices", max_bytes)
+
+
+def test_digest_ignores_sub_millisecond_precision():
+    written = datetime(2024, 5, 1, 10, 30, 0, 123456)
+    read_back = datetime(2024, 5, 1, 10, 30, 0, 123000)
+    assert invoice_digest("s1", written) == invoice_digest("s1", read_back)
+    assert invoice_digest("s1", written) != invoice_digest("s2", written)
+
+
+def test_read_returns_bytes_of_exact_revision(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.put("s1", "aaa", b"pdf-1")
+    assert cache.read("s1", "aaa") == b"pdf-1"
+    assert cache.read("s1", "bbb") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_evicts_least_recently_read(tmp_path):
+    cache = make_cache(tmp_path, max_bytes=10)
+    cache.put("s1", "a", b"12345")
+    cache.put("s2", "a", b"12345")
+    cache.read("s1", "a")
+    cache.put("s3", "a", b"12345")
+    assert cache.read("s2", "a") is None
+    assert cache.read("s1", "a") == b"12345"
+    assert cache.read("s3", "a") == b"12345"
+    assert cache.size == 10
+
+
+def test_oversized_entry_is_evicted_but_put_does_not_fail(tmp_path):
+    cache = make_cache(tmp_path, max_bytes=4)
+    cache.put("s1", "a", b"123456")
+    assert cache.read("s1", "a") is None
+    assert cache.size == 0
+
+
+def test_file_removed_by_another_process_is_a_miss(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.put("s1", "a", b"pdf")
+    (tmp_path / "invoices" / "s1_a.pdf").unlink()
+    assert cache.read("s1", "a") is None
+    assert cache.size == 0
+    assert cache.stats()["entries"] == 0
+
+
+def test_invalidate_drops_every_revision(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.put("s1", "a", b"one")
+    cache.put("s1", "b", b"two")
+    cache.put("s10", "a", b"other")
+    cache.invalidate("s1")
+    assert cache.read("s1", "a") is None
+    assert cache.read("s1", "b") is None
+    assert cache.read("s10", "a") == b"other"
+
+
+def test_reload_keeps_files_from_previous_process(tmp_path):
+    make_cache(tmp_path).put("s1", "a", b"pdf")
+    assert make_cache(tmp_path).read("s1", "a") == b"pdf"
+
+
+def test_read_of_a_file_evicted_after_it_was_opened_still_returns_it(tmp_path, monkeypatch):
+    cache = make_cache(tmp_path, max_bytes=10)
+    cache.put("s1", "a", b"12345")
+    real_open = open
+
+    def open_then_evict(path, mode="r", *args, **kwargs):
+        f = real_open(path, mode, *args, **kwargs)
+        # Evicted by another request between the open and the read
+        os.unlink(path)
+        return f
+
+    monkeypatch.setattr("builtins.open", open_then_evict)
+    assert cache.read("s1", "a") == b"12345"
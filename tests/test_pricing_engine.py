@@ -0,0 +1,112 @@
+import pytest
+
+from utils.pricing_engine import PriceTable, TOLERANCE
+
+
+def product(product_id, price, tax_rate=0):
+    return {"id": product_id, "pricing": {"sellingPrice": price, "taxRate": tax_rate}}
+
+
+@pytest.fixture
+def table():
+    table = PriceTable()
+    table.rebuild([product("p1", 100, 18), product("p2", 50), product("p3", 10, 5)])
+    return table
+
+
+def test_fixed_line_discount_comes_off_before_tax(table):
+    quote = table.quote([("p1", 2, 10, "fixed")])
+    line = quote["items"][0]
+    assert line["discountValue"] == 10
+    assert line["taxAmount"] == 34.2
+    assert line["lineTotal"] == 224.2
+    assert quote["subtotal"] == 200
+    assert quote["total"] == 224.2
+
+
+def test_percentage_line_discount(table):
+    line = table.quote([("p1", 2, 10, "percentage")])["items"][0]
+    assert line["discountValue"] == 20
+    assert line["taxAmount"] == 32.4
+    assert line["lineTotal"] == 212.4
+
+
+def test_cart_discount_applies_to_discounted_subtotal(table):
+    lines = [("p1", 2, 10, "fixed"), ("p2", 1, 0, None)]
+    percentage = table.quote(lines, "percentage", 10)
+    assert percentage["discountAmount"] == 24
+    assert percentage["total"] == 240 - 24 + 34.2
+    fixed = table.quote(lines, "fixed", 15)
+    assert fixed["discountAmount"] == 15
+    assert fixed["total"] == 240 - 15 + 34.2
+
+
+def test_unknown_products_are_reported_not_priced(table):
+    quote = table.quote([("p1", 1, 0, None), ("nope", 3, 0, None)])
+    assert quote["missing"] == ["nope"]
+    assert [item["productId"] for item in quote["items"]] == ["p1"]
+
+
+def test_set_updates_in_place_and_remove_frees_the_slot(table):
+    table.set(product("p2", 55))
+    assert table.price("p2") == 55
+    table.remove("p2")
+    assert table.price("p2") is None
+    table.set(product("p4", 7))
+    assert table.price("p4") == 7
+    assert len(table) == 3
+    # Products without pricing are skipped
+    table.set({"id": "p5"})
+    assert table.price("p5") is None
+
+
+def sale_line(product_id, quantity, unit_price, tax_amount, line_total, discount=0, discount_type="fixed"):
+    return {
+        "productId": product_id, "sku": product_id.upper(), "quantity": quantity,
+        "unitPrice": unit_price, "discount": discount, "discountType": discount_type,
+        "taxAmount": tax_amount, "lineTotal": line_total,
+    }
+
+
+def test_check_sale_accepts_matching_amounts(table):
+    sale = {
+        "items": [sale_line("p1", 2, 100, 34.2, 224.2, discount=10), sale_line("p3", 1, 10, 0.5, 10.5)],
+        "subtotal": 210, "discountAmount": 5, "taxAmount": 34.7, "total": 229.7,
+    }
+    assert table.check_sale(sale) == []
+
+
+def test_check_sale_reports_stale_client_price(table):
+    sale = {
+        "items": [sale_line("p1", 1, 90, 16.2, 106.2)],
+        "subtotal": 90, "discountAmount": 0, "taxAmount": 16.2, "total": 106.2,
+    }
+    problems = table.check_sale(sale)
+    assert any(problem.startswith("P1: unitPrice 90") for problem in problems)
+    assert any(problem.startswith("total 106.2") for problem in problems)
+
+
+def test_check_sale_allows_rounding_within_tolerance(table):
+    sale = {
+        "items": [sale_line("p1", 1, 100, 18 + TOLERANCE / 2, 118)],
+        "subtotal": 100, "discountAmount": 0, "taxAmount": 18, "total": 118 + TOLERANCE / 2,
+    }
+    assert table.check_sale(sale) == []
+
+
+def test_check_sale_compares_repeated_product_lines_in_order(table):
+    sale = {
+        "items": [
+            sale_line("p2", 1, 50, 0, 50),
+            sale_line("p2", 2, 50, 0, 90, discount=10),
+        ],
+        "subtotal": 150, "discountAmount": 0, "taxAmount": 0, "total": 140,
+    }
+    assert table.check_sale(sale) == []
+    sale["items"][1]["lineTotal"] = 100
+    assert table.check_sale(sale) == ["P2: lineTotal 100 does not match 90.0"]
+
+
+def test_check_sale_reports_unpriced_products(table):
+    sale = {"items": [sale_line("zz", 1, 5, 0, 5)], "subtotal": 5, "taxAmount": 0, "total": 5}
+    assert table.check_sale(sale) == ["Product zz has no price"]
@@ -0,0 +1,148 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+from models.sale import SaleBatch, SaleBatchItem, SaleCreate
+from utils.write_behind import WriteBehind
+from tests.fakes import FakeDB, fail_once
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def sales(monkeypatch):
+    from routes import sales
+    from utils.inventory import invalidate_warehouses
+    from utils.stock_shards import shard_registry
+
+    db = FakeDB()
+    monkeypatch.setattr(sales, "db", db)
+    # Its queue events belong to the loop it was first started in
+    monkeypatch.setattr(sales, "transaction_writer", WriteBehind("transactions", mode="ack"))
+    monkeypatch.setattr(sales, "VALIDATION_MODE", "off")
+    monkeypatch.setattr(sales, "_seeded_counters", set())
+    invalidate_warehouses()
+    shard_registry.invalidate()
+    db.warehouses.docs.append({"_id": "w1", "id": "w1", "code": "MAIN", "isDefault": True, "isActive": True})
+    for product_id in ("p1", "p2"):
+        db.products.docs.append({
+            "_id": product_id, "id": product_id, "name": product_id.upper(),
+            "stock": {"quantity": 5, "reorderPoint": 0},
+        })
+        db.warehouse_stock.docs.append({"_id": product_id, "productId": product_id, "warehouseId": "w1", "quantity": 5})
+    return sales
+
+
+def today():
+    return datetime.now().strftime("%Y%m%d")
+
+
+def sale_request(sales, *lines, client_id=None):
+    items = [
+        {"productId": pid, "productName": pid, "sku": pid, "quantity": quantity, "unitPrice": 1, "lineTotal": quantity}
+        for pid, quantity in lines
+    ]
+    fields = {"items": items, "subtotal": 1, "total": 1, "paymentMode": "cash", "paymentStatus": "paid"}
+    if client_id:
+        return SaleBatchItem(clientSaleId=client_id, **fields)
+    return SaleCreate(**fields)
+
+
+def row(sales, product_id):
+    return next(doc["quantity"] for doc in sales.db.warehouse_stock.docs if doc["productId"] == product_id)
+
+
+def test_counter_starts_after_invoices_numbered_before_it(sales):
+    sales.db.sales.docs.append({"_id": "old", "invoiceNumber": f"INV-{today()}-0041"})
+    numbers = run(sales.allocate_invoice_numbers(3))
+    assert numbers == [f"INV-{today()}-{n:04d}" for n in (42, 43, 44)]
+
+
+def test_workers_seeding_at_once_get_disjoint_blocks(sales):
+    sales.db.sales.docs.append({"_id": "old", "invoiceNumber": f"INV-{today()}-0007"})
+
+    async def worker(count):
+        # Each worker process starts with nothing seeded
+        sales._seeded_counters.clear()
+        return await sales.allocate_invoice_numbers(count)
+
+    async def scenario():
+        return await asyncio.gather(worker(2), worker(3), worker(1))
+
+    blocks = run(scenario())
+    numbers = [number for block in blocks for number in block]
+    assert sorted(numbers) == [f"INV-{today()}-{n:04d}" for n in range(8, 14)]
+
+
+def test_rejected_sale_does_not_use_an_invoice_number(sales):
+    with pytest.raises(HTTPException) as error:
+        run(sales.record_sale(sale_request(sales, ("p1", 9)), {"id": "u1"}))
+    assert error.value.status_code == 400
+    assert sales.db.counters.docs == []
+    sales.db.counters.docs.clear()
+
+    async def scenario():
+        await sales.transaction_writer.start(sales.db.transactions)
+        try:
+            return await sales.record_sale(sale_request(sales, ("p1", 1)), {"id": "u1"})
+        finally:
+            await sales.transaction_writer.drain()
+
+    assert run(scenario()).invoiceNumber == f"INV-{today()}-0001"
+
+
+def test_failed_sale_insert_puts_the_stock_back(sales):
+    fail_once(sales.db.sales, "insert_one")
+    with pytest.raises(RuntimeError):
+        run(sales.record_sale(sale_request(sales, ("p1", 2)), {"id": "u1"}))
+    assert row(sales, "p1") == 5
+    assert sales.db.products.docs[0]["stock"]["quantity"] == 5
+
+
+def test_batch_rejects_only_orders_that_lost_a_row_to_a_concurrent_sale(sales):
+    from utils.inventory import allocate_batch
+    from utils.stock_ledger import reason
+
+    db = sales.db
+    original = db.warehouse_stock.bulk_write
+
+    async def racing_bulk_write(requests, ordered=True):
+        # Another checkout takes 4 of p1 between the read and the write
+        db.warehouse_stock.docs[0]["quantity"] = 1
+        db.warehouse_stock.bulk_write = original
+        return await original(requests, ordered=ordered)
+
+    db.warehouse_stock.bulk_write = racing_bulk_write
+    orders = [
+        [{"productId": "p1", "quantity": 3}, {"productId": "p2", "quantity": 1}],
+        [{"productId": "p2", "quantity": 1}],
+    ]
+    results = run(allocate_batch(db, orders, [reason("sale", "a"), reason("sale", "b")]))
+    assert results[0].product_id == "p1" and results[0].available == 1
+    assert results[1] is None
+    # The rejected order's share of p2 went back; only the second order's unit is gone
+    assert row(sales, "p1") == 1 and row(sales, "p2") == 4
+    assert all(not doc.get("batchIds") for doc in db.warehouse_stock.docs)
+    assert orders[1][0]["allocations"] == [{"warehouseId": "w1", "quantity": 1}]
+
+
+def test_batch_reports_repeated_client_ids_once(sales):
+    batch = SaleBatch(sales=[
+        sale_request(sales, ("p1", 1), client_id="c1"),
+        sale_request(sales, ("p1", 1), client_id="c1"),
+        sale_request(sales, ("p2", 1), client_id="c2"),
+    ])
+    response = run(sales.create_sales_batch(batch, {"id": "u1"}))
+    statuses = [(result["clientSaleId"], result["status"]) for result in response["results"]]
+    assert statuses == [("c1", "created"), ("c1", "duplicate"), ("c2", "created")]
+    assert response["results"][0]["invoiceNumber"] == response["results"][1]["invoiceNumber"]
+    assert row(sales, "p1") == 4
+    assert len(sales.db.sales.docs) == 2
+
+    again = run(sales.create_sales_batch(batch, {"id": "u1"}))
+    assert [result["status"] for result in again["results"]] == ["duplicate"] * 3
+    assert row(sales, "p1") == 4
@@ -0,0 +1,79 @@
+from utils import search_index
+from utils.search_index import ProductSearchIndex
+
+
+def product(product_id, name, sku, category="General", brand=None):
+    return {"id": product_id, "name": name, "sku": sku, "category": category, "brand": brand}
+
+
+def build(products):
+    index = ProductSearchIndex()
+    index.rebuild(products)
+    return index
+
+
+def test_ranks_sku_exact_then_prefix_then_name():
+    index = build([
+        product("1", "Shampoo Basic", "SH-100"),
+        product("2", "Shoe Polish", "SP-1"),
+        product("3", "Washing Powder", "SH"),
+        product("4", "Fresh Shower Gel", "FG-2"),
+    ])
+    assert index.search("sh") == ["3", "1", "2", "4"]
+
+
+def test_every_token_must_prefix_a_word():
+    index = build([
+        product("1", "Red Apple Juice", "J1"),
+        product("2", "Red Grape Juice", "J2"),
+        product("3", "Apple Pie", "P1"),
+    ])
+    assert index.search("red app") == ["1"]
+    assert sorted(index.search("juice")) == ["1", "2"]
+
+
+def test_substring_matches_rank_last():
+    index = build([
+        product("1", "Notebook", "NB-1"),
+        product("2", "Reading Lamp", "EB-1"),
+        product("3", "Large Book Stand", "BS-1"),
+    ])
+    assert index.search("book") == ["3", "1"]
+
+
+def test_filters_apply_before_any_cut(monkeypatch):
+    # Many broad matches outside the category must not hide the ones inside
+    monkeypatch.setattr(search_index, "BROAD_QUERY_LIMIT", 50)
+    products = [product(str(i), f"Shirt {i}", f"A{i}", category="Clothing") for i in range(40)]
+    products += [product("x1", "Sharpener", "S-1", category="Stationery"),
+                 product("x2", "Shelf Label", "S-2", category="Stationery")]
+    index = build(products)
+    assert index.search("sh", category="Stationery") == ["x1", "x2"]
+    assert index.search("sh", category="Stationery", limit=1) == ["x1"]
+
+
+def test_pages_are_stable():
+    index = build([product(str(i), f"Shirt {i:02d}", f"C{i}") for i in range(30)])
+    full = index.search("shirt")
+    pages = [index.search("shirt", limit=end)[end - 10:end] for end in (10, 20, 30)]
+    assert sum(pages, []) == full
+    assert index.search("shirt") == full
+
+
+def test_too_broad_query_defers_to_database(monkeypatch):
+    monkeypatch.setattr(search_index, "BROAD_QUERY_LIMIT", 5)
+    index = build([product(str(i), f"Soap {i}", f"S{i}") for i in range(10)])
+    assert index.search("s") is None
+    # A selective second token keeps the query in memory
+    assert index.search("soap 3") == ["3"]
+    assert index.search("s3") == ["3"]
+
+
+def test_remove_and_reindex():
+    index = build([product("1", "Green Tea", "T1")])
+    index.add(product("1", "Black Coffee", "C1"))
+    assert index.search("green") == []
+    assert index.search("coffee") == ["1"]
+    index.remove("1")
+    assert index.search("coffee") == []
+    assert len(index) == 0
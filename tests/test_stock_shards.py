@@ -0,0 +1,189 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from utils import stock_journal, stock_shards
+from tests.fakes import FakeDB, fail_once
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def seed_shards(db, levels, product_id="p1", warehouse_id="w1"):
+    for shard, quantity in levels.items():
+        db.stock_shards.docs.append({
+            "_id": f"{product_id}-{warehouse_id}-{shard}", "productId": product_id,
+            "warehouseId": warehouse_id, "shard": shard, "quantity": quantity
+        })
+
+
+def levels(db, product_id="p1"):
+    return {doc["shard"]: doc["quantity"] for doc in db.stock_shards.docs if doc["productId"] == product_id}
+
+
+def on_hand(db, product_id="p1"):
+    rows = sum(doc["quantity"] for doc in db.warehouse_stock.docs if doc["productId"] == product_id)
+    return rows + sum(levels(db, product_id).values())
+
+
+def test_take_drains_several_shards_when_none_holds_enough():
+    db = FakeDB()
+    seed_shards(db, {0: 3, 1: 2, 2: 1})
+    assert run(stock_shards.take(db, "p1", "w1", 4, 3))
+    assert sum(levels(db).values()) == 2
+    assert levels(db)[0] == 0
+
+
+def test_take_is_all_or_nothing_when_stock_is_short():
+    db = FakeDB()
+    seed_shards(db, {0: 3, 1: 2})
+    assert not run(stock_shards.take(db, "p1", "w1", 6, 2))
+    assert levels(db) == {0: 3, 1: 2}
+
+
+def test_take_rolls_back_when_a_concurrent_sale_wins_a_shard():
+    db = FakeDB()
+    seed_shards(db, {0: 3, 1: 2})
+    original = db.stock_shards.update_one
+
+    async def racing_update(query, update, upsert=False):
+        if query.get("shard") == 1 and update["$inc"]["quantity"] < 0:
+            # Another checkout empties shard 1 between our read and our write
+            db.stock_shards.docs[1]["quantity"] = 0
+        return await original(query, update, upsert=upsert)
+
+    db.stock_shards.update_one = racing_update
+    assert not run(stock_shards.take(db, "p1", "w1", 5, 2))
+    # Shard 0's part is given back; shard 1 went to the other sale
+    assert levels(db) == {0: 3, 1: 0}
+
+
+def test_rebalance_after_lowering_shard_count_empties_and_drops_extra_shards():
+    db = FakeDB()
+    seed_shards(db, {0: 5, 1: 5, 2: 5, 3: 5})
+    run(stock_shards._rebalance(db, "p1", 2))
+    assert levels(db) == {0: 10, 1: 10}
+
+
+def test_rebalance_evens_out_skewed_shards():
+    db = FakeDB()
+    seed_shards(db, {0: 12, 1: 0, 2: 0})
+    run(stock_shards._rebalance(db, "p1", 3))
+    assert levels(db) == {0: 4, 1: 4, 2: 4}
+
+
+def test_rows_into_shards_moves_the_whole_row():
+    db = FakeDB()
+    db.warehouse_stock.docs.append({"_id": "r1", "productId": "p1", "warehouseId": "w1", "quantity": 10})
+    run(stock_shards._rows_into_shards(db, "p1", 4))
+    assert on_hand(db) == 10
+    assert db.warehouse_stock.docs[0]["quantity"] == 0
+    assert db.stock_move_journal.docs == []
+    assert all(not doc.get("moves") for doc in db.stock_shards.docs + db.warehouse_stock.docs)
+
+
+def expire_moves(db):
+    for move in db.stock_move_journal.docs:
+        move["leaseUntil"] = datetime.now(timezone.utc) - timedelta(seconds=1)
+
+
+def test_move_interrupted_after_debit_is_finished_on_resume():
+    db = FakeDB()
+    db.warehouse_stock.docs.append({"_id": "r1", "productId": "p1", "warehouseId": "w1", "quantity": 10})
+    fail_once(db.stock_shards, "update_one", lambda *args, **kwargs: kwargs.get("upsert"))
+    try:
+        run(stock_shards._rows_into_shards(db, "p1", 2))
+    except RuntimeError:
+        pass
+    assert on_hand(db) == 0
+    assert len(db.stock_move_journal.docs) == 1
+
+    # A live lease keeps other workers off the move
+    run(stock_journal.resume_moves(db))
+    assert on_hand(db) == 0
+
+    expire_moves(db)
+    run(stock_journal.resume_moves(db))
+    assert on_hand(db) == 10
+    assert db.stock_move_journal.docs == []
+    assert all(not doc.get("moves") for doc in db.stock_shards.docs + db.warehouse_stock.docs)
+
+
+def test_move_interrupted_before_debit_is_dropped_on_resume():
+    db = FakeDB()
+    db.warehouse_stock.docs.append({"_id": "r1", "productId": "p1", "warehouseId": "w1", "quantity": 10})
+    fail_once(db.warehouse_stock, "update_one")
+    try:
+        run(stock_shards._rows_into_shards(db, "p1", 2))
+    except RuntimeError:
+        pass
+    # The stock sells down before the move is resumed
+    db.warehouse_stock.docs[0]["quantity"] = 7
+    expire_moves(db)
+    run(stock_journal.resume_moves(db))
+    assert db.warehouse_stock.docs[0]["quantity"] == 7
+    assert levels(db) == {}
+    assert db.stock_move_journal.docs == []
+
+
+def test_finishing_a_move_twice_moves_the_stock_once():
+    db = FakeDB()
+    seed_shards(db, {0: 6})
+
+    async def scenario():
+        await stock_shards._move(db, "p1", "w1", 6, {"shard": 0}, {})
+        move = {
+            "_id": "again", "productId": "p1", "quantity": 4,
+            "from": {"warehouseId": "w1"}, "to": {"warehouseId": "w1", "shard": 1}
+        }
+        await db.stock_move_journal.insert_one(dict(move))
+        fail_once(db.stock_move_journal, "delete_one")
+        try:
+            await stock_journal.finish_move(db, move)
+        except RuntimeError:
+            pass
+        await stock_journal.finish_move(db, move)
+
+    run(scenario())
+    assert on_hand(db) == 6
+    assert levels(db) == {0: 0, 1: 4}
+    assert db.warehouse_stock.docs[0]["quantity"] == 2
+
+
+def test_rebalance_interrupted_mid_move_loses_no_stock():
+    db = FakeDB()
+    seed_shards(db, {0: 12, 1: 0, 2: 0})
+    fail_once(db.stock_shards, "update_one", lambda *args, **kwargs: kwargs.get("upsert"))
+    try:
+        run(stock_shards._rebalance(db, "p1", 3))
+    except RuntimeError:
+        pass
+    assert len(db.stock_move_journal.docs) == 1
+    expire_moves(db)
+    run(stock_journal.resume_moves(db))
+    assert on_hand(db) == 12
+    run(stock_shards._rebalance(db, "p1", 3))
+    assert levels(db) == {0: 4, 1: 4, 2: 4}
+
+
+def test_only_one_worker_maintains_a_product_at_a_time():
+    db = FakeDB()
+    seed_shards(db, {0: 12, 1: 0, 2: 0})
+    db.products.docs.append({"_id": "p1", "id": "p1", "stock": {"quantity": 12}})
+    gate = asyncio.Event()
+
+    async def scenario():
+        async def held():
+            await gate.wait()
+
+        first = asyncio.create_task(stock_shards._leased(db, "p1", held))
+        await asyncio.sleep(0)
+        assert not await stock_shards.maintain(db, "p1", 3)
+        assert levels(db) == {0: 12, 1: 0, 2: 0}
+        gate.set()
+        assert await first
+        # Released on completion, so the next run goes ahead
+        assert await stock_shards.maintain(db, "p1", 3)
+
+    run(scenario())
+    assert levels(db) == {0: 4, 1: 4, 2: 4}
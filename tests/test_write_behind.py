@@ -0,0 +1,94 @@
+import asyncio
+import fcntl
+import os
+
+import pytest
+from bson import ObjectId, json_util
+
+from tests.fakes import FakeDB
+from utils.write_behind import WriteBehind
+
+
+def spill_file(path, docs):
+    path.write_text("".join(json_util.dumps(doc) + "\n" for doc in docs), encoding="utf-8")
+
+
+def test_ack_mode_groups_concurrent_writes_into_batches():
+    async def scenario():
+        db = FakeDB()
+        writer = WriteBehind("tx", mode="ack", flush_ms=5, max_batch=50)
+        await writer.start(db.transactions)
+        await asyncio.gather(*(writer.write({"id": str(i)}) for i in range(120)))
+        await writer.drain()
+        return db, writer
+
+    db, writer = asyncio.run(scenario())
+    assert len(db.transactions.docs) == 120
+    assert writer.written == 120
+    assert writer.batches < 120
+
+
+def test_write_requires_start():
+    writer = WriteBehind("tx", mode="ack")
+    with pytest.raises(RuntimeError):
+        asyncio.run(writer.write({"id": "1"}))
+
+
+def test_spill_file_is_per_process_and_removed_on_drain(tmp_path):
+    base = tmp_path / "tx.ndjson"
+
+    async def scenario():
+        db = FakeDB()
+        writer = WriteBehind("tx", mode="spill", flush_ms=5, spill_path=base)
+        await writer.start(db.transactions)
+        assert writer.spill_path == tmp_path / f"tx.{os.getpid()}.ndjson"
+        await writer.write({"id": "a"})
+        # Spilled before it is flushed
+        assert "\"a\"" in writer.spill_path.read_text()
+        await writer.drain()
+        return db, writer
+
+    db, writer = asyncio.run(scenario())
+    assert [doc["id"] for doc in db.transactions.docs] == ["a"]
+    assert not writer.spill_path.exists()
+
+
+def test_start_replays_every_abandoned_spill_file(tmp_path):
+    base = tmp_path / "tx.ndjson"
+    flushed = {"_id": ObjectId(), "id": "flushed"}
+    spill_file(tmp_path / "tx.111.ndjson", [{"_id": ObjectId(), "id": "a"}, flushed])
+    spill_file(tmp_path / "tx.222.ndjson", [{"_id": ObjectId(), "id": "b"}])
+    # Shared file from before spill files were per process
+    spill_file(base, [{"_id": ObjectId(), "id": "legacy"}])
+
+    async def scenario():
+        db = FakeDB()
+        await db.transactions.insert_one(dict(flushed))
+        writer = WriteBehind("tx", mode="spill", spill_path=base)
+        await writer.start(db.transactions)
+        await writer.drain()
+        return db, writer
+
+    db, writer = asyncio.run(scenario())
+    assert sorted(doc["id"] for doc in db.transactions.docs) == ["a", "b", "flushed", "legacy"]
+    assert writer.replayed == 4
+    assert list(tmp_path.glob("*.ndjson")) == []
+
+
+def test_start_leaves_files_of_running_processes_alone(tmp_path):
+    base = tmp_path / "tx.ndjson"
+    live = tmp_path / "tx.333.ndjson"
+    spill_file(live, [{"_id": ObjectId(), "id": "in-flight"}])
+
+    async def scenario():
+        db = FakeDB()
+        writer = WriteBehind("tx", mode="spill", spill_path=base)
+        await writer.start(db.transactions)
+        await writer.drain()
+        return db
+
+    with open(live) as held:
+        fcntl.flock(held, fcntl.LOCK_EX)
+        db = asyncio.run(scenario())
+    assert db.transactions.docs == []
+    assert live.exists()